@@ -1,5 +1,17 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.db import transaction
+from .models import (
+    User, Team, TeamMembership, Activity, ActivityRollup, Leaderboard, Task, Workout, WorkoutExercise,
+)
+from .changes import (
+    ACTIVITIES, LEADERBOARD, TEAMS, USERS, record_changes, record_email_change, record_team_members,
+    record_user_deleted,
+)
+from .caching import invalidate
+from .leaderboard import record_activity_batch, record_activity_change
+from .rollups import move_team_rollups, record_rollup_batch, record_rollup_change, remove_user_rollups
+from .search import WORKOUT, get_index
+from .workouts import workout_deleted, workout_saved
 
 
 @admin.register(User)
@@ -8,31 +20,175 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ('name', 'email')
     ordering = ('name',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        record_changes(USERS, [obj.pk])
+        if change and 'email' in form.changed_data:
+            record_email_change(obj.pk)
+
+    def delete_model(self, request, obj):
+        record_user_deleted(obj.pk)
+        remove_user_rollups([obj.pk])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+        for pk in pks:
+            record_user_deleted(pk)
+        remove_user_rollups(pks)
+        super().delete_queryset(request, queryset)
+
+
+class TeamMembershipInline(admin.TabularInline):
+    model = TeamMembership
+    autocomplete_fields = ('user',)
+    extra = 0
+
 
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
     ordering = ('name',)
+    inlines = (TeamMembershipInline,)
+
+    def save_related(self, request, form, formsets, change):
+        team = form.instance
+        members_before = set(TeamMembership.objects.filter(team=team).values_list('user_id', flat=True))
+        super().save_related(request, form, formsets, change)
+        # No other team changes: a user on another team can't be added
+        # here, memberships are unique per user
+        members = set(TeamMembership.objects.filter(team=team).values_list('user_id', flat=True))
+        moves = {user_id: (team.pk, None) for user_id in members_before - members}
+        moves.update((user_id, (None, team.pk)) for user_id in members - members_before)
+        move_team_rollups(moves)
+        record_changes(TEAMS, [team.pk])
+        record_changes(USERS, members_before)
+        record_team_members(team.pk)
+
+    def delete_model(self, request, obj):
+        record_team_members(obj.pk)
+        record_changes(TEAMS, [obj.pk], deleted=True)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for pk in queryset.values_list('pk', flat=True):
+            record_team_members(pk)
+            record_changes(TEAMS, [pk], deleted=True)
+        super().delete_queryset(request, queryset)
 
 
 @admin.register(Activity)
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('user', 'activity_type', 'duration', 'date')
-    search_fields = ('user', 'activity_type')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    search_fields = ('user__email', 'activity_type')
     list_filter = ('activity_type', 'date')
     ordering = ('-date',)
 
+    # Admin writes apply the same score and rollup deltas as the API, in the
+    # write's transaction
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        before = Activity.objects.filter(pk=obj.pk).first() if change else None
+        super().save_model(request, obj, form, change)
+        record_changes(ACTIVITIES, [obj.pk])
+        record_activity_change(before=before, after=obj)
+        record_rollup_change(before=before, after=obj)
+        transaction.on_commit(lambda: invalidate('activities'))
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        record_changes(ACTIVITIES, [obj.pk], deleted=True)
+        record_activity_change(before=obj)
+        record_rollup_change(before=obj)
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: invalidate('activities'))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        activities = list(queryset.only('id', 'user_id', 'duration', 'date'))
+        record_changes(ACTIVITIES, [activity.pk for activity in activities], deleted=True)
+        record_activity_batch(activities, deleted=True)
+        record_rollup_batch(activities, deleted=True)
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: invalidate('activities'))
+
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('period', 'period_start', 'user', 'team', 'total_duration', 'activity_count')
+    list_select_related = ('user', 'team')
+    list_filter = ('period',)
+    ordering = ('-period_start',)
+
 
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
     list_display = ('user', 'score')
-    search_fields = ('user',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    search_fields = ('user__email',)
     ordering = ('-score',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        record_changes(LEADERBOARD, [obj.pk])
+
+    def delete_model(self, request, obj):
+        record_changes(LEADERBOARD, [obj.pk], deleted=True)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        record_changes(LEADERBOARD, queryset.values_list('pk', flat=True), deleted=True)
+        super().delete_queryset(request, queryset)
+
+
+class WorkoutExerciseInline(admin.TabularInline):
+    model = WorkoutExercise
+    fields = ('position', 'name', 'sets', 'reps', 'duration_seconds')
+    extra = 0
+
 
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
     search_fields = ('name',)
     ordering = ('name',)
+    inlines = (WorkoutExerciseInline,)
+    # Matches from the search index, not an unindexed icontains scan
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        ids = [
+            payload['id']
+            for _, _, payload in get_index().search(search_term, kind=WORKOUT, limit=self.search_limit)
+        ]
+        return queryset.filter(pk__in=ids), False
+
+    def save_related(self, request, form, formsets, change):
+        # Runs after the exercise inlines are saved
+        super().save_related(request, form, formsets, change)
+        workout_saved(form.instance)
+
+    def delete_model(self, request, obj):
+        pk = obj.pk
+        super().delete_model(request, obj)
+        workout_deleted(pk)
+
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+        super().delete_queryset(request, queryset)
+        for pk in pks:
+            workout_deleted(pk)
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key', 'status', 'run_at', 'attempts', 'coalesced', 'worker')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key')
+    ordering = ('run_at',)
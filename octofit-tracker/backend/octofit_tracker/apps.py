@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Before djongo opens its client on the first query
+        from .mongo_pool import register_pool_listener
+        register_pool_listener()
+
+        from . import metrics, tasks, taskqueue  # noqa: F401 - tasks registers the task functions
+        metrics.register_collector(taskqueue.collect_queue_metrics)
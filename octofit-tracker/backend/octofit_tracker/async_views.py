@@ -0,0 +1,101 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+from .renderers import JSONRenderer
+from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+
+
+class AsyncReadView(View):
+    """
+    Async list and detail reads for a viewset's resource.
+
+    Rows are fetched with the async ORM so an ASGI worker keeps serving other
+    requests while a query is in flight. Queryset, serializer, ordering and
+    pagination come from ``viewset``, so responses match the sync endpoint
+    byte for byte (minus the response cache). Writes stay on the viewset.
+    """
+    http_method_names = ['get', 'options']
+    viewset = None
+    renderer = JSONRenderer()
+
+    @property
+    def ordering(self):
+        # Read by the paginator
+        return self.viewset.ordering
+
+    def get_queryset(self):
+        return self.viewset.queryset.all()
+
+    def filter_list(self, queryset, query_params):
+        """Hook for list filters; returns the queryset and the serializer's ``fields``."""
+        return queryset, None
+
+    def get_serializer(self, *args, fields=None, **kwargs):
+        if fields:
+            kwargs['fields'] = fields
+        return self.viewset.serializer_class(*args, **kwargs)
+
+    async def get(self, request, pk=None):
+        request = Request(request)
+        try:
+            data = await (self.list(request) if pk is None else self.retrieve(request, pk))
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return self.render(detail, exc.status_code)
+        return self.render(data)
+
+    async def list(self, request):
+        queryset, fields = self.filter_list(self.get_queryset(), request.query_params)
+        paginator = self.viewset.pagination_class()
+        page = paginator.take_page([obj async for obj in paginator.page_queryset(queryset, request, self)])
+        return paginator.get_paginated_response(self.get_serializer(page, many=True, fields=fields).data).data
+
+    async def retrieve(self, request, pk):
+        queryset = self.get_queryset()
+        try:
+            obj = await queryset.aget(pk=pk)
+        except (queryset.model.DoesNotExist, ValueError, DjangoValidationError):
+            raise NotFound()
+        return self.get_serializer(obj).data
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type='application/json')
+
+
+class AsyncUserView(AsyncReadView):
+    viewset = UserViewSet
+
+
+class AsyncTeamView(AsyncReadView):
+    viewset = TeamViewSet
+
+
+class AsyncActivityView(AsyncReadView):
+    viewset = ActivityViewSet
+
+    def filter_list(self, queryset, query_params):
+        return ActivityViewSet.filter_list(queryset, query_params)
+
+
+class AsyncLeaderboardView(AsyncReadView):
+    viewset = LeaderboardViewSet
+
+
+class AsyncWorkoutView(AsyncReadView):
+    viewset = WorkoutViewSet
+
+    def filter_list(self, queryset, query_params):
+        return WorkoutViewSet.filter_list(queryset, query_params)
+
+
+# URL prefix under /api/async/ -> view
+ASYNC_READ_VIEWS = {
+    'users': AsyncUserView,
+    'teams': AsyncTeamView,
+    'activities': AsyncActivityView,
+    'leaderboard': AsyncLeaderboardView,
+    'workouts': AsyncWorkoutView,
+}
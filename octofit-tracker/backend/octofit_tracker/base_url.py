@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+
+
+def base_url(request=None):
+    """
+    Scheme and host for absolute links in API responses.
+
+    A request forwarded by a proxy with ``X-Forwarded-Host`` gets that host,
+    if ``OCTOFIT_FORWARDED_HOSTS`` allows it, and the scheme the proxy
+    reported; a forwarded host that isn't allowed gets
+    ``settings.OCTOFIT_BASE_URL`` (worked out once at startup) instead of
+    being echoed back. Any other request links to the host it reached us on,
+    so links work from wherever the client is.
+    """
+    if request is None:
+        return settings.OCTOFIT_BASE_URL
+    if 'X-Forwarded-Host' in request.headers:
+        forwarded = request.headers['X-Forwarded-Host'].split(',')[0].strip()
+        domain, _ = split_domain_port(forwarded)
+        if domain and validate_host(domain, settings.OCTOFIT_FORWARDED_HOSTS):
+            return f'{request.scheme}://{forwarded}'
+        return settings.OCTOFIT_BASE_URL
+    return request.build_absolute_uri('/').rstrip('/')
+
+
+def absolute_url(request, path):
+    """``path`` (e.g. ``request.get_full_path()``) on the :func:`base_url`."""
+    return base_url(request) + path
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+from . import metrics
+
+API_CACHE = 'api'
+
+# Resources whose cached responses a write to the key resource can change,
+# e.g. user emails appear in team member lists and activity rows.
+CACHE_DEPENDENTS = {
+    'users': ('users', 'teams', 'activities', 'leaderboard', 'stats'),
+    'teams': ('teams', 'users', 'leaderboard', 'stats'),
+    'activities': ('activities', 'leaderboard', 'stats'),
+    'leaderboard': ('leaderboard',),
+    'stats': ('stats',),
+    'workouts': ('workouts',),
+}
+
+metrics.describe('octofit_cache_hits_total', 'API responses served from the response cache.')
+metrics.describe('octofit_cache_misses_total', 'API responses built because no cached copy existed.')
+metrics.describe('octofit_cache_not_modified_total', 'Conditional requests answered with 304 Not Modified.')
+metrics.describe('octofit_cache_invalidations_total', 'Cache generations bumped by writes.')
+
+
+def _generation_key(resource):
+    return f'generation:{resource}'
+
+
+def _generation(resource):
+    # Seeded from the clock so a generation lost to eviction never comes
+    # back with a value old entries were stored under.
+    return caches[API_CACHE].get_or_set(_generation_key(resource), time.time_ns, None)
+
+
+def invalidate(resource):
+    """Drop every cached response of ``resource`` and of the resources it feeds."""
+    cache = caches[API_CACHE]
+    for dependent in CACHE_DEPENDENTS.get(resource, (resource,)):
+        try:
+            cache.incr(_generation_key(dependent))
+        except ValueError:
+            cache.set(_generation_key(dependent), time.time_ns(), None)
+        metrics.inc('octofit_cache_invalidations_total', resource=dependent)
+
+
+def invalidate_all():
+    for resource in CACHE_DEPENDENTS:
+        invalidate(resource)
+
+
+def etag_for(data):
+    payload = json.dumps(data, sort_keys=True, default=str, separators=(',', ':'))
+    return '"%s"' % hashlib.md5(payload.encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+
+def conditional_response(request, data, etag, response=None):
+    """``data`` with an ETag, or an empty 304 when the client already holds it."""
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        metrics.inc('octofit_cache_not_modified_total', resource=getattr(request, 'cache_resource', 'root'))
+    elif response is None:
+        response = Response(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Response cache for read-heavy viewsets.
+
+    ``list`` and ``retrieve`` responses are cached per absolute URL under the
+    viewset's ``cache_resource`` and carry an ETag, so repeat requests with
+    ``If-None-Match`` get a 304. ``create``/``update``/``destroy`` through
+    the viewset invalidate the resource and its dependents; writes made
+    elsewhere (admin, shell) only show up once ``OCTOFIT_API_CACHE_TIMEOUT``
+    expires the entry.
+    """
+    cache_resource = None
+
+    def cached_response(self, request, build):
+        resource = self.cache_resource
+        request.cache_resource = resource
+        url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        key = f'response:{resource}:{_generation(resource)}:{url}'
+        cache = caches[API_CACHE]
+        entry = cache.get(key)
+        if entry is not None:
+            metrics.inc('octofit_cache_hits_total', resource=resource)
+            return conditional_response(request, *entry)
+
+        metrics.inc('octofit_cache_misses_total', resource=resource)
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        etag = etag_for(response.data)
+        cache.set(key, (response.data, etag), settings.OCTOFIT_API_CACHE_TIMEOUT)
+        return conditional_response(request, response.data, etag, response)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    def invalidate_cache(self):
+        invalidate(self.cache_resource)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        self.invalidate_cache()
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        self.invalidate_cache()
+        return response
+
+    def destroy(self, request, *args, **kwargs):
+        response = super().destroy(request, *args, **kwargs)
+        self.invalidate_cache()
+        return response
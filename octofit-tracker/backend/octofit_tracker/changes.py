@@ -0,0 +1,147 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import Activity, Change, Leaderboard, TeamMembership
+
+USERS = 'users'
+TEAMS = 'teams'
+ACTIVITIES = 'activities'
+LEADERBOARD = 'leaderboard'
+WORKOUTS = 'workouts'
+# Marks a reset of the whole log; tokens from before it are expired
+RESET = '_reset'
+
+RECORD_BATCH_SIZE = 1000
+
+
+def record_changes(resource, ids, deleted=False):
+    """Log a write to the objects ``ids`` of ``resource``; call it inside the write's transaction."""
+    Change.objects.bulk_create(
+        (Change(resource=resource, object_id=str(pk), deleted=deleted) for pk in ids),
+        batch_size=RECORD_BATCH_SIZE,
+    )
+
+
+def record_created(resource, model, objs, bulk_create):
+    """
+    Insert ``objs`` with ``bulk_create(objs)`` and log them. Backends that
+    don't return the new ids get every row past the previous highest id,
+    which may log rows inserted concurrently too; an extra change is harmless.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        bulk_create(objs)
+        record_changes(resource, [obj.pk for obj in objs])
+        return
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    bulk_create(objs)
+    record_changes(resource, model.objects.filter(pk__gt=last).values_list('pk', flat=True).iterator())
+
+
+def record_email_change(user_id):
+    """
+    Log the rows that show a user's email: their activities, leaderboard
+    entry and team (whose member list holds the email).
+    """
+    record_changes(ACTIVITIES, Activity.objects.filter(user_id=user_id).values_list('id', flat=True).iterator())
+    record_changes(LEADERBOARD, Leaderboard.objects.filter(user_id=user_id).values_list('id', flat=True))
+    record_changes(TEAMS, TeamMembership.objects.filter(user_id=user_id).values_list('team_id', flat=True))
+
+
+def record_user_deleted(user_id):
+    """Log a user's delete and its cascade; call it before the delete."""
+    record_changes(
+        ACTIVITIES, Activity.objects.filter(user_id=user_id).values_list('id', flat=True).iterator(), deleted=True,
+    )
+    record_changes(LEADERBOARD, Leaderboard.objects.filter(user_id=user_id).values_list('id', flat=True), deleted=True)
+    record_changes(TEAMS, TeamMembership.objects.filter(user_id=user_id).values_list('team_id', flat=True))
+    record_changes(USERS, [user_id], deleted=True)
+
+
+def record_team_members(team_id):
+    """Log the members of a team, whose ``team`` and ``team_name`` fields follow it."""
+    record_changes(USERS, TeamMembership.objects.filter(team_id=team_id).values_list('user_id', flat=True))
+
+
+class ChangesExpired(Exception):
+    """The token is older than the retained change log; the client must fetch everything again."""
+
+
+def reset_changes():
+    """
+    Empty the change log after the data was replaced without logging, e.g.
+    by ``populate_db``. A marker row is kept so that every earlier token is
+    expired.
+    """
+    Change.objects.all().delete()
+    Change.objects.create(resource=RESET, object_id='')
+
+
+def _settled_before():
+    """
+    Changes logged after this time are not served yet. Ids are taken at
+    insert, not at commit, so a change may become visible after a higher id
+    was already served; waiting ``OCTOFIT_CHANGES_SETTLE_SECONDS`` lets the
+    transactions that logged lower ids commit first.
+    """
+    return timezone.now() - timedelta(seconds=settings.OCTOFIT_CHANGES_SETTLE_SECONDS)
+
+
+def latest_token():
+    """The token to take before a full fetch: the change before the first unsettled one."""
+    # A reset runs alone, so its marker has nothing to wait for
+    unsettled = (
+        Change.objects.filter(created_at__gt=_settled_before()).exclude(resource=RESET)
+        .order_by('id').values_list('id', flat=True).first()
+    )
+    if unsettled is not None:
+        return unsettled - 1
+    return Change.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_since(since, limit):
+    """
+    The settled changes after token ``since``, at most ``limit`` log entries.
+
+    Returns ``(entries, next_token, has_more)``; entries are
+    ``(resource, object_id, deleted)``, one per object (its latest change
+    in the page), in the order of those changes. The page stops before the
+    first change logged within the settle window. Raises
+    :class:`ChangesExpired` if changes after ``since`` were pruned or the
+    log was reset after it.
+    """
+    first = Change.objects.order_by('id').values_list('id', 'resource').first()
+    if first is not None:
+        first_id, resource = first
+        # Only the changes before the first kept one were pruned, but a reset
+        # marker drops everything before it
+        if since < (first_id if resource == RESET else first_id - 1):
+            raise ChangesExpired(since)
+    settled = _settled_before()
+    rows = []
+    for row in (
+        Change.objects.filter(id__gt=since).order_by('id')
+        .values_list('id', 'resource', 'object_id', 'deleted', 'created_at')[:limit]
+    ):
+        if row[4] > settled and row[1] != RESET:
+            break
+        rows.append(row)
+    latest = {}
+    for _, resource, object_id, deleted, _ in rows:
+        if resource == RESET:
+            continue
+        latest.pop((resource, object_id), None)
+        latest[resource, object_id] = deleted
+    entries = [(resource, object_id, deleted) for (resource, object_id), deleted in latest.items()]
+    return entries, rows[-1][0] if rows else since, len(rows) == limit
+
+
+def prune_changes(days):
+    """
+    Delete changes older than ``days`` days. The newest change is always
+    kept, so expired tokens can still be told apart. Returns the number deleted.
+    """
+    newest = latest_token()
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = Change.objects.filter(created_at__lt=cutoff, id__lt=newest).delete()
+    return deleted
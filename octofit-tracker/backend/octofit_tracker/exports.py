@@ -0,0 +1,61 @@
+import csv
+import json
+from django.http import StreamingHttpResponse
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=str) + '\n'
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def streaming_export(fmt, filename, columns, rows):
+    """
+    Stream ``rows`` (an iterable of tuples matching ``columns``) as NDJSON or CSV.
+
+    Rows are encoded one at a time as the response is sent, so memory use
+    does not depend on the size of the export as long as ``rows`` is lazy.
+    """
+    lines = ndjson_lines(columns, rows) if fmt == 'ndjson' else csv_lines(columns, rows)
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def activity_rows(queryset, chunk_size):
+    """Activity export rows, with the same values the list endpoint renders."""
+    rows = queryset.values_list('id', 'user__email', 'activity_type', 'duration', 'date')
+    for pk, email, activity_type, duration, day in rows.iterator(chunk_size=chunk_size):
+        yield str(pk), email, activity_type, duration, day.isoformat()
+
+
+def leaderboard_rows(queryset, chunk_size, top=None):
+    """Leaderboard export rows, best first, with competition ranks as in ``ranked``."""
+    rows = queryset.order_by('-score', 'id').values_list(
+        'user__email', 'user__name', 'user__membership__team__name', 'score',
+    )
+    rank = previous_score = None
+    for position, (email, name, team, score) in enumerate(rows.iterator(chunk_size=chunk_size), start=1):
+        if top is not None and position > top:
+            break
+        if score != previous_score:
+            rank, previous_score = position, score
+        yield rank, email, name, team, score
@@ -0,0 +1,45 @@
+from .models import WorkoutExercise
+
+
+def filter_activities(queryset, user=None, activity_type=None, date_from=None, date_to=None,
+                      min_duration=None):
+    """
+    Narrow an Activity queryset to the given filters.
+
+    ``user`` (an email) and ``activity_type`` are equality matches that lead
+    the (user, date) and (activity_type, date) indexes, so combined with a
+    date window each is a single index range scan. ``min_duration`` is
+    applied to the rows that range returns.
+    """
+    if user is not None:
+        queryset = queryset.filter(user__email=user)
+    if activity_type is not None:
+        queryset = queryset.filter(activity_type=activity_type)
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date__lte=date_to)
+    if min_duration is not None:
+        queryset = queryset.filter(duration__gte=min_duration)
+    return queryset
+
+
+def filter_workouts(queryset, exercise=None, min_sets=None, min_duration_seconds=None):
+    """
+    Narrow a Workout queryset to workouts with an exercise matching every
+    given filter.
+
+    ``exercise`` is an exact name and leads the (name, sets) and
+    (name, duration_seconds) indexes; the conditions apply to the same
+    exercise, so "squats with at least 4 sets" is one index range scan.
+    """
+    conditions = {}
+    if exercise is not None:
+        conditions['name'] = exercise
+    if min_sets is not None:
+        conditions['sets__gte'] = min_sets
+    if min_duration_seconds is not None:
+        conditions['duration_seconds__gte'] = min_duration_seconds
+    if not conditions:
+        return queryset
+    return queryset.filter(pk__in=WorkoutExercise.objects.filter(**conditions).values('workout_id'))
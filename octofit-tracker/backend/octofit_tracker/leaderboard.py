@@ -0,0 +1,176 @@
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .changes import LEADERBOARD, record_changes
+from .models import Activity, Leaderboard
+from .repositories import analytics_repository
+
+# Same estimate the frontend uses for the kcal badges.
+CALORIES_PER_MINUTE = 10
+
+# Leaderboard points earned per minute of logged activity.
+POINTS_PER_MINUTE = 1
+
+
+def activity_points(duration):
+    """Points an activity of ``duration`` minutes contributes to a score."""
+    return int(round((duration or 0) * POINTS_PER_MINUTE))
+
+
+def _add_score(user_id, delta):
+    """``score = score + delta`` for the user's entry, creating it if missing."""
+    entries = Leaderboard.objects.filter(user_id=user_id)
+    if entries.update(score=F('score') + delta):
+        return
+    try:
+        # In a savepoint so a lost race doesn't break the outer transaction
+        with transaction.atomic():
+            Leaderboard.objects.create(user_id=user_id, score=delta)
+    except IntegrityError:
+        # A concurrent first write for the user created the entry meanwhile
+        entries.update(score=F('score') + delta)
+
+
+def apply_score_deltas(deltas):
+    """
+    Add ``{user_id: delta}`` to the stored scores, creating missing entries.
+
+    Each delta is a single ``score = score + delta`` update keyed on the user,
+    so a write never reads other activities. Ranks are not stored: they are
+    derived when the leaderboard is read, in :func:`ranked_leaderboard`.
+    """
+    changed = [user_id for user_id, delta in deltas.items() if delta]
+    if not changed:
+        return
+    with transaction.atomic():
+        for user_id in changed:
+            _add_score(user_id, deltas[user_id])
+        record_changes(LEADERBOARD, Leaderboard.objects.filter(user_id__in=changed).values_list('id', flat=True))
+
+
+def record_activity_change(before=None, after=None):
+    """
+    Update scores for an activity write.
+
+    ``before`` and ``after`` are the activity's state around the write (None
+    for a create or a delete respectively); only the difference is applied.
+    """
+    deltas = defaultdict(int)
+    if before is not None:
+        deltas[before.user_id] -= activity_points(before.duration)
+    if after is not None:
+        deltas[after.user_id] += activity_points(after.duration)
+    apply_score_deltas(deltas)
+
+
+def record_activity_batch(activities, deleted=False):
+    """Update scores for newly created, or ``deleted``, ``activities``: one update per user."""
+    sign = -1 if deleted else 1
+    deltas = defaultdict(int)
+    for activity in activities:
+        deltas[activity.user_id] += sign * activity_points(activity.duration)
+    apply_score_deltas(deltas)
+
+
+def rescore_user(user_id):
+    """
+    Recompute one user's score from their activities; returns the new score.
+
+    The entry is locked before the activities are read, so an activity write
+    committing meanwhile waits and then adds its delta to the new score
+    rather than being overwritten by it. MongoDB has no row locks.
+    """
+    with transaction.atomic():
+        entries = Leaderboard.objects.select_for_update().filter(user_id=user_id)
+        entry = entries.first()
+        created = entry is None
+        if created:
+            try:
+                with transaction.atomic():
+                    entry = Leaderboard.objects.create(user_id=user_id, score=0)
+            except IntegrityError:
+                created, entry = False, entries.get()
+        durations = Activity.objects.filter(user_id=user_id).values_list('duration', flat=True)
+        score = sum(activity_points(duration) for duration in durations)
+        if entry.score != score:
+            Leaderboard.objects.filter(pk=entry.pk).update(score=score)
+        elif not created:
+            return score
+        record_changes(LEADERBOARD, [entry.pk])
+    return score
+
+
+def rebuild_scores(batch_size=1000):
+    """
+    Recompute every score from the activity table in one streaming pass.
+
+    Activities are streamed in chunks and only the per-user totals are held
+    in memory. The entries are locked before the activities are read, as in
+    :func:`rescore_user`. Returns the number of leaderboard entries written.
+    """
+    with transaction.atomic():
+        list(Leaderboard.objects.select_for_update().values_list('id', flat=True))
+        totals = defaultdict(int)
+        activities = Activity.objects.values_list('user_id', 'duration').iterator(chunk_size=batch_size)
+        for user_id, duration in activities:
+            totals[user_id] += activity_points(duration)
+
+        to_update = []
+        for entry in Leaderboard.objects.only('id', 'user_id', 'score').iterator(chunk_size=batch_size):
+            score = totals.pop(entry.user_id, 0)
+            if entry.score != score:
+                entry.score = score
+                to_update.append(entry)
+        Leaderboard.objects.bulk_update(to_update, ['score'], batch_size=batch_size)
+        to_create = [Leaderboard(user_id=user_id, score=score) for user_id, score in totals.items()]
+        Leaderboard.objects.bulk_create(to_create, batch_size=batch_size)
+        record_changes(LEADERBOARD, [entry.pk for entry in to_update])
+        # Read back: bulk_create doesn't set ids on every backend
+        for start in range(0, len(to_create), batch_size):
+            user_ids = [entry.user_id for entry in to_create[start:start + batch_size]]
+            record_changes(LEADERBOARD, Leaderboard.objects.filter(user_id__in=user_ids).values_list('id', flat=True))
+    return len(to_update) + len(to_create)
+
+
+def ranked_leaderboard(top=None, team=None, date_from=None, date_to=None, repository=None):
+    """
+    Return leaderboard rows joined with user names, teams and activity totals.
+
+    Activity totals are aggregated in a single grouped query; ``date_from`` and
+    ``date_to`` narrow that window only, scores are the stored values. Ranks
+    use competition ranking (1, 2, 2, 4) within the filtered set. Reads go
+    through ``repository`` (default: :func:`analytics_repository`).
+    """
+    repository = repository or analytics_repository()
+    ranked = []
+    previous_score = None
+    for position, (user_id, score) in enumerate(repository.ranked_entries(team_id=team, limit=top), start=1):
+        if score != previous_score:
+            rank = position
+            previous_score = score
+        ranked.append((rank, user_id, score))
+    user_ids = [user_id for _, user_id, _ in ranked]
+
+    # Grouped on user_id over the (user, date) index
+    totals = repository.activity_totals(
+        user_ids=user_ids if team is not None or top is not None else None,
+        date_from=date_from, date_to=date_to,
+    )
+    users = repository.users_with_teams(user_ids)
+
+    rows = []
+    for rank, user_id, score in ranked:
+        email, name, team_id, team_name = users[user_id]
+        total_duration, activity_count = totals.get(user_id, (0, 0))
+        rows.append({
+            'rank': rank,
+            'user': email,
+            'name': name,
+            'team': team_name,
+            'team_id': str(team_id) if team_id is not None else None,
+            'score': score,
+            'total_duration': total_duration,
+            'activity_count': activity_count,
+            'calories': round(total_duration * CALORIES_PER_MINUTE),
+        })
+    return rows
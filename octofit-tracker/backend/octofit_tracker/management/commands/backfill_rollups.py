@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.caching import invalidate
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and weekly activity rollups from the activity table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Activities fetched and rollups written per database round trip (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Backfilling activity rollups...')
+        written = rebuild_rollups(batch_size=options['batch_size'])
+        invalidate('stats')
+        self.stdout.write(self.style.SUCCESS(f'Activity rollups rebuilt: {written} rows written.'))
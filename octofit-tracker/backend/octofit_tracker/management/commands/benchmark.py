@@ -0,0 +1,231 @@
+import json
+import platform
+import subprocess
+import time
+from datetime import date, datetime, timezone
+import django
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+from octofit_tracker.caching import API_CACHE
+from octofit_tracker.management.commands.loadtest import percentile
+from octofit_tracker.middleware import QueryTimer
+from octofit_tracker.models import Activity, User
+from octofit_tracker.recommendations import WorkoutFeatures
+from octofit_tracker.search import SearchIndex
+from octofit_tracker.serializers import ActivitySerializer
+from octofit_tracker.urls import router
+
+SEARCH_WORDS = ['tempo', 'hill', 'core', 'power', 'mobility', 'interval', 'recovery', 'strength']
+SEARCH_EXERCISES = ['Squats', 'Push-ups', 'Lunges', 'Plank', 'Burpees', 'Pull-ups', 'Deadlifts', 'Rows']
+SEARCH_QUERIES = ['tempo', 'core plank', 'power hill squ', 'recovery mobility deadlifts', '12345']
+ACTIVITY_TYPES = ['running', 'cycling', 'swimming', 'strength', 'training', 'yoga', 'walking', 'hiking', 'rowing']
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large synthetic dataset and measure p50/p95 latency, throughput and query '
+        'counts of every router endpoint and the leaderboard aggregation. Run it against a '
+        'throwaway database, e.g. OCTOFIT_SQLITE_PATH=/tmp/bench.sqlite3: seeding replaces '
+        'all data, and asks for confirmation on any database but SQLite.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Synthetic users (default: 10000)')
+        parser.add_argument('--activities', type=int, default=1000000,
+                            help='Synthetic activities (default: 1000000)')
+        parser.add_argument('--teams', type=int, default=1000, help='Synthetic teams (default: 1000)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the dataset (default: 42)')
+        parser.add_argument('--no-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Seed a database other than SQLite without asking for confirmation',
+        )
+        parser.add_argument('--iterations', type=int, default=30, help='Requests per endpoint (default: 30)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the API response cache between requests (default: cleared each time)')
+        parser.add_argument('--index-workouts', type=int, default=100000,
+                            help='Synthetic workouts in the in-memory search index benchmark (default: 100000)')
+        parser.add_argument('--feature-workouts', type=int, default=10000,
+                            help='Synthetic workouts in the recommendation scoring benchmark (default: 10000)')
+        parser.add_argument('--serialize-rows', type=int, default=10000,
+                            help='Unsaved activities in the list serialization benchmark (default: 10000)')
+        parser.add_argument('--output', default='benchmark.json', help='Results file (default: benchmark.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare p95 latencies against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='p95 slowdown ratio reported as a regression with --compare (default: 0.2)')
+
+    def handle(self, *args, **options):
+        if not options['no_seed']:
+            if not self.confirm_seed(options['interactive']):
+                self.stdout.write('Benchmark cancelled.')
+                return
+            migrate = {'verbosity': 0, 'interactive': False}
+            call_command('migrate', **migrate)
+            call_command(
+                'populate_db', users=options['users'], activities=options['activities'],
+                teams=options['teams'], seed=options['seed'], stdout=self.stdout,
+            )
+
+        self.client = APIClient()
+        results = {}
+        for name, path in self.endpoints():
+            results[name] = self.measure(path, options['iterations'], options['warm_cache'])
+            self.stdout.write(
+                f"{name:<28}{results[name]['p50_ms']:>9.1f}{results[name]['p95_ms']:>9.1f} ms"
+                f"{results[name]['throughput_rps']:>9.1f} req/s{results[name]['queries']:>5} queries"
+            )
+        in_memory = self.in_memory(options['index_workouts'], options['feature_workouts'], options['serialize_rows'])
+        for name, label, call in in_memory:
+            results[name] = self.measure_call(label, call, options['iterations'])
+            self.stdout.write(f"{name:<28}{results[name]['p50_ms']:>9.1f}{results[name]['p95_ms']:>9.1f} ms")
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': User.objects.count(),
+                'activities': Activity.objects.count(),
+                'iterations': options['iterations'],
+                'warm_cache': options['warm_cache'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    @staticmethod
+    def confirm_seed(interactive):
+        """
+        Seeding replaces all data. A SQLite file is taken to be a scratch
+        database; any other database, such as the default MongoDB
+        ``octofit_db``, needs a typed confirmation, as ``flush`` asks.
+        """
+        if connection.vendor == 'sqlite' or not interactive:
+            return True
+        answer = input(
+            f"This will replace ALL data in the {connection.vendor} database "
+            f"{connection.settings_dict['NAME']!r} with a synthetic dataset.\n"
+            "Use OCTOFIT_SQLITE_PATH to benchmark a scratch SQLite file instead.\n"
+            "Type 'yes' to continue, or 'no' to cancel: "
+        )
+        return answer == 'yes'
+
+    def endpoints(self):
+        """``(name, path)`` for every router list and detail route, plus the leaderboard aggregation."""
+        for prefix, viewset, basename in router.registry:
+            yield f'{basename}-list', f'/api/{prefix}/'
+            obj = viewset.queryset.order_by('pk').first() if viewset.queryset is not None else None
+            if obj is not None:
+                yield f'{basename}-detail', f'/api/{prefix}/{obj.pk}/'
+        yield 'leaderboard-ranked', '/api/leaderboard/ranked/'
+        yield 'leaderboard-ranked-top10', '/api/leaderboard/ranked/?top=10'
+
+    def in_memory(self, index_workouts, feature_workouts, serialize_rows):
+        """
+        ``(name, label, call)`` for the per-process structures behind search
+        and recommendations, filled with synthetic workouts, and for list
+        serialization: one call runs every sample search, scores every
+        workout for one profile, or serializes ``serialize_rows`` activities.
+        """
+        index = SearchIndex()
+        for n in range(index_workouts):
+            index.add_workout(
+                n, f'{SEARCH_WORDS[n % 8].title()} {SEARCH_WORDS[n // 8 % 8]} {n}',
+                f'Session {n} for {SEARCH_WORDS[n // 64 % 8]} work',
+                [SEARCH_EXERCISES[(n + k) % 8] for k in range(3)],
+            )
+        yield (
+            f'search-index-{len(SEARCH_QUERIES)}-queries', f'SearchIndex.search x{len(SEARCH_QUERIES)}',
+            lambda: [index.search(query, limit=20) for query in SEARCH_QUERIES],
+        )
+
+        features = WorkoutFeatures(ACTIVITY_TYPES)
+        for n in range(feature_workouts):
+            features.set_workout(
+                n, f'Workout {n}', f'{ACTIVITY_TYPES[n % 9].title()} session',
+                [('Squats', 3, 10, None), ('Plank', 1, None, n % 600)],
+            )
+        profile, minutes = features.profile([('Running', 30), ('Strength training', 45), ('Yoga', 20)])
+        yield 'recommend-features', 'WorkoutFeatures.recommend', lambda: features.recommend(profile, minutes, limit=10)
+
+        user = User(pk=1, name='Bruce Wayne', email='batman@dc.com', age=40)
+        activities = [
+            Activity(pk=pk, user=user, activity_type='Running', duration=30.0, date=date(2024, 1, 1))
+            for pk in range(1, serialize_rows + 1)
+        ]
+        yield (
+            'serialize-activities', f'ActivitySerializer(many=True) x{serialize_rows}',
+            lambda: ActivitySerializer(activities, many=True).data,
+        )
+
+    def measure_call(self, label, call, iterations):
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - started)
+        return self.summarize(label, latencies, [], 0)
+
+    def measure(self, path, iterations, warm_cache):
+        latencies, timer, statuses = [], QueryTimer(), set()
+        with connection.execute_wrapper(timer):
+            for _ in range(iterations):
+                if not warm_cache:
+                    caches[API_CACHE].clear()
+                started = time.perf_counter()
+                response = self.client.get(path)
+                latencies.append(time.perf_counter() - started)
+                statuses.add(response.status_code)
+        return self.summarize(path, latencies, sorted(statuses), timer.count / iterations)
+
+    @staticmethod
+    def summarize(path, latencies, statuses, queries):
+        latencies.sort()
+        total = sum(latencies)
+        return {
+            'path': path,
+            'status': statuses,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'mean_ms': round(total / len(latencies) * 1000, 3),
+            'throughput_rps': round(len(latencies) / total, 2) if total else 0.0,
+            'queries': round(queries),
+        }
+
+    def compare(self, path, results, threshold):
+        with open(path) as handle:
+            baseline = json.load(handle)['results']
+        regressions = []
+        self.stdout.write(f'\nCompared with {path} (p95):')
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name]['p95_ms'], result['p95_ms']
+            change = (after - before) / before if before else 0.0
+            queries = f"  queries {baseline[name]['queries']} -> {result['queries']}" \
+                if baseline[name]['queries'] != result['queries'] else ''
+            self.stdout.write(f'  {name:<28}{before:>9.1f} -> {after:>9.1f} ms ({change:+.0%}){queries}')
+            # Sub-millisecond changes are noise at any ratio
+            if (change > threshold and after - before > 1.0) or result['queries'] > baseline[name]['queries']:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"Regressions: {', '.join(regressions)}")
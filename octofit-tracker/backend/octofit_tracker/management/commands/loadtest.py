@@ -0,0 +1,94 @@
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def fetch(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run_load(url, requests, concurrency, timeout, bust_cache=False):
+    """
+    Fire ``requests`` GETs at ``url``, ``concurrency`` at a time.
+
+    With ``bust_cache`` every request carries a unique query parameter so
+    the sync endpoints can't answer from the response cache.
+    """
+    def one(n):
+        return fetch(f'{url}?_={n}' if bust_cache else url, timeout)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'url': url,
+        'requests': requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput': requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the sync API reads against the async ones (/api/async/...) on running '
+        'servers, e.g. gunicorn for --sync-url and uvicorn octofit_tracker.asgi for --async-url'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://localhost:8000',
+                            help='Base URL of the server for the sync endpoints (default: http://localhost:8000)')
+        parser.add_argument('--async-url', default=None,
+                            help='Base URL of the server for the async endpoints (default: --sync-url)')
+        parser.add_argument('--resources', default='users,activities,leaderboard',
+                            help='Comma-separated resources to hit (default: users,activities,leaderboard)')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint (default: 500)')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Requests in flight at once (default: 50)')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+        parser.add_argument('--bust-cache', action='store_true',
+                            help='Make every sync request miss the response cache (the async reads are never cached)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        sync_url = options['sync_url'].rstrip('/')
+        async_url = (options['async_url'] or sync_url).rstrip('/')
+        results = []
+        for resource in [name.strip() for name in options['resources'].split(',') if name.strip()]:
+            for mode, url in (('sync', f'{sync_url}/api/{resource}/'), ('async', f'{async_url}/api/async/{resource}/')):
+                result = run_load(
+                    url, options['requests'], options['concurrency'], options['timeout'], options['bust_cache'],
+                )
+                result.update(resource=resource, mode=mode)
+                results.append(result)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'resource':<14}{'mode':<7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['resource']:<14}{result['mode']:<7}{result['throughput']:>9.1f}"
+                f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['errors']:>8}"
+            )
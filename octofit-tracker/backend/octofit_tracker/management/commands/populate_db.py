@@ -1,19 +1,66 @@
-import json
-from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import date
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.caching import invalidate_all
+from octofit_tracker.changes import reset_changes
+from octofit_tracker.leaderboard import rebuild_scores
+from octofit_tracker.models import (
+    User, Team, TeamMembership, Activity, ActivityRollup, Leaderboard, Workout, WorkoutExercise
+)
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.workouts import set_workout_exercises
+from datetime import date, timedelta
+
+ACTIVITY_TYPES = [
+    'Running', 'Cycling', 'Swimming', 'Strength training', 'Yoga', 'Walking',
+    'Hiking', 'Rowing', 'Combat training', 'Stretching',
+]
+EXERCISE_NAMES = [
+    'Squats', 'Push-ups', 'Lunges', 'Plank', 'Burpees', 'Pull-ups', 'Deadlifts',
+    'Mountain climbers', 'Box jumps', 'Kettlebell swings', 'Sprints', 'Rows',
+]
 
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = (
+        'Populate the octofit_db database with test data: the superhero set by '
+        'default, or a deterministic synthetic dataset when --users or '
+        '--activities is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='Number of synthetic users')
+        parser.add_argument('--activities', type=int, help='Number of synthetic activities')
+        parser.add_argument('--teams', type=int, help='Number of synthetic teams (default: users / 10)')
+        parser.add_argument('--workouts', type=int, default=50, help='Number of synthetic workouts (default: 50)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; equal seeds give equal data (default: 42)')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per bulk insert in synthetic mode (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        synthetic = options['users'] is not None or options['activities'] is not None
+        if synthetic and (options['users'] or 0) < 1:
+            raise CommandError('--users must be at least 1 for a synthetic dataset.')
 
-    def handle(self, *args, **kwargs):
         self.stdout.write('Clearing existing data...')
+        ActivityRollup.objects.all().delete()
         Leaderboard.objects.all().delete()
         Activity.objects.all().delete()
+        WorkoutExercise.objects.all().delete()
         Workout.objects.all().delete()
+        TeamMembership.objects.all().delete()
         Team.objects.all().delete()
         User.objects.all().delete()
+        # None of this is logged, so delta sync clients must fetch everything again
+        reset_changes()
+
+        if synthetic:
+            self.populate_synthetic(options)
+            invalidate_all()
+            self.report_counts()
+            return
 
         self.stdout.write('Creating superhero users...')
 
@@ -49,20 +96,22 @@ class Command(BaseCommand):
 
         self.stdout.write('Creating teams...')
 
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            members=json.dumps([u.email for u in marvel_users])
+        team_marvel = Team.objects.create(name='Team Marvel')
+        TeamMembership.objects.bulk_create(
+            [TeamMembership(team=team_marvel, user=u) for u in marvel_users]
         )
         self.stdout.write(f'  Created team: {team_marvel.name}')
 
-        team_dc = Team.objects.create(
-            name='Team DC',
-            members=json.dumps([u.email for u in dc_users])
+        team_dc = Team.objects.create(name='Team DC')
+        TeamMembership.objects.bulk_create(
+            [TeamMembership(team=team_dc, user=u) for u in dc_users]
         )
         self.stdout.write(f'  Created team: {team_dc.name}')
 
         self.stdout.write('Creating activities...')
 
+        users_by_email = {u.email: u for u in marvel_users + dc_users}
+
         activities_data = [
             {'user': 'ironman@marvel.com', 'activity_type': 'Flying in Iron Man suit', 'duration': 60.0, 'date': date(2024, 1, 10)},
             {'user': 'spiderman@marvel.com', 'activity_type': 'Web-slinging across NYC', 'duration': 45.0, 'date': date(2024, 1, 11)},
@@ -77,27 +126,15 @@ class Command(BaseCommand):
         ]
 
         for act_data in activities_data:
+            act_data['user'] = users_by_email[act_data['user']]
             activity = Activity.objects.create(**act_data)
-            self.stdout.write(f'  Created activity: {activity.activity_type} for {activity.user}')
-
-        self.stdout.write('Creating leaderboard entries...')
-
-        leaderboard_data = [
-            {'user': 'thor@marvel.com', 'score': 950},
-            {'user': 'batman@dc.com', 'score': 910},
-            {'user': 'wonderwoman@dc.com', 'score': 880},
-            {'user': 'captain_america@marvel.com', 'score': 860},
-            {'user': 'superman@dc.com', 'score': 840},
-            {'user': 'ironman@marvel.com', 'score': 820},
-            {'user': 'blackwidow@marvel.com', 'score': 800},
-            {'user': 'flash@dc.com', 'score': 790},
-            {'user': 'spiderman@marvel.com', 'score': 750},
-            {'user': 'greenlantern@dc.com', 'score': 700},
-        ]
+            self.stdout.write(f'  Created activity: {activity.activity_type} for {activity.user.email}')
 
-        for lb_data in leaderboard_data:
-            entry = Leaderboard.objects.create(**lb_data)
-            self.stdout.write(f'  Created leaderboard entry: {entry.user} -> {entry.score}')
+        self.stdout.write('Scoring leaderboard...')
+        # Scores are the activity points of each user's activities
+        rebuild_scores()
+        for entry in Leaderboard.objects.select_related('user').order_by('-score', 'id'):
+            self.stdout.write(f'  Scored leaderboard entry: {entry.user.email} -> {entry.score}')
 
         self.stdout.write('Creating workouts...')
 
@@ -105,57 +142,143 @@ class Command(BaseCommand):
             {
                 'name': 'Iron Man Endurance Circuit',
                 'description': 'High-intensity endurance training inspired by Tony Stark\'s arc reactor powered suit.',
-                'exercises': json.dumps([
+                'exercises': [
                     {'name': 'Repulsor blast holds', 'sets': 3, 'reps': 15},
                     {'name': 'Suit-up sprint drills', 'sets': 4, 'reps': 10},
                     {'name': 'Core stabilization plank', 'sets': 3, 'duration_seconds': 60},
-                ])
+                ]
             },
             {
                 'name': 'Spider-Man Agility Training',
                 'description': 'Agility and flexibility workout inspired by Peter Parker\'s spider-like abilities.',
-                'exercises': json.dumps([
+                'exercises': [
                     {'name': 'Wall crawl simulation', 'sets': 3, 'reps': 12},
                     {'name': 'Web-swing squats', 'sets': 4, 'reps': 15},
                     {'name': 'Spider-sense reaction drills', 'sets': 3, 'reps': 20},
-                ])
+                ]
             },
             {
                 'name': 'Batman Combat Conditioning',
                 'description': 'Full-body combat conditioning from Bruce Wayne\'s training regimen.',
-                'exercises': json.dumps([
+                'exercises': [
                     {'name': 'Batarang throws (resistance band)', 'sets': 3, 'reps': 20},
-                    {'name': 'Gotham obstacle course run', 'sets': 2, 'duration_minutes': 15},
+                    {'name': 'Gotham obstacle course run', 'sets': 2, 'duration_seconds': 900},
                     {'name': 'Defensive grappling holds', 'sets': 4, 'reps': 10},
-                ])
+                ]
             },
             {
                 'name': 'Wonder Woman Power Build',
                 'description': 'Strength and power training inspired by Diana Prince\'s Amazonian warrior training.',
-                'exercises': json.dumps([
+                'exercises': [
                     {'name': 'Lasso pull rows', 'sets': 4, 'reps': 12},
                     {'name': 'Shield block press', 'sets': 3, 'reps': 15},
                     {'name': 'Amazonian warrior lunges', 'sets': 3, 'reps': 20},
-                ])
+                ]
             },
             {
                 'name': 'Flash Speed Intervals',
                 'description': 'High-speed interval training inspired by Barry Allen\'s speed force abilities.',
-                'exercises': json.dumps([
+                'exercises': [
                     {'name': 'Speed force sprints', 'sets': 10, 'duration_seconds': 30},
                     {'name': 'Treadmill acceleration bursts', 'sets': 5, 'duration_seconds': 60},
                     {'name': 'Reaction time drills', 'sets': 3, 'reps': 25},
-                ])
+                ]
             },
         ]
 
         for workout_data in workouts_data:
+            exercises = workout_data.pop('exercises')
             workout = Workout.objects.create(**workout_data)
+            set_workout_exercises(workout, exercises)
             self.stdout.write(f'  Created workout: {workout.name}')
 
+        self.stdout.write('Building activity rollups...')
+        rebuild_rollups()
+
+        invalidate_all()
         self.stdout.write(self.style.SUCCESS('\nDatabase populated successfully with superhero test data!'))
+        self.report_counts()
+
+    def report_counts(self):
         self.stdout.write(f'  Users: {User.objects.count()}')
         self.stdout.write(f'  Teams: {Team.objects.count()}')
         self.stdout.write(f'  Activities: {Activity.objects.count()}')
         self.stdout.write(f'  Leaderboard entries: {Leaderboard.objects.count()}')
         self.stdout.write(f'  Workouts: {Workout.objects.count()}')
+
+    def bulk_insert(self, label, model, objects, total, batch_size):
+        """Insert ``objects`` (any iterable) in batches, reporting progress every ~10%."""
+        started = time.monotonic()
+        step = max(batch_size, total // 10)
+        batch, done, next_report = [], 0, step
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch)
+                done += len(batch)
+                batch = []
+                if done >= next_report:
+                    self.stdout.write(f'  {label}: {done:,}/{total:,} ({time.monotonic() - started:.1f}s)')
+                    next_report += step
+        if batch:
+            model.objects.bulk_create(batch)
+            done += len(batch)
+        self.stdout.write(f'  {label}: {done:,} created in {time.monotonic() - started:.1f}s')
+
+    def populate_synthetic(self, options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        user_count = options['users']
+        activity_count = options['activities'] or 0
+        team_count = options['teams'] if options['teams'] is not None else max(1, user_count // 10)
+        workout_count = options['workouts']
+
+        self.stdout.write(
+            f'Creating synthetic dataset (seed {options["seed"]}): {user_count:,} users, '
+            f'{team_count:,} teams, {activity_count:,} activities, {workout_count:,} workouts...'
+        )
+        self.bulk_insert('users', User, (
+            User(name=f'Athlete {n}', email=f'athlete{n}@octofit.test', age=rng.randint(16, 70))
+            for n in range(1, user_count + 1)
+        ), user_count, batch_size)
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+
+        self.bulk_insert('teams', Team, (
+            Team(name=f'Team {n}') for n in range(1, team_count + 1)
+        ), team_count, batch_size)
+        team_ids = list(Team.objects.order_by('id').values_list('id', flat=True))
+        if team_ids:
+            self.bulk_insert('team memberships', TeamMembership, (
+                TeamMembership(user_id=user_id, team_id=team_ids[n % len(team_ids)])
+                for n, user_id in enumerate(user_ids)
+            ), len(user_ids), batch_size)
+
+        first_day = date(2024, 1, 1)
+        self.bulk_insert('activities', Activity, (
+            Activity(
+                user_id=rng.choice(user_ids),
+                activity_type=rng.choice(ACTIVITY_TYPES),
+                duration=round(rng.uniform(5, 120), 1),
+                date=first_day + timedelta(days=rng.randrange(365)),
+            )
+            for _ in range(activity_count)
+        ), activity_count, batch_size)
+
+        self.bulk_insert('workouts', Workout, (
+            Workout(name=f'Workout {n}', description=f'{rng.choice(ACTIVITY_TYPES)} session number {n}.')
+            for n in range(1, workout_count + 1)
+        ), workout_count, batch_size)
+        workout_ids = list(Workout.objects.order_by('id').values_list('id', flat=True))
+        self.bulk_insert('workout exercises', WorkoutExercise, (
+            WorkoutExercise(
+                workout_id=workout_id, position=position, name=name,
+                sets=rng.randint(2, 5), reps=rng.choice([8, 10, 12, 15, 20]),
+            )
+            for workout_id in workout_ids
+            for position, name in enumerate(rng.sample(EXERCISE_NAMES, rng.randint(2, 4)))
+        ), workout_count * 3, batch_size)
+
+        self.stdout.write('Scoring leaderboard and building activity rollups...')
+        rebuild_scores(batch_size=batch_size)
+        rebuild_rollups(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS('\nDatabase populated successfully with synthetic data!'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from octofit_tracker.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed entries older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.OCTOFIT_CHANGES_RETENTION_DAYS,
+            help='Keep this many days of changes (default: OCTOFIT_CHANGES_RETENTION_DAYS)',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} changes older than {options['days']} days."))
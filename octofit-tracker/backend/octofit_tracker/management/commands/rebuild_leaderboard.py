@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.caching import invalidate
+from octofit_tracker.leaderboard import rebuild_scores
+from octofit_tracker.models import Leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute every leaderboard score from the activity table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows fetched and written per database round trip (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding leaderboard from activities...')
+        written = rebuild_scores(batch_size=options['batch_size'])
+        invalidate('leaderboard')
+        self.stdout.write(self.style.SUCCESS(
+            f'Leaderboard rebuilt: {written} entries changed, '
+            f'{Leaderboard.objects.count()} entries total.'
+        ))
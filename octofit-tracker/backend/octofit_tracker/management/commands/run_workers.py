@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.taskqueue import WorkerPool, collect_queue_metrics, requeue_stale, run_due
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks (score and rollup recomputes) from the task table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Worker threads; run more processes for more parallelism (default: 4)',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds an idle worker waits before looking for due tasks again (default: 1)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1,
+            help='Tasks a worker claims at a time (default: 1)',
+        )
+        parser.add_argument(
+            '--drain', action='store_true',
+            help='Exit once no task is due instead of waiting for more',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run every due task in this thread and exit, e.g. from cron',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            requeue_stale()
+            processed, failed = run_due(batch_size=max(options['batch_size'], 100))
+        else:
+            pool = WorkerPool(
+                threads=options['threads'], poll_interval=options['poll_interval'],
+                batch_size=options['batch_size'], drain=options['drain'],
+            )
+            self.stdout.write(f"Running {options['threads']} workers...")
+            try:
+                pool.run()
+            except KeyboardInterrupt:
+                pass
+            processed, failed = pool.processed, pool.failed
+        depth = collect_queue_metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f'Tasks run: {processed} ({failed} failed); '
+            f"queue: {depth.get('pending', 0)} pending, {depth.get('failed', 0)} failed."
+        ))
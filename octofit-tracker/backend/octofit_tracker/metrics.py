@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.http import HttpResponse
+
+# Process-local registry: each worker exposes its own series and the
+# Prometheus server sums them across scrape targets.
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+_help = {}
+_collectors = []
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default histogram buckets: request latency in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase timings of the request being handled, see :func:`timed`
+_request_timings = ContextVar('octofit_request_timings', default=None)
+
+
+def describe(name, text):
+    """Register the ``# HELP`` line for a metric."""
+    _help[name] = text
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to the counter ``name`` with the given labels."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def register_collector(collect):
+    """Call ``collect()`` before every scrape, e.g. to set gauges read from the database."""
+    if collect not in _collectors:
+        _collectors.append(collect)
+
+
+def counter_value(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def set_gauge(name, value, **labels):
+    """Set the gauge ``name`` with the given labels to ``value``."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def gauge_value(name, **labels):
+    return _gauges.get(_key(name, labels))
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record ``value`` in the histogram ``name``; ``buckets`` are upper bounds."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                'buckets': tuple(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+            }
+        index = bisect_left(histogram['buckets'], value)
+        if index < len(histogram['counts']):
+            histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def histogram_count(name, **labels):
+    histogram = _histograms.get(_key(name, labels))
+    return histogram['count'] if histogram else 0
+
+
+@contextmanager
+def collect_timings():
+    """Collect :func:`timed` phases for the duration of a request; yields the totals."""
+    timings = defaultdict(float)
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the current request, if any."""
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] += time.perf_counter() - started
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _header(lines, described, name, kind):
+    if name not in described:
+        described.add(name)
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+
+def render_prometheus():
+    """Every registered metric in the Prometheus text exposition format."""
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception:  # a failing collector must not take the other metrics down
+            logger.exception('Metrics collector %r failed', collect)
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted(
+            (key, dict(value, counts=list(value['counts']))) for key, value in _histograms.items()
+        )
+    lines, described = [], set()
+    for (name, labels), value in counters:
+        _header(lines, described, name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    for (name, labels), value in gauges:
+        _header(lines, described, name, 'gauge')
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    for (name, labels), histogram in histograms:
+        _header(lines, described, name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
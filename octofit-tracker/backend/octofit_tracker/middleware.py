@@ -0,0 +1,110 @@
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from . import metrics
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+metrics.describe('octofit_requests_total', 'Requests handled, by route, method and status code.')
+metrics.describe('octofit_request_duration_seconds', 'Wall-clock time from the first middleware to the response.')
+metrics.describe('octofit_request_queries', 'ORM queries executed per request.')
+metrics.describe('octofit_request_query_seconds', 'Time spent in ORM queries per request.')
+metrics.describe('octofit_request_serialize_seconds', 'Time spent serializing and rendering the response body.')
+metrics.describe('octofit_response_size_bytes', 'Size of non-streaming response bodies.')
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts and times every query on a connection."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def route_name(request):
+    """The URL name the request resolved to (``user-list``, ``activity-detail``...)."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+def wrap_connections(stack, timer):
+    """Time the queries of this thread's connections with ``timer`` until ``stack`` closes."""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timer))
+
+
+class RequestMetricsMiddleware:
+    """
+    Per-route request instrumentation.
+
+    Records latency, ORM query count and time, serialization time (the
+    ``serialize`` and ``render`` phases, see :func:`metrics.timed`) and body
+    size into the histograms served at ``/api/_metrics``, and reports the
+    same request's numbers in a ``Server-Timing`` header. Goes first in
+    ``MIDDLEWARE`` so the latency covers the whole stack.
+
+    Works both ways round: under ASGI it stays async, so Django doesn't run
+    the whole stack, async views included, on the sync thread for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with metrics.collect_timings() as timings, ExitStack() as stack:
+            wrap_connections(stack, timer)
+            response = self.get_response(request)
+        return self.record(request, response, timer, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with metrics.collect_timings() as timings:
+            stack = ExitStack()
+            # Sync ORM work of an ASGI request runs on one thread; wrap its connections
+            await sync_to_async(wrap_connections)(stack, timer)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        return self.record(request, response, timer, timings, time.perf_counter() - started)
+
+    @staticmethod
+    def record(request, response, timer, timings, elapsed):
+        serialize = timings['serialize'] + timings['render']
+
+        route = route_name(request)
+        metrics.inc('octofit_requests_total', route=route, method=request.method, status=str(response.status_code))
+        metrics.observe('octofit_request_duration_seconds', elapsed, route=route)
+        metrics.observe('octofit_request_queries', timer.count, QUERY_BUCKETS, route=route)
+        metrics.observe('octofit_request_query_seconds', timer.seconds, route=route)
+        metrics.observe('octofit_request_serialize_seconds', serialize, route=route)
+        if not response.streaming:
+            metrics.observe('octofit_response_size_bytes', len(response.content), SIZE_BUCKETS, route=route)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timer.seconds * 1000:.1f};desc="{timer.count} queries"',
+            f'serialize;dur={serialize * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+        return response
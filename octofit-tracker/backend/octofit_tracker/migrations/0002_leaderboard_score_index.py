@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='score',
+            field=models.IntegerField(db_index=True),
+        ),
+    ]
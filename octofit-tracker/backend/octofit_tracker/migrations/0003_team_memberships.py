@@ -0,0 +1,63 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:16
+
+import json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def members_to_memberships(apps, schema_editor):
+    Team = apps.get_model('octofit_tracker', 'Team')
+    User = apps.get_model('octofit_tracker', 'User')
+    TeamMembership = apps.get_model('octofit_tracker', 'TeamMembership')
+    user_ids = dict(User.objects.values_list('email', 'id'))
+    memberships = {}
+    for team in Team.objects.all():
+        try:
+            emails = json.loads(team.members or '[]')
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(emails, list):
+            continue
+        for email in emails:
+            user_id = user_ids.get(email)
+            # A user listed on several teams keeps the first one
+            if user_id is not None and user_id not in memberships:
+                memberships[user_id] = TeamMembership(team_id=team.id, user_id=user_id)
+    TeamMembership.objects.bulk_create(memberships.values())
+
+
+def memberships_to_members(apps, schema_editor):
+    Team = apps.get_model('octofit_tracker', 'Team')
+    TeamMembership = apps.get_model('octofit_tracker', 'TeamMembership')
+    members = {}
+    for team_id, email in TeamMembership.objects.values_list('team_id', 'user__email'):
+        members.setdefault(team_id, []).append(email)
+    for team in Team.objects.all():
+        team.members = json.dumps(members.get(team.id, []))
+        team.save(update_fields=['members'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0002_leaderboard_score_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='octofit_tracker.team')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='membership', to='octofit_tracker.user')),
+            ],
+            options={
+                'db_table': 'team_memberships',
+            },
+        ),
+        migrations.RunPython(members_to_memberships, memberships_to_members),
+        migrations.RemoveField(
+            model_name='team',
+            name='members',
+        ),
+    ]
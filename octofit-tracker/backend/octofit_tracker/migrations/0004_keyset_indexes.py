@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_team_memberships'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='score',
+            field=models.IntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['date', 'id'], name='activities_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['score', 'id'], name='leaderboard_score_id_idx'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def resolve_user_emails(apps, schema_editor):
+    User = apps.get_model('octofit_tracker', 'User')
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    Leaderboard = apps.get_model('octofit_tracker', 'Leaderboard')
+    user_ids = dict(User.objects.values_list('email', 'id'))
+
+    emails = set(Activity.objects.values_list('user', flat=True).distinct())
+    emails |= set(Leaderboard.objects.values_list('user', flat=True).distinct())
+    # Rows pointing at an email with no user keep their history under a
+    # placeholder user rather than being dropped
+    for email in sorted(emails - set(user_ids)):
+        user_ids[email] = User.objects.create(name=email, email=email, age=0).id
+
+    for email in emails:
+        Activity.objects.filter(user=email).update(user_ref_id=user_ids[email])
+
+    # One leaderboard entry per user from now on: keep the best score
+    seen = set()
+    for entry in Leaderboard.objects.order_by('user', '-score', 'id'):
+        if entry.user in seen:
+            entry.delete()
+            continue
+        seen.add(entry.user)
+        entry.user_ref_id = user_ids[entry.user]
+        entry.save(update_fields=['user_ref'])
+
+
+def restore_user_emails(apps, schema_editor):
+    User = apps.get_model('octofit_tracker', 'User')
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    Leaderboard = apps.get_model('octofit_tracker', 'Leaderboard')
+    for user_id, email in User.objects.values_list('id', 'email'):
+        Activity.objects.filter(user_ref_id=user_id).update(user=email)
+        Leaderboard.objects.filter(user_ref_id=user_id).update(user=email)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='user_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.user'),
+        ),
+        migrations.AddField(
+            model_name='leaderboard',
+            name='user_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.user'),
+        ),
+        migrations.RunPython(resolve_user_emails, restore_user_emails),
+        # A default lets the email columns be re-added when migrating back
+        migrations.AlterField(
+            model_name='activity',
+            name='user',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='user',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.RemoveField(
+            model_name='activity',
+            name='user',
+        ),
+        migrations.RemoveField(
+            model_name='leaderboard',
+            name='user',
+        ),
+        migrations.RenameField(
+            model_name='activity',
+            old_name='user_ref',
+            new_name='user',
+        ),
+        migrations.RenameField(
+            model_name='leaderboard',
+            old_name='user_ref',
+            new_name='user',
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='octofit_tracker.user'),
+        ),
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entry', to='octofit_tracker.user'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'date'], name='activities_user_date_idx'),
+        ),
+    ]
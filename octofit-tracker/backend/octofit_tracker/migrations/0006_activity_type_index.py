@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0005_user_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['activity_type', 'date'], name='activities_type_date_idx'),
+        ),
+    ]
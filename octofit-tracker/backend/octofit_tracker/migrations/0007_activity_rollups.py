@@ -0,0 +1,37 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_activity_type_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=4)),
+                ('period_start', models.DateField()),
+                ('total_duration', models.FloatField(default=0)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('team', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.team')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.user')),
+            ],
+            options={
+                'db_table': 'activity_rollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('team__isnull', True)), fields=('period', 'user', 'period_start'), name='activity_rollups_user_period_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('period', 'team', 'period_start'), name='activity_rollups_team_period_uniq'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:48
+
+import json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _count(value):
+    """A non-negative whole number from the old JSON, or None."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        return None
+    return int(value)
+
+
+def parse_exercises(text):
+    """The old ``exercises`` JSON as ``WorkoutExercise`` field dicts; unreadable entries are skipped."""
+    try:
+        items = json.loads(text or '[]')
+    except (TypeError, ValueError):
+        return []
+    exercises = []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, str):
+            item = {'name': item}
+        if not isinstance(item, dict) or not isinstance(item.get('name'), str) or not item['name'].strip():
+            continue
+        duration = _count(item.get('duration_seconds'))
+        if duration is None and _count(item.get('duration_minutes')) is not None:
+            duration = _count(item['duration_minutes'] * 60)
+        exercises.append({
+            'name': item['name'].strip()[:100],
+            'sets': _count(item.get('sets')),
+            'reps': _count(item.get('reps')),
+            'duration_seconds': duration,
+        })
+    return exercises
+
+
+def split_exercises(apps, schema_editor):
+    Workout = apps.get_model('octofit_tracker', 'Workout')
+    WorkoutExercise = apps.get_model('octofit_tracker', 'WorkoutExercise')
+    batch = []
+    for workout_id, text in Workout.objects.values_list('id', 'exercises').iterator(chunk_size=2000):
+        for position, fields in enumerate(parse_exercises(text)):
+            batch.append(WorkoutExercise(workout_id=workout_id, position=position, **fields))
+        if len(batch) >= 2000:
+            WorkoutExercise.objects.bulk_create(batch)
+            batch = []
+    WorkoutExercise.objects.bulk_create(batch)
+
+
+def join_exercises(apps, schema_editor):
+    Workout = apps.get_model('octofit_tracker', 'Workout')
+    WorkoutExercise = apps.get_model('octofit_tracker', 'WorkoutExercise')
+    exercises = {}
+    rows = WorkoutExercise.objects.order_by('workout', 'position').values(
+        'workout_id', 'name', 'sets', 'reps', 'duration_seconds',
+    )
+    for row in rows:
+        workout_id = row.pop('workout_id')
+        exercises.setdefault(workout_id, []).append({key: value for key, value in row.items() if value is not None})
+    for workout_id, items in exercises.items():
+        Workout.objects.filter(pk=workout_id).update(exercises=json.dumps(items))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkoutExercise',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('sets', models.PositiveIntegerField(blank=True, null=True)),
+                ('reps', models.PositiveIntegerField(blank=True, null=True)),
+                ('duration_seconds', models.PositiveIntegerField(blank=True, null=True)),
+                # No reverse accessor until the old exercises column is gone
+                ('workout', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.workout')),
+            ],
+            options={
+                'db_table': 'workout_exercises',
+                'ordering': ('workout', 'position'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='workoutexercise',
+            index=models.Index(fields=['name', 'sets'], name='workout_ex_name_sets_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutexercise',
+            index=models.Index(fields=['name', 'duration_seconds'], name='workout_ex_name_duration_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='workoutexercise',
+            constraint=models.UniqueConstraint(fields=('workout', 'position'), name='workout_exercises_workout_position_uniq'),
+        ),
+        migrations.RunPython(split_exercises, join_exercises),
+        migrations.RemoveField(
+            model_name='workout',
+            name='exercises',
+        ),
+        migrations.AlterField(
+            model_name='workoutexercise',
+            name='workout',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='exercises', to='octofit_tracker.workout'),
+        ),
+    ]
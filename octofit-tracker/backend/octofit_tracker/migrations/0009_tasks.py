@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_workout_exercises'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('key', models.CharField(blank=True, default='', max_length=200)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('run_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('attempts', models.IntegerField(default=0)),
+                ('coalesced', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'db_table': 'tasks',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'run_at'], name='tasks_status_run_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('name', 'key'), name='tasks_pending_name_key_uniq'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0010_changes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='leaderboard',
+            name='leaderboard_score_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-score', 'id'], name='leaderboard_score_desc_id_idx'),
+        ),
+    ]
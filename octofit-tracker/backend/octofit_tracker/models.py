@@ -15,7 +15,6 @@ class User(models.Model):
 
 class Team(models.Model):
     name = models.CharField(max_length=100)
-    members = models.TextField(default='[]')  # JSON list of user emails
 
     class Meta:
         db_table = 'teams'
@@ -23,38 +22,179 @@ class Team(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def member_emails(self):
+        # Reads the prefetched memberships when the queryset prefetched them
+        return [membership.user.email for membership in self.memberships.all()]
+
+
+class TeamMembership(models.Model):
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='memberships')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='membership')  # one team per user
+
+    class Meta:
+        db_table = 'team_memberships'
+
+    def __str__(self):
+        return f"{self.user} in {self.team}"
+
 
 class Activity(models.Model):
-    user = models.CharField(max_length=100)  # references User email
+    # Covered by the (user, date) index below, so no separate index on user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activities', db_index=False)
     activity_type = models.CharField(max_length=100)
     duration = models.FloatField()  # in minutes
     date = models.DateField()
 
     class Meta:
         db_table = 'activities'
+        indexes = [
+            # Per-user history and date-window queries
+            models.Index(fields=['user', 'date'], name='activities_user_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activities_type_date_idx'),
+            # Keyset pagination order
+            models.Index(fields=['date', 'id'], name='activities_date_id_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user} - {self.activity_type}"
+        return f"{self.user.email} - {self.activity_type}"
 
 
 class Leaderboard(models.Model):
-    user = models.CharField(max_length=100)  # references User email
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='leaderboard_entry')
     score = models.IntegerField()
 
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            # Ranking and keyset pagination order, ('-score', 'id'): a mixed
+            # direction sort isn't served by an all-ascending index
+            models.Index(fields=['-score', 'id'], name='leaderboard_score_desc_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email}: {self.score}"
+
+
+class ActivityRollup(models.Model):
+    DAY = 'day'
+    WEEK = 'week'
+    PERIOD_CHOICES = [(DAY, 'Day'), (WEEK, 'Week')]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # the day itself, or the Monday of the week
+    # Exactly one of user / team is set: a per-user or a per-team total
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    team = models.ForeignKey(Team, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    total_duration = models.FloatField(default=0)  # in minutes
+    activity_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'activity_rollups'
+        # The unique indexes also serve the per-user and per-team range reads
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'user', 'period_start'], condition=models.Q(team__isnull=True),
+                name='activity_rollups_user_period_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['period', 'team', 'period_start'], condition=models.Q(user__isnull=True),
+                name='activity_rollups_team_period_uniq',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.user}: {self.score}"
+        owner = f"user {self.user_id}" if self.user_id else f"team {self.team_id}"
+        return f"{owner} {self.period} of {self.period_start}: {self.total_duration} min"
 
 
 class Workout(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
-    exercises = models.TextField(default='[]')  # JSON list of exercises
 
     class Meta:
         db_table = 'workouts'
 
     def __str__(self):
         return self.name
+
+
+class WorkoutExercise(models.Model):
+    # Covered by the (workout, position) unique index below
+    workout = models.ForeignKey(Workout, on_delete=models.CASCADE, related_name='exercises', db_index=False)
+    position = models.PositiveIntegerField()  # order within the workout
+    name = models.CharField(max_length=100)
+    sets = models.PositiveIntegerField(null=True, blank=True)
+    reps = models.PositiveIntegerField(null=True, blank=True)
+    duration_seconds = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'workout_exercises'
+        ordering = ('workout', 'position')
+        constraints = [
+            models.UniqueConstraint(fields=['workout', 'position'], name='workout_exercises_workout_position_uniq'),
+        ]
+        indexes = [
+            # Exercise filters on the workout list: a name, then sets or duration
+            models.Index(fields=['name', 'sets'], name='workout_ex_name_sets_idx'),
+            models.Index(fields=['name', 'duration_seconds'], name='workout_ex_name_duration_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.workout}: {self.name}"
+
+
+class Task(models.Model):
+    """A unit of background work, run by ``manage.py run_workers`` (see taskqueue.py)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)  # a registered task
+    key = models.CharField(max_length=200, blank=True, default='')  # argument and deduplication key
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    run_at = models.DateTimeField()  # not claimed before this
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    coalesced = models.IntegerField(default=0)  # enqueues merged into this task
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        db_table = 'tasks'
+        constraints = [
+            # At most one pending task per name and key: later enqueues coalesce into it.
+            # djongo doesn't create partial indexes; on MongoDB taskqueue.claim() folds duplicates
+            models.UniqueConstraint(
+                fields=['name', 'key'], condition=models.Q(status='pending'), name='tasks_pending_name_key_uniq',
+            ),
+        ]
+        indexes = [
+            # Claiming: due pending tasks, oldest first
+            models.Index(fields=['status', 'run_at'], name='tasks_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}({self.key}) {self.status}"
+
+
+class Change(models.Model):
+    """
+    One write to an API resource, for delta sync (``GET /api/changes/``).
+
+    The auto-increment id is the sync token: a client passes the last id it
+    has seen and gets every object changed after it. Deletes are kept as
+    tombstones (``deleted``) so clients can drop their copy.
+    """
+    resource = models.CharField(max_length=20)  # an API resource name, e.g. 'activities'
+    object_id = models.CharField(max_length=64)
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'changes'
+
+    def __str__(self):
+        return f"{self.id} {self.resource}/{self.object_id}{' deleted' if self.deleted else ''}"
@@ -0,0 +1,83 @@
+import threading
+from . import metrics
+
+try:
+    from pymongo import monitoring
+except ImportError:  # pragma: no cover - SQLite-only deployments
+    monitoring = None
+
+metrics.describe('octofit_mongo_pool_connections', 'Open connections in the pymongo pool.')
+metrics.describe('octofit_mongo_pool_checked_out', 'Pool connections currently in use.')
+metrics.describe('octofit_mongo_pool_checkout_failures_total', 'Checkouts that failed, e.g. on waitQueueTimeoutMS.')
+
+
+class PoolStats:
+    """Per-server pymongo pool usage, fed by :class:`PoolStatsListener`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, address):
+        return self._pools.setdefault(address, {
+            'max_pool_size': None, 'open': 0, 'checked_out': 0, 'created_total': 0, 'checkout_failures': 0,
+        })
+
+    def update(self, address, **changes):
+        host = '%s:%s' % address
+        with self._lock:
+            pool = self._pool(host)
+            for key, value in changes.items():
+                if key == 'max_pool_size':
+                    pool[key] = value
+                else:
+                    pool[key] = max(0, pool[key] + value)
+            metrics.set_gauge('octofit_mongo_pool_connections', pool['open'], server=host)
+            metrics.set_gauge('octofit_mongo_pool_checked_out', pool['checked_out'], server=host)
+
+    def snapshot(self):
+        with self._lock:
+            return {host: dict(pool) for host, pool in self._pools.items()}
+
+
+pool_stats = PoolStats()
+
+
+if monitoring is not None:
+    class PoolStatsListener(monitoring.ConnectionPoolListener):
+        def pool_created(self, event):
+            pool_stats.update(event.address, max_pool_size=event.options.get('maxPoolSize'))
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_created(self, event):
+            pool_stats.update(event.address, open=1, created_total=1)
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            pool_stats.update(event.address, open=-1)
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            pool_stats.update(event.address, checkout_failures=1)
+            metrics.inc('octofit_mongo_pool_checkout_failures_total', server='%s:%s' % event.address)
+
+        def connection_checked_out(self, event):
+            pool_stats.update(event.address, checked_out=1)
+
+        def connection_checked_in(self, event):
+            pool_stats.update(event.address, checked_out=-1)
+
+
+def register_pool_listener():
+    """Report pool usage of every MongoClient created from now on."""
+    if monitoring is not None:
+        monitoring.register(PoolStatsListener())
@@ -0,0 +1,134 @@
+import base64
+import json
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from .base_url import absolute_url
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the full ordering key.
+
+    The view's ``ordering`` (e.g. ``('-date', '-id')``) must end in a unique
+    field. The cursor stores the boundary row's values for every ordering
+    field, so each page is a single ``WHERE (date, id) < (...) LIMIT n`` range
+    read on an index and deep pages cost the same as the first one. Unlike
+    DRF's ``CursorPagination`` no offset is kept for rows sharing a date.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.take_page(list(self.page_queryset(queryset, request, view)))
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        The unevaluated query for the requested page, one row past its end.
+
+        Split from :meth:`take_page` so async views can fetch the rows with
+        the async ORM in between.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        values, self.reverse = self.decode_cursor(request)
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self._flip(name) for name in ordering)
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(ordering, values))
+        self.has_cursor = values is not None
+        return queryset[:self.page_size + 1]
+
+    def take_page(self, rows):
+        """Trim the rows fetched from :meth:`page_queryset` to the page."""
+        self.has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        # Going backwards there is always a page after the one we came from
+        if not self.page or not (self.has_more or self.reverse):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.page or not (self.has_more if self.reverse else self.has_cursor):
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        payload = {'v': [field.value_to_string(obj) for field in self.fields]}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        url = absolute_url(self.request, self.request.get_full_path())
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if len(payload['v']) != len(self.fields):
+                raise ValueError(token)
+            values = [field.to_python(raw) for field, raw in zip(self.fields, payload['v'])]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(payload.get('r'))
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def _seek(self, ordering, values):
+        """Rows strictly after ``values`` in ``ordering``: a row-value comparison."""
+        condition = Q()
+        for i, name in enumerate(ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for prefix_name, value in zip(ordering[:i], values[:i]):
+                step &= Q(**{prefix_name.lstrip('-'): value})
+            condition |= step
+        return condition
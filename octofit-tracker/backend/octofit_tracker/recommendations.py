@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from .models import Activity, Workout, WorkoutExercise
+from .repositories import analytics_repository
+from .search import WORKOUT_FIELD_WEIGHTS, field_term_weights, tokenize
+
+# A user's profile is built from this many of their latest activities
+RECENT_ACTIVITIES = 50
+
+# Share of the score from activity-type similarity and from duration closeness
+TYPE_WEIGHT = 0.8
+DURATION_WEIGHT = 0.2
+
+# Assumed pace when a workout's exercises give sets and reps but no duration
+SECONDS_PER_REP = 4
+REST_SECONDS_PER_SET = 60
+
+
+def estimated_minutes(exercises):
+    """Rough length of a workout from ``(name, sets, reps, duration_seconds)`` rows; NaN without any."""
+    seconds = 0
+    for _, sets, reps, duration_seconds in exercises:
+        sets = sets or 1
+        seconds += sets * ((duration_seconds or (reps or 0) * SECONDS_PER_REP) + REST_SECONDS_PER_SET)
+    return seconds / 60 if exercises else np.nan
+
+
+class WorkoutFeatures:
+    """
+    Workouts as rows of a matrix over the terms of the known activity types.
+
+    A row holds the field-weighted frequency of each of those terms in the
+    workout's name, exercise names and description, L2-normalised, so one
+    matrix-vector product with a user's normalised activity profile gives
+    the cosine similarity of every workout. Rows are rewritten in place when
+    a workout is saved; a deleted workout's row is reused by the next new one.
+    """
+
+    def __init__(self, vocabulary, capacity=1024):
+        self._lock = threading.Lock()
+        self.vocabulary = {term: column for column, term in enumerate(sorted(vocabulary))}
+        self._matrix = np.zeros((capacity, len(self.vocabulary)), dtype=np.float32)
+        self._minutes = np.full(capacity, np.nan, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._pks = [None] * capacity  # row -> workout pk
+        self._rows = {}  # workout pk -> row
+        self._payloads = {}  # workout pk -> (name, description)
+        self._free = []
+        self._size = 0  # rows handed out so far
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls, chunk_size=2000):
+        vocabulary = set()
+        for activity_type in analytics_repository().activity_type_counts():
+            vocabulary.update(tokenize(activity_type))
+        exercises = defaultdict(list)
+        rows = WorkoutExercise.objects.order_by().values_list('workout_id', 'name', 'sets', 'reps', 'duration_seconds')
+        for workout_id, *exercise in rows.iterator(chunk_size=chunk_size):
+            exercises[workout_id].append(exercise)
+        features = cls(vocabulary)
+        workouts = Workout.objects.order_by().values_list('id', 'name', 'description')
+        for pk, name, description in workouts.iterator(chunk_size=chunk_size):
+            features.set_workout(pk, name, description, exercises.pop(pk, ()))
+        return features
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _vector(self, weights):
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term, weight in weights.items():
+            column = self.vocabulary.get(term)
+            if column is not None:
+                vector[column] += weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _grow(self):
+        capacity = 2 * len(self._alive)
+        matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        minutes = np.full(capacity, np.nan, dtype=np.float32)
+        minutes[:self._size] = self._minutes[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._matrix, self._minutes, self._alive = matrix, minutes, alive
+        self._pks.extend([None] * (capacity - len(self._pks)))
+
+    def set_workout(self, pk, name, description, exercises):
+        """Add or replace a workout; ``exercises`` are ``(name, sets, reps, duration_seconds)`` rows."""
+        vector = self._vector(field_term_weights([
+            (name, WORKOUT_FIELD_WEIGHTS['name']),
+            (' '.join(exercise[0] for exercise in exercises), WORKOUT_FIELD_WEIGHTS['exercises']),
+            (description, WORKOUT_FIELD_WEIGHTS['description']),
+        ]))
+        with self._lock:
+            row = self._rows.get(pk)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    if self._size == len(self._alive):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                self._rows[pk] = row
+                self._pks[row] = pk
+            self._matrix[row] = vector
+            self._minutes[row] = estimated_minutes(exercises)
+            self._alive[row] = True
+            self._payloads[pk] = (name, description)
+
+    def remove_workout(self, pk):
+        with self._lock:
+            row = self._rows.pop(pk, None)
+            if row is None:
+                return
+            self._alive[row] = False
+            self._pks[row] = None
+            del self._payloads[pk]
+            self._free.append(row)
+
+    def profile(self, activities):
+        """
+        A user's normalised activity-type vector and median session length
+        from ``(activity_type, duration)`` pairs; types weigh by total duration.
+        """
+        weights = defaultdict(float)
+        durations = []
+        for activity_type, duration in activities:
+            durations.append(duration)
+            for term in set(tokenize(activity_type)):
+                weights[term] += duration
+        return self._vector(weights), float(np.median(durations)) if durations else None
+
+    def recommend(self, profile, typical_minutes=None, limit=10):
+        """Best ``limit`` workouts for ``profile`` as ``(score, pk, name, description, minutes)``."""
+        with self._lock:
+            size = self._size
+            scores = TYPE_WEIGHT * (self._matrix[:size] @ profile)
+            minutes = self._minutes[:size]
+            if typical_minutes:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    closeness = np.exp(-np.abs(np.log(minutes / typical_minutes)))
+                scores += DURATION_WEIGHT * np.nan_to_num(closeness)
+            scores[~self._alive[:size]] = -np.inf
+            count = min(limit, len(self._rows))
+            if not count:
+                return []
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            results = []
+            for row in top.tolist():
+                pk = self._pks[row]
+                minutes_row = None if np.isnan(minutes[row]) else float(minutes[row])
+                results.append((float(scores[row]), pk, *self._payloads[pk], minutes_row))
+            return results
+
+
+_features = None
+_build_lock = threading.Lock()
+
+
+def get_features():
+    """
+    This process's workout features, built on first use.
+
+    Workout writes through the API update them in place (see
+    :func:`update_workout`); they are rebuilt after
+    ``OCTOFIT_RECOMMENDATION_FEATURES_TTL`` seconds to pick up writes from
+    other workers and activity types that appeared since.
+    """
+    global _features
+    features = _features
+    if features is None or time.monotonic() - features.built_at > settings.OCTOFIT_RECOMMENDATION_FEATURES_TTL:
+        with _build_lock:
+            if _features is features:
+                _features = WorkoutFeatures.build()
+            features = _features
+    return features
+
+
+def reset_features():
+    global _features
+    _features = None
+
+
+def update_workout(workout, exercises):
+    if _features is not None:
+        _features.set_workout(workout.pk, workout.name, workout.description, exercises)
+
+
+def remove_workout(pk):
+    if _features is not None:
+        _features.remove_workout(pk)
+
+
+def recommend_workouts(user, limit=10):
+    """Workouts for ``user`` ranked against the types and lengths of their latest activities."""
+    activities = list(
+        Activity.objects.filter(user=user).order_by('-date', '-id')
+        .values_list('activity_type', 'duration')[:RECENT_ACTIVITIES]
+    )
+    features = get_features()
+    profile, typical_minutes = features.profile(activities)
+    results = features.recommend(profile, typical_minutes, limit) if activities else []
+    return {
+        'user': str(user.pk),
+        'based_on': {'activities': len(activities), 'typical_duration': typical_minutes},
+        'results': [
+            {
+                'id': str(pk),
+                'name': name,
+                'description': description,
+                'estimated_minutes': None if minutes is None else round(minutes, 1),
+                'score': round(score, 4),
+            }
+            for score, pk, name, description, minutes in results
+        ],
+    }
@@ -0,0 +1,10 @@
+from rest_framework import renderers
+from . import metrics
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF's JSON renderer, timed as the request's ``render`` phase."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,162 @@
+from datetime import datetime, time
+from django.db import connection
+from django.db.models import Count, Sum
+from .filters import filter_activities
+from .models import User, Team, TeamMembership, Activity, Leaderboard
+
+# Duration totals are rounded so the database's summation order can't make
+# the two repositories disagree in the last bits of a float.
+TOTAL_PRECISION = 6
+
+
+def _total(value):
+    return round(value or 0.0, TOTAL_PRECISION)
+
+
+class OrmAnalyticsRepository:
+    """The analytics reads through the Django ORM; used on SQL databases."""
+
+    def ranked_entries(self, team_id=None, limit=None):
+        """``(user_id, score)`` best first (score, then id), optionally for one team."""
+        entries = Leaderboard.objects.order_by('-score', 'id')
+        if team_id is not None:
+            entries = entries.filter(user__membership__team=team_id)
+        if limit is not None:
+            entries = entries[:limit]
+        return entries.values_list('user_id', 'score').iterator()
+
+    def activity_totals(self, user_ids=None, date_from=None, date_to=None):
+        """``{user_id: (total_duration, activity_count)}``, grouped in the database."""
+        activities = Activity.objects.all()
+        if user_ids is not None:
+            activities = activities.filter(user_id__in=user_ids)
+        activities = filter_activities(activities, date_from=date_from, date_to=date_to)
+        rows = activities.values('user_id').annotate(total=Sum('duration'), count=Count('id')).order_by()
+        return {row['user_id']: (_total(row['total']), row['count']) for row in rows}
+
+    def users_with_teams(self, user_ids):
+        """``{user_id: (email, name, team_id, team_name)}``; team fields are None without a team."""
+        rows = User.objects.filter(pk__in=user_ids).values_list(
+            'id', 'email', 'name', 'membership__team_id', 'membership__team__name',
+        )
+        return {user_id: tuple(rest) for user_id, *rest in rows}
+
+    def activity_type_counts(self):
+        """``{activity_type: number of activities}``."""
+        rows = Activity.objects.values_list('activity_type').annotate(count=Count('id')).order_by()
+        return dict(rows)
+
+    def daily_activity_totals(self, chunk_size=1000):
+        """``(user_id, day, total_duration, activity_count)`` per user and day with activity."""
+        rows = Activity.objects.values('user_id', 'date').annotate(
+            total=Sum('duration'), count=Count('id'),
+        ).order_by().values_list('user_id', 'date', 'total', 'count')
+        for user_id, day, total, count in rows.iterator(chunk_size=chunk_size):
+            yield user_id, day, _total(total), count
+
+
+class MongoAnalyticsRepository:
+    """
+    The same reads as native pymongo queries and aggregation pipelines.
+
+    djongo translates ORM queries to SQL and the SQL to MongoDB, which is
+    slow for joins and fails on many GROUP BYs. These go to the collections
+    directly, using the column names of the Django models (djongo stores
+    ``DateField`` values as midnight datetimes).
+    """
+
+    def __init__(self, database):
+        self.db = database
+
+    @staticmethod
+    def _column(model, name):
+        return model._meta.get_field(name).column
+
+    def _collection(self, model):
+        return self.db[model._meta.db_table]
+
+    @staticmethod
+    def _as_datetime(day):
+        return datetime.combine(day, time.min)
+
+    @staticmethod
+    def _as_date(value):
+        return value.date() if isinstance(value, datetime) else value
+
+    def _team_user_ids(self, team_id):
+        user, team = self._column(TeamMembership, 'user'), self._column(TeamMembership, 'team')
+        return [doc[user] for doc in self._collection(TeamMembership).find({team: team_id}, {user: 1})]
+
+    def ranked_entries(self, team_id=None, limit=None):
+        user, score = self._column(Leaderboard, 'user'), self._column(Leaderboard, 'score')
+        query = {}
+        if team_id is not None:
+            query[user] = {'$in': self._team_user_ids(team_id)}
+        cursor = self._collection(Leaderboard).find(query, {user: 1, score: 1}).sort([(score, -1), ('id', 1)])
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return ((doc[user], doc[score]) for doc in cursor)
+
+    def activity_totals(self, user_ids=None, date_from=None, date_to=None):
+        user, day = self._column(Activity, 'user'), self._column(Activity, 'date')
+        match = {}
+        if user_ids is not None:
+            match[user] = {'$in': list(user_ids)}
+        window = {}
+        if date_from is not None:
+            window['$gte'] = self._as_datetime(date_from)
+        if date_to is not None:
+            window['$lte'] = self._as_datetime(date_to)
+        if window:
+            match[day] = window
+        pipeline = [
+            {'$match': match},
+            {'$group': {
+                '_id': f'${user}',
+                'total': {'$sum': f"${self._column(Activity, 'duration')}"},
+                'count': {'$sum': 1},
+            }},
+        ]
+        return {
+            doc['_id']: (_total(doc['total']), doc['count'])
+            for doc in self._collection(Activity).aggregate(pipeline)
+        }
+
+    def users_with_teams(self, user_ids):
+        user_ids = list(user_ids)
+        member, team = self._column(TeamMembership, 'user'), self._column(TeamMembership, 'team')
+        team_ids = {
+            doc[member]: doc[team]
+            for doc in self._collection(TeamMembership).find({member: {'$in': user_ids}}, {member: 1, team: 1})
+        }
+        teams = self._collection(Team).find({'id': {'$in': list(set(team_ids.values()))}}, {'id': 1, 'name': 1})
+        team_names = {doc['id']: doc['name'] for doc in teams}
+        users = self._collection(User).find({'id': {'$in': user_ids}}, {'id': 1, 'email': 1, 'name': 1})
+        rows = {}
+        for doc in users:
+            team_id = team_ids.get(doc['id'])
+            rows[doc['id']] = (doc['email'], doc['name'], team_id, team_names.get(team_id))
+        return rows
+
+    def activity_type_counts(self):
+        pipeline = [{'$group': {'_id': f"${self._column(Activity, 'activity_type')}", 'count': {'$sum': 1}}}]
+        return {doc['_id']: doc['count'] for doc in self._collection(Activity).aggregate(pipeline)}
+
+    def daily_activity_totals(self, chunk_size=1000):
+        user, day = self._column(Activity, 'user'), self._column(Activity, 'date')
+        pipeline = [{'$group': {
+            '_id': {'user': f'${user}', 'day': f'${day}'},
+            'total': {'$sum': f"${self._column(Activity, 'duration')}"},
+            'count': {'$sum': 1},
+        }}]
+        cursor = self._collection(Activity).aggregate(pipeline, allowDiskUse=True, batchSize=chunk_size)
+        for doc in cursor:
+            yield doc['_id']['user'], self._as_date(doc['_id']['day']), _total(doc['total']), doc['count']
+
+
+def analytics_repository():
+    """The native MongoDB repository when the database is djongo, the ORM one otherwise."""
+    if connection.vendor == 'djongo':
+        connection.ensure_connection()
+        return MongoAnalyticsRepository(connection.connection)
+    return OrmAnalyticsRepository()
@@ -0,0 +1,167 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import ActivityRollup, TeamMembership
+from .repositories import analytics_repository
+
+
+def period_starts(day):
+    """The (period, period_start) buckets an activity on ``day`` counts towards."""
+    return (
+        (ActivityRollup.DAY, day),
+        (ActivityRollup.WEEK, day - timedelta(days=day.weekday())),
+    )
+
+
+def _accumulate(deltas, changes, team_ids):
+    """
+    Fold ``(user_id, date, duration, count)`` changes into ``deltas``.
+
+    ``duration`` and ``count`` are signed: a removed activity contributes
+    ``(-duration, -1)``.
+
+    Keys are ``(period, period_start, user_id, team_id)`` with exactly one of
+    the two ids set; values are ``[duration, count]``. Team totals follow the
+    user's team at the time the change is recorded.
+    """
+    for user_id, day, duration, count in changes:
+        team_id = team_ids.get(user_id)
+        for period, start in period_starts(day):
+            keys = [(period, start, user_id, None)]
+            if team_id is not None:
+                keys.append((period, start, None, team_id))
+            for key in keys:
+                deltas[key][0] += duration
+                deltas[key][1] += count
+
+
+def collect_rollup_deltas(changes):
+    """Rollup deltas for a batch of ``(user_id, date, duration, count)`` changes."""
+    changes = list(changes)
+    team_ids = dict(
+        TeamMembership.objects.filter(user_id__in={change[0] for change in changes})
+        .values_list('user_id', 'team_id')
+    )
+    deltas = defaultdict(lambda: [0.0, 0])
+    _accumulate(deltas, changes, team_ids)
+    return deltas
+
+
+def _add_rollup(period, start, user_id, team_id, duration, count):
+    """Add to one rollup row, creating it if missing."""
+    rows = ActivityRollup.objects.filter(period=period, period_start=start, user_id=user_id, team_id=team_id)
+    if rows.update(total_duration=F('total_duration') + duration, activity_count=F('activity_count') + count):
+        return
+    try:
+        # In a savepoint so a lost race doesn't break the outer transaction
+        with transaction.atomic():
+            ActivityRollup.objects.create(
+                period=period, period_start=start, user_id=user_id, team_id=team_id,
+                total_duration=duration, activity_count=count,
+            )
+    except IntegrityError:
+        # A concurrent first write for the key created the row meanwhile
+        rows.update(total_duration=F('total_duration') + duration, activity_count=F('activity_count') + count)
+
+
+def apply_rollup_deltas(deltas):
+    """Add each delta to its rollup row with one update, creating missing rows."""
+    with transaction.atomic():
+        for (period, start, user_id, team_id), (duration, count) in deltas.items():
+            if duration or count:
+                _add_rollup(period, start, user_id, team_id, duration, count)
+
+
+def move_team_rollups(moves):
+    """
+    Move what users contributed to team rollups along with them.
+
+    ``moves`` is ``{user_id: (from_team_id, to_team_id)}``, either id None
+    for no team. Each user's rollup rows are subtracted from the old team's
+    rollups and added to the new team's, so later edits and deletes of
+    their activities, which go to the current team, balance out.
+    """
+    moves = {user_id: teams for user_id, teams in moves.items() if teams[0] != teams[1]}
+    if not moves:
+        return
+    deltas = defaultdict(lambda: [0.0, 0])
+    rows = ActivityRollup.objects.filter(user_id__in=moves).values_list(
+        'user_id', 'period', 'period_start', 'total_duration', 'activity_count',
+    )
+    for user_id, period, start, duration, count in rows:
+        from_team_id, to_team_id = moves[user_id]
+        for team_id, sign in ((from_team_id, -1), (to_team_id, 1)):
+            if team_id is not None:
+                delta = deltas[period, start, None, team_id]
+                delta[0] += sign * duration
+                delta[1] += sign * count
+    apply_rollup_deltas(deltas)
+
+
+def remove_user_rollups(user_ids):
+    """
+    Take users' contribution out of their teams' rollups; call it before
+    deleting them. Their own rollup rows go with the delete.
+    """
+    move_team_rollups({
+        user_id: (team_id, None)
+        for user_id, team_id in TeamMembership.objects.filter(user_id__in=user_ids).values_list('user_id', 'team_id')
+    })
+
+
+def record_rollup_change(before=None, after=None):
+    """
+    Update the day and week rollups for an activity write.
+
+    ``before`` and ``after`` are the activity's state around the write, as
+    for :func:`octofit_tracker.leaderboard.record_activity_change`.
+    """
+    changes = []
+    if before is not None:
+        changes.append((before.user_id, before.date, -before.duration, -1))
+    if after is not None:
+        changes.append((after.user_id, after.date, after.duration, 1))
+    apply_rollup_deltas(collect_rollup_deltas(changes))
+
+
+def record_rollup_batch(activities, deleted=False):
+    """Update the rollups for newly created, or ``deleted``, ``activities`` in one pass."""
+    sign = -1 if deleted else 1
+    apply_rollup_deltas(collect_rollup_deltas(
+        (activity.user_id, activity.date, sign * activity.duration, sign) for activity in activities
+    ))
+
+
+def rebuild_rollups(batch_size=1000, repository=None):
+    """
+    Recompute every rollup from the activity table.
+
+    Activities are summed per user and day by the database (see
+    :meth:`OrmAnalyticsRepository.daily_activity_totals`), and only those
+    daily totals are streamed here, ``batch_size`` rows at a time, to be
+    folded into day and week rollups. The existing rows are locked before the
+    totals are read, so activity writes committing meanwhile wait and then
+    apply their deltas to the rebuilt rows; a write creating a new row isn't
+    held back, and MongoDB has no row locks. Returns the number of rollup
+    rows written.
+    """
+    repository = repository or analytics_repository()
+    with transaction.atomic():
+        list(ActivityRollup.objects.select_for_update().values_list('id', flat=True))
+        team_ids = dict(TeamMembership.objects.values_list('user_id', 'team_id'))
+        deltas = defaultdict(lambda: [0.0, 0])
+        _accumulate(deltas, repository.daily_activity_totals(chunk_size=batch_size), team_ids)
+
+        ActivityRollup.objects.all().delete()
+        ActivityRollup.objects.bulk_create(
+            (
+                ActivityRollup(
+                    period=period, period_start=start, user_id=user_id, team_id=team_id,
+                    total_duration=duration, activity_count=count,
+                )
+                for (period, start, user_id, team_id), (duration, count) in deltas.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(deltas)
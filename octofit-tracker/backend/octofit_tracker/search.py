@@ -0,0 +1,296 @@
+import heapq
+import itertools
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from operator import itemgetter
+from django.conf import settings
+from .models import Workout, WorkoutExercise
+from .repositories import analytics_repository
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Relative weight of a term found in each workout field
+WORKOUT_FIELD_WEIGHTS = {'name': 3.0, 'exercises': 2.0, 'description': 1.0}
+ACTIVITY_TYPE_WEIGHT = 3.0
+
+# Vocabulary terms a trailing prefix may expand to
+MAX_PREFIX_EXPANSIONS = 50
+
+# Multi-term queries with at most this many matches score them all directly
+DIRECT_SCORING_LIMIT = 10000
+
+WORKOUT = 'workout'
+ACTIVITY_TYPE = 'activity_type'
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def field_term_weights(fields):
+    """``{term: weight}`` for ``(text, field_weight)`` pairs; repeats within a field count logarithmically."""
+    weights = defaultdict(float)
+    for text, field_weight in fields:
+        for term, count in Counter(tokenize(text)).items():
+            weights[term] += field_weight * (1 + math.log(count))
+    return dict(weights)
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over workouts and activity types.
+
+    Each posting holds a document's field-weighted term frequency; a query
+    scores documents by the sum of ``idf * weight`` over its terms. All terms
+    must match, and the last one also matches as a prefix so results follow
+    the user while they type.
+
+    Multi-term queries first intersect the matching document sets. Postings
+    are also kept sorted by weight, so when many documents match a query
+    walks them best first and stops as soon as no document left can make
+    the top ``limit``.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._doc_ids = {}  # (kind, pk) -> doc id
+        self._documents = {}  # doc id -> (kind, {term: weight}, payload)
+        self._kinds = defaultdict(set)  # kind -> doc ids
+        self._postings = {}  # term -> {doc id: weight}
+        self._ranked = {}  # term -> [(weight, doc id)] best first, built lazily
+        self._vocabulary = []  # sorted terms, for prefix matches
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls, chunk_size=2000):
+        index = cls()
+        exercises = defaultdict(list)
+        rows = WorkoutExercise.objects.order_by().values_list('workout_id', 'name')
+        for workout_id, name in rows.iterator(chunk_size=chunk_size):
+            exercises[workout_id].append(name)
+        workouts = Workout.objects.order_by().values_list('id', 'name', 'description')
+        for pk, name, description in workouts.iterator(chunk_size=chunk_size):
+            index.add_workout(pk, name, description, exercises.pop(pk, ()))
+        for activity_type, count in analytics_repository().activity_type_counts().items():
+            index.count_activity_type(activity_type, count)
+        return index
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _add(self, kind, pk, weights, payload):
+        with self._lock:
+            self._remove(kind, pk)
+            # Small integer ids keep the postings cheap to hash and intersect
+            doc = self._doc_ids[kind, pk] = next(self._ids)
+            self._documents[doc] = (kind, weights, payload)
+            self._kinds[kind].add(doc)
+            for term, weight in weights.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    insort(self._vocabulary, term)
+                postings[doc] = weight
+                self._ranked.pop(term, None)
+
+    def _remove(self, kind, pk):
+        with self._lock:
+            doc = self._doc_ids.pop((kind, pk), None)
+            if doc is None:
+                return
+            _, weights, _ = self._documents.pop(doc)
+            self._kinds[kind].discard(doc)
+            for term in weights:
+                postings = self._postings[term]
+                del postings[doc]
+                self._ranked.pop(term, None)
+                if not postings:
+                    del self._postings[term]
+                    del self._vocabulary[bisect_left(self._vocabulary, term)]
+
+    def add_workout(self, pk, name, description, exercise_names):
+        weights = field_term_weights([
+            (name, WORKOUT_FIELD_WEIGHTS['name']),
+            (' '.join(exercise_names), WORKOUT_FIELD_WEIGHTS['exercises']),
+            (description, WORKOUT_FIELD_WEIGHTS['description']),
+        ])
+        self._add(WORKOUT, pk, weights, {'id': str(pk), 'name': name, 'description': description})
+
+    def remove_workout(self, pk):
+        self._remove(WORKOUT, pk)
+
+    def count_activity_type(self, activity_type, delta):
+        """Add ``delta`` activities of ``activity_type``; the type drops out at zero."""
+        with self._lock:
+            doc = self._doc_ids.get((ACTIVITY_TYPE, activity_type))
+            payload = self._documents[doc][2] if doc is not None else None
+            count = (payload['activities'] if payload else 0) + delta
+            if count <= 0:
+                self._remove(ACTIVITY_TYPE, activity_type)
+            elif payload:
+                payload['activities'] = count
+            else:
+                weights = field_term_weights([(activity_type, ACTIVITY_TYPE_WEIGHT)])
+                self._add(ACTIVITY_TYPE, activity_type, weights, {'activity_type': activity_type, 'activities': count})
+
+    def _expand(self, prefix):
+        start = bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _ranked_postings(self, term):
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            ranked = sorted(
+                ((weight, doc) for doc, weight in self._postings[term].items()), key=itemgetter(0), reverse=True,
+            )
+            self._ranked[term] = ranked
+        return ranked
+
+    def _stream(self, expansions):
+        """``(score, doc id)`` for every posting of ``expansions``, best first."""
+        streams = [
+            ((idf * weight, doc) for weight, doc in self._ranked_postings(term))
+            for idf, term in expansions
+        ]
+        return streams[0] if len(streams) == 1 else heapq.merge(*streams, key=itemgetter(0), reverse=True)
+
+    def _size(self, expansions):
+        return sum(len(self._postings[term]) for _, term in expansions)
+
+    def _docs(self, expansions):
+        if len(expansions) == 1:
+            return self._postings[expansions[0][1]].keys()
+        return set().union(*(self._postings[term].keys() for _, term in expansions))
+
+    def _best_score(self, expansions):
+        return max(idf * self._ranked_postings(term)[0][0] for idf, term in expansions)
+
+    def _scorer(self, expansions):
+        """A function giving a document's score for one clause (0 if it doesn't match)."""
+        if len(expansions) == 1:
+            idf, term = expansions[0]
+            postings = self._postings[term]
+            return lambda doc: idf * postings.get(doc, 0.0)
+        weighted = [(idf, self._postings[term]) for idf, term in expansions]
+        return lambda doc: max(idf * postings.get(doc, 0.0) for idf, postings in weighted)
+
+    def search(self, query, kind=None, limit=20):
+        """Best ``limit`` matches for ``query`` as ``(score, kind, payload)``, best first."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            total = len(self._documents)
+            # Per query term, the (idf, term) pairs it matches
+            clauses = []
+            for position, term in enumerate(terms):
+                matched = self._expand(term) if position == len(terms) - 1 else [term]
+                expansions = [
+                    (math.log(1 + total / len(self._postings[t])), t) for t in matched if t in self._postings
+                ]
+                if not expansions:
+                    return []
+                clauses.append(expansions)
+            clauses.sort(key=self._size)
+
+            matches = None
+            if len(clauses) > 1 or kind is not None:
+                # Documents matching every clause (and the kind), intersected in C
+                doc_sets = [self._docs(expansions) for expansions in clauses]
+                if kind is not None:
+                    doc_sets.append(self._kinds[kind])
+                doc_sets.sort(key=len)
+                matches = doc_sets[0] & doc_sets[1]
+                for docs in doc_sets[2:]:
+                    matches &= docs
+                if not matches:
+                    return []
+                if len(matches) <= DIRECT_SCORING_LIMIT:
+                    scorers = [self._scorer(expansions) for expansions in clauses]
+                    scored = ((sum(clause_score(doc) for clause_score in scorers), doc) for doc in matches)
+                    return self._results(heapq.nlargest(limit, scored, key=itemgetter(0)))
+
+            # Walk the clause with the fewest postings best first and look the
+            # document up in the others; stop once nothing left can make the top
+            driver, others = clauses[0], clauses[1:]
+            others_bound = sum(self._best_score(expansions) for expansions in others)
+            scorers = [self._scorer(expansions) for expansions in others]
+            best, seen = [], set()  # best: min-heap of (score, -order, doc)
+            for order, (score, doc) in enumerate(self._stream(driver)):
+                if len(best) == limit and best[0][0] >= score + others_bound:
+                    break
+                if matches is not None and doc not in matches:
+                    continue
+                if len(driver) > 1:
+                    # Several prefix expansions can match a document; the first is its best
+                    if doc in seen:
+                        continue
+                    seen.add(doc)
+                entry = (score + sum(clause_score(doc) for clause_score in scorers), -order, doc)
+                if len(best) < limit:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+            return self._results((score, doc) for score, _, doc in sorted(best, reverse=True))
+
+    def _results(self, scored):
+        results = []
+        for score, doc in scored:
+            kind, _, payload = self._documents[doc]
+            results.append((score, kind, dict(payload)))
+        return results
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """
+    This process's index, built on first use.
+
+    Writes through the API update it in place (see :func:`index_workout` and
+    friends); it is rebuilt after ``OCTOFIT_SEARCH_INDEX_TTL`` seconds so
+    writes made by other workers or the admin show up too.
+    """
+    global _index
+    index = _index
+    if index is None or time.monotonic() - index.built_at > settings.OCTOFIT_SEARCH_INDEX_TTL:
+        with _build_lock:
+            if _index is index:
+                _index = SearchIndex.build()
+            index = _index
+    return index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def index_workout(workout, exercise_names):
+    if _index is not None:
+        _index.add_workout(workout.pk, workout.name, workout.description, exercise_names)
+
+
+def unindex_workout(pk):
+    if _index is not None:
+        _index.remove_workout(pk)
+
+
+def count_activity_types(deltas):
+    """Apply ``{activity_type: delta}`` activity counts to the index."""
+    if _index is not None:
+        for activity_type, delta in deltas.items():
+            if delta:
+                _index.count_activity_type(activity_type, delta)
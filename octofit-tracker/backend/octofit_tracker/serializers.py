@@ -1,57 +1,339 @@
+import json
+from collections.abc import Mapping
+from operator import attrgetter, itemgetter
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject, ManyRelatedField, RelatedField
+from rest_framework.validators import UniqueValidator
+from . import metrics
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, Workout, WorkoutExercise
+from .teams import set_team_members
+from .workouts import set_workout_exercises
+
+
+class DynamicFieldsMixin:
+    """Lets a ``fields`` keyword argument restrict a serializer to a subset of its fields."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """
+    List serializer that resolves each field's accessor once per list.
+
+    ``Serializer.to_representation`` re-walks the readable fields for every
+    row and goes through ``get_attribute`` for each value. Here plain model
+    columns (a single-attribute source, not a relation) are read with one
+    ``attrgetter``/``itemgetter`` built up front; every other field keeps
+    DRF's own lookup, so the output is the same as the default serializer.
+    """
+
+    def to_representation(self, data):
+        with metrics.timed('serialize'):
+            return self._to_representation(data)
+
+    def _to_representation(self, data):
+        # As in ListSerializer: only a manager is re-queried, never a queryset it may have evaluated
+        rows = data.all() if isinstance(data, BaseManager) else data
+        plan = None
+        result = []
+        for row in rows:
+            if plan is None:
+                plan = self._plan(isinstance(row, Mapping))
+            item = {}
+            for name, get, to_representation in plan:
+                try:
+                    value = get(row)
+                except SkipField:
+                    continue
+                if value is None or (isinstance(value, PKOnlyObject) and value.pk is None):
+                    item[name] = None
+                else:
+                    item[name] = to_representation(value)
+            result.append(item)
+        return result
+
+    def _plan(self, mapping):
+        model = getattr(getattr(self.child, 'Meta', None), 'model', None)
+        columns = {'pk'}
+        if model is not None:
+            for column in model._meta.concrete_fields:
+                columns.update((column.name, column.attname))
+        plan = []
+        for field in self.child._readable_fields:
+            get = field.get_attribute
+            simple = not isinstance(field, (RelatedField, ManyRelatedField, serializers.BaseSerializer))
+            if simple and len(field.source_attrs) == 1:
+                attr = field.source_attrs[0]
+                if mapping:
+                    get = itemgetter(attr)
+                elif attr in columns:
+                    get = attrgetter(attr)
+            plan.append((field.field_name, get, field.to_representation))
+        return plan
+
+
+def string_id():
+    """The primary key rendered as a string, as the frontend expects."""
+    return serializers.CharField(source='pk', read_only=True)
 
 
 class UserSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+    id = string_id()
+    # Expects the queryset to select_related('membership__team')
+    team = serializers.CharField(source='membership.team_id', read_only=True)
+    team_name = serializers.CharField(source='membership.team.name', read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'name', 'email', 'age']
-
-    def get_id(self, obj):
-        return str(obj.pk)
+        fields = ['id', 'name', 'email', 'age', 'team', 'team_name']
+        list_serializer_class = FastListSerializer
 
 
 class TeamSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+    id = string_id()
+    # Member emails; expects the queryset to prefetch_related('memberships__user')
+    members = serializers.ListField(
+        child=serializers.EmailField(), source='member_emails', required=False
+    )
 
     class Meta:
         model = Team
         fields = ['id', 'name', 'members']
+        list_serializer_class = FastListSerializer
+
+    def validate_members(self, value):
+        known = set(User.objects.filter(email__in=value).values_list('email', flat=True))
+        unknown = [email for email in value if email not in known]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown users: {', '.join(unknown)}")
+        return value
+
+    def create(self, validated_data):
+        emails = validated_data.pop('member_emails', [])
+        team = super().create(validated_data)
+        set_team_members(team, emails)
+        return team
+
+    def update(self, instance, validated_data):
+        emails = validated_data.pop('member_emails', None)
+        team = super().update(instance, validated_data)
+        if emails is not None:
+            set_team_members(team, emails)
+        return team
 
-    def get_id(self, obj):
-        return str(obj.pk)
 
+class MoveTeamSerializer(serializers.Serializer):
+    team = serializers.PrimaryKeyRelatedField(queryset=Team.objects.all(), allow_null=True)
 
-class ActivitySerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+
+class UserEmailField(serializers.SlugRelatedField):
+    """
+    A user addressed by email.
+
+    When the serializer context carries a ``users_by_email`` map (bulk
+    validation preloads one) lookups are served from it instead of one query
+    per value.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(slug_field='email', **kwargs)
+
+    def to_internal_value(self, data):
+        users = self.context.get('users_by_email')
+        if users is None:
+            return super().to_internal_value(data)
+        try:
+            return users[data]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+
+
+class ActivityBulkListSerializer(FastListSerializer):
+    """Validates each item on its own so one bad row doesn't reject the batch."""
+
+    def partition(self):
+        """Return ``(validated_items, errors)``; errors carry the item's index."""
+        if not isinstance(self.initial_data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        # Only strings: other values fail per item, in UserEmailField
+        emails = {
+            item['user'] for item in self.initial_data
+            if isinstance(item, dict) and isinstance(item.get('user'), str)
+        }
+        self.context['users_by_email'] = {user.email: user for user in User.objects.filter(email__in=emails)}
+        valid, errors = [], []
+        for index, item in enumerate(self.initial_data):
+            try:
+                valid.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        return valid, errors
+
+
+class ActivitySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    id = string_id()
+    # Clients keep addressing users by email; expects select_related('user')
+    user = UserEmailField(queryset=User.objects.all())
 
     class Meta:
         model = Activity
         fields = ['id', 'user', 'activity_type', 'duration', 'date']
-
-    def get_id(self, obj):
-        return str(obj.pk)
+        list_serializer_class = ActivityBulkListSerializer
 
 
 class LeaderboardSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+    id = string_id()
+    # Declared fields don't get the model's unique check; one entry per user
+    user = serializers.SlugRelatedField(
+        slug_field='email', queryset=User.objects.all(),
+        validators=[UniqueValidator(queryset=Leaderboard.objects.all())],
+    )
 
     class Meta:
         model = Leaderboard
         fields = ['id', 'user', 'score']
+        list_serializer_class = FastListSerializer
+
+
+class ActivityRollupSerializer(serializers.ModelSerializer):
+    id = string_id()
+    user = serializers.SlugRelatedField(slug_field='email', read_only=True)
+    team = serializers.CharField(source='team_id', read_only=True)
+
+    class Meta:
+        model = ActivityRollup
+        fields = ['id', 'period', 'period_start', 'user', 'team', 'total_duration', 'activity_count']
+        list_serializer_class = FastListSerializer
 
-    def get_id(self, obj):
-        return str(obj.pk)
+
+class WorkoutExerciseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkoutExercise
+        fields = ['name', 'sets', 'reps', 'duration_seconds']
 
 
 class WorkoutSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+    id = string_id()
+    # In order; expects the queryset to prefetch_related('exercises')
+    exercises = WorkoutExerciseSerializer(many=True, required=False)
 
     class Meta:
         model = Workout
         fields = ['id', 'name', 'description', 'exercises']
+        list_serializer_class = FastListSerializer
+
+    def to_internal_value(self, data):
+        # Older clients send the exercise list JSON-encoded, as it used to be stored
+        if isinstance(data, Mapping) and isinstance(data.get('exercises'), str):
+            try:
+                exercises = json.loads(data['exercises'])
+            except ValueError:
+                raise serializers.ValidationError({'exercises': ['Expected a list of exercises or its JSON.']})
+            data = {**data, 'exercises': exercises}
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        exercises = validated_data.pop('exercises', [])
+        workout = super().create(validated_data)
+        set_workout_exercises(workout, exercises)
+        return workout
+
+    def update(self, instance, validated_data):
+        exercises = validated_data.pop('exercises', None)
+        workout = super().update(instance, validated_data)
+        if exercises is not None:
+            set_workout_exercises(workout, exercises)
+        return workout
+
+
+class DateWindowQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        date_from, date_to = attrs.get('date_from'), attrs.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError('date_from must not be after date_to.')
+        return attrs
+
+
+class RankedLeaderboardQuerySerializer(DateWindowQuerySerializer):
+    top = serializers.IntegerField(required=False, min_value=1)
+    team = serializers.IntegerField(required=False)
+
+
+class ActivityQuerySerializer(DateWindowQuerySerializer):
+    user = serializers.EmailField(required=False)
+    activity_type = serializers.CharField(required=False)
+    min_duration = serializers.FloatField(required=False, min_value=0)
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in ActivitySerializer.Meta.fields]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown fields: {', '.join(unknown)}")
+        return names
+
+
+class LeaderboardExportQuerySerializer(serializers.Serializer):
+    top = serializers.IntegerField(required=False, min_value=1)
+    team = serializers.IntegerField(required=False)
+
+
+class WorkoutQuerySerializer(serializers.Serializer):
+    exercise = serializers.CharField(required=False)
+    min_sets = serializers.IntegerField(required=False, min_value=0)
+    min_duration_seconds = serializers.IntegerField(required=False, min_value=0)
+
+
+class RecommendationQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=50, default=10)
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField()
+    type = serializers.ChoiceField(choices=['workout', 'activity_type'], required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100, default=20)
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(required=False, min_value=0)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=1000, default=500)
+
+
+class RankedLeaderboardSerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    user = serializers.CharField()
+    name = serializers.CharField()
+    team = serializers.CharField(allow_null=True)
+    team_id = serializers.CharField(allow_null=True)
+    score = serializers.IntegerField()
+    total_duration = serializers.FloatField()
+    activity_count = serializers.IntegerField()
+    calories = serializers.IntegerField()
+
+    class Meta:
+        list_serializer_class = FastListSerializer
+
+
+class StatsQuerySerializer(DateWindowQuerySerializer):
+    period = serializers.ChoiceField(choices=ActivityRollup.PERIOD_CHOICES, default=ActivityRollup.WEEK)
+    scope = serializers.ChoiceField(choices=['user', 'team'], default='user')
+    user = serializers.EmailField(required=False)
+    team = serializers.IntegerField(required=False)
 
-    def get_id(self, obj):
-        return str(obj.pk)
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if 'user' in attrs:
+            attrs['scope'] = 'user'
+        elif 'team' in attrs:
+            attrs['scope'] = 'team'
+        return attrs
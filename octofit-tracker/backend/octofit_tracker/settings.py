@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 import os
 from pathlib import Path
+from urllib.parse import urlsplit
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +40,20 @@ if os.environ.get('CODESPACE_NAME'):
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_X_FORWARDED_HOST = True
 
+# Links the API hands out use the host a request reached us on. Requests
+# through a proxy setting X-Forwarded-Host link to that host if it is in
+# OCTOFIT_FORWARDED_HOSTS (comma-separated, ALLOWED_HOSTS syntax), and to
+# OCTOFIT_BASE_URL, resolved once at startup, if it isn't
+# (see octofit_tracker.base_url).
+OCTOFIT_BASE_URL = os.environ.get('OCTOFIT_BASE_URL') or (
+    f"https://{os.environ['CODESPACE_NAME']}-8000.app.github.dev"
+    if os.environ.get('CODESPACE_NAME')
+    else "http://localhost:8000"
+).rstrip('/')
+OCTOFIT_FORWARDED_HOSTS = [
+    host.strip() for host in os.environ.get('OCTOFIT_FORWARDED_HOSTS', '').split(',') if host.strip()
+] or [urlsplit(OCTOFIT_BASE_URL).hostname]
+
 
 # Application definition
 
@@ -56,6 +71,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware
+    'octofit_tracker.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,13 +112,108 @@ DATABASES = {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
+        # Keep each worker's connection between requests instead of opening
+        # one per request; 0 restores per-request connections
+        'CONN_MAX_AGE': int(os.environ.get('OCTOFIT_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+            'port': int(os.environ.get('OCTOFIT_MONGO_PORT', 27017)),
+            # pymongo pool, per worker process
+            'maxPoolSize': int(os.environ.get('OCTOFIT_MONGO_MAX_POOL_SIZE', 20)),
+            'minPoolSize': int(os.environ.get('OCTOFIT_MONGO_MIN_POOL_SIZE', 0)),
+            'maxIdleTimeMS': int(os.environ.get('OCTOFIT_MONGO_MAX_IDLE_TIME_MS', 300000)),
+            'waitQueueTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
         },
     }
 }
 
+# A local SQLite file instead of MongoDB, e.g. for `manage.py benchmark`
+if os.environ.get('OCTOFIT_SQLITE_PATH'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['OCTOFIT_SQLITE_PATH'],
+    }
+
+# Django REST framework
+REST_FRAMEWORK = {
+    # Keyset pagination over each viewset's indexed ``ordering``
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Bulk activity ingestion (POST /api/activities/bulk/)
+OCTOFIT_BULK_MAX_ITEMS = int(os.environ.get('OCTOFIT_BULK_MAX_ITEMS', 10000))
+OCTOFIT_BULK_BATCH_SIZE = int(os.environ.get('OCTOFIT_BULK_BATCH_SIZE', 500))
+
+# Streaming exports (GET /api/<resource>/export/<ndjson|csv>/): rows fetched
+# from the database per round trip
+OCTOFIT_EXPORT_CHUNK_SIZE = int(os.environ.get('OCTOFIT_EXPORT_CHUNK_SIZE', 2000))
+
+# Search (GET /api/search/): each process rebuilds its in-memory index after
+# this many seconds to pick up writes made by other workers
+OCTOFIT_SEARCH_INDEX_TTL = int(os.environ.get('OCTOFIT_SEARCH_INDEX_TTL', 300))
+
+# Workout recommendations (GET /api/users/<id>/recommended-workouts/): each
+# process rebuilds its workout feature matrix after this many seconds
+OCTOFIT_RECOMMENDATION_FEATURES_TTL = int(os.environ.get('OCTOFIT_RECOMMENDATION_FEATURES_TTL', 300))
+
+# Background tasks (manage.py run_workers): enqueues of the same task and key
+# within the coalescing window run once; failed tasks are retried with
+# exponential backoff, and tasks still running after the timeout are requeued
+OCTOFIT_TASK_COALESCE_SECONDS = int(os.environ.get('OCTOFIT_TASK_COALESCE_SECONDS', 5))
+OCTOFIT_TASK_MAX_ATTEMPTS = int(os.environ.get('OCTOFIT_TASK_MAX_ATTEMPTS', 3))
+OCTOFIT_TASK_RETRY_SECONDS = int(os.environ.get('OCTOFIT_TASK_RETRY_SECONDS', 30))
+OCTOFIT_TASK_TIMEOUT = int(os.environ.get('OCTOFIT_TASK_TIMEOUT', 600))
+
+# Change feed (GET /api/changes/): manage.py prune_changes deletes logged
+# changes older than this many days; clients behind that resync in full
+OCTOFIT_CHANGES_RETENTION_DAYS = int(os.environ.get('OCTOFIT_CHANGES_RETENTION_DAYS', 30))
+# Changes are served only once they are this many seconds old, so that a
+# transaction that took a lower id has committed; keep it above the longest
+# write transaction
+OCTOFIT_CHANGES_SETTLE_SECONDS = int(os.environ.get('OCTOFIT_CHANGES_SETTLE_SECONDS', 5))
+
+# API response cache. Writes invalidate it through generation counters stored
+# in the cache itself, so every worker has to share it: Redis at
+# OCTOFIT_REDIS_URL for any number of hosts, or a directory shared by the
+# workers of one host (OCTOFIT_CACHE_DIR). OCTOFIT_API_CACHE_LOCAL=1 caches in
+# process memory, which is only correct with a single worker process. With
+# none of these, responses aren't cached; ETags and 304s still work.
+OCTOFIT_REDIS_URL = os.environ.get('OCTOFIT_REDIS_URL')
+OCTOFIT_CACHE_DIR = os.environ.get('OCTOFIT_CACHE_DIR')
+OCTOFIT_API_CACHE_LOCAL = os.environ.get('OCTOFIT_API_CACHE_LOCAL') == '1'
+OCTOFIT_API_CACHE_TIMEOUT = int(os.environ.get('OCTOFIT_API_CACHE_TIMEOUT', 300))
+if OCTOFIT_REDIS_URL:
+    API_CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': OCTOFIT_REDIS_URL,
+    }
+elif OCTOFIT_CACHE_DIR:
+    API_CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': OCTOFIT_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+elif OCTOFIT_API_CACHE_LOCAL:
+    API_CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+else:
+    API_CACHE_BACKEND = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': API_CACHE_BACKEND,
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_ALL_METHODS = True
@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from . import metrics
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('octofit_tasks_enqueued_total', 'Tasks added to the queue, by task.')
+metrics.describe('octofit_tasks_coalesced_total', 'Enqueues merged into an already pending task, by task.')
+metrics.describe('octofit_tasks_processed_total', 'Tasks run by this process, by task and outcome.')
+metrics.describe('octofit_task_duration_seconds', 'Time spent running a task, by task.')
+metrics.describe('octofit_task_queue_depth', 'Tasks in the queue table, by status.')
+metrics.describe('octofit_task_queue_oldest_pending_seconds', 'Age of the oldest due pending task.')
+
+# Task name -> function taking the task's key
+TASKS = {}
+
+
+def register(name):
+    """Decorator: make a function of one string argument runnable as task ``name``."""
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, key='', delay=None):
+    """
+    Schedule task ``name`` for ``key`` once the current transaction commits.
+
+    Tasks are deduplicated on ``(name, key)``: while one is pending, further
+    enqueues only bump its ``coalesced`` count, so a burst of writes for one
+    user runs a single recompute. ``delay`` (default
+    ``OCTOFIT_TASK_COALESCE_SECONDS``) holds the task back so that a burst
+    can finish before it runs.
+
+    On SQL databases the partial unique index ``tasks_pending_name_key_uniq``
+    guarantees one pending task per key. djongo can't create it, so on
+    MongoDB concurrent enqueues may insert duplicates; :func:`claim` folds
+    them into the task it claims.
+    """
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name!r}')
+    if delay is None:
+        delay = settings.OCTOFIT_TASK_COALESCE_SECONDS
+    transaction.on_commit(partial(_enqueue, name, str(key), delay))
+
+
+def _enqueue(name, key, delay):
+    pending = Task.objects.filter(name=name, key=key, status=Task.PENDING)
+    if pending.update(coalesced=F('coalesced') + 1):
+        metrics.inc('octofit_tasks_coalesced_total', task=name)
+        return
+    try:
+        with transaction.atomic():
+            Task.objects.create(name=name, key=key, run_at=timezone.now() + timedelta(seconds=delay))
+    except IntegrityError:
+        # Another process enqueued it between the update and the insert
+        pending.update(coalesced=F('coalesced') + 1)
+        metrics.inc('octofit_tasks_coalesced_total', task=name)
+        return
+    metrics.inc('octofit_tasks_enqueued_total', task=name)
+
+
+def claim(worker, limit=1):
+    """
+    Mark up to ``limit`` due pending tasks as running for ``worker`` and return them.
+
+    Claiming is a conditional ``pending -> running`` update per task, which
+    is atomic on every backend, so two workers never run the same task even
+    without ``SELECT ... FOR UPDATE`` (MongoDB has none). Other pending
+    tasks with the same name and key, which only MongoDB lets in, were
+    enqueued before the claim, so the claimed run covers them: they are
+    deleted and counted as coalesced. Two workers may still each claim one
+    of such duplicates at the same moment, so tasks must be idempotent.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by('run_at', 'id')
+    claimed = []
+    for task_id, name, key in due.values_list('id', 'name', 'key')[:limit]:
+        updated = Task.objects.filter(pk=task_id, status=Task.PENDING).update(
+            status=Task.RUNNING, worker=worker, started_at=now, attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(task_id)
+            _collapse_duplicates(task_id, name, key)
+    return list(Task.objects.filter(pk__in=claimed, worker=worker).order_by('run_at', 'id'))
+
+
+def _collapse_duplicates(task_id, name, key):
+    duplicates = Task.objects.filter(name=name, key=key, status=Task.PENDING).exclude(pk=task_id)
+    merged = sum(coalesced + 1 for coalesced in duplicates.values_list('coalesced', flat=True))
+    if not merged:
+        return
+    duplicates.delete()
+    Task.objects.filter(pk=task_id).update(coalesced=F('coalesced') + merged)
+    metrics.inc('octofit_tasks_coalesced_total', merged, task=name)
+
+
+def _retry_or_fail(task, error):
+    """Put a failed task back in the queue with backoff, or leave it failed after the last attempt."""
+    if task.attempts < settings.OCTOFIT_TASK_MAX_ATTEMPTS:
+        backoff = timedelta(seconds=settings.OCTOFIT_TASK_RETRY_SECONDS * 2 ** (task.attempts - 1))
+        try:
+            with transaction.atomic():
+                Task.objects.filter(pk=task.pk).update(
+                    status=Task.PENDING, run_at=timezone.now() + backoff, last_error=error,
+                )
+            return
+        except IntegrityError:
+            pass  # a newer pending task for the same key will do the work
+    Task.objects.filter(pk=task.pk).update(status=Task.FAILED, last_error=error)
+
+
+def run_task(task):
+    """Run a claimed task; it is deleted when done. Returns True on success."""
+    started = time.perf_counter()
+    try:
+        TASKS[task.name](task.key)
+    except Exception:  # any failure is recorded on the task and retried
+        logger.exception('Task %s(%s) failed', task.name, task.key)
+        _retry_or_fail(task, traceback.format_exc(limit=20))
+        outcome = 'failed'
+    else:
+        Task.objects.filter(pk=task.pk).delete()
+        outcome = 'done'
+    metrics.observe('octofit_task_duration_seconds', time.perf_counter() - started, task=task.name)
+    metrics.inc('octofit_tasks_processed_total', task=task.name, outcome=outcome)
+    return outcome == 'done'
+
+
+def requeue_stale(timeout=None):
+    """
+    Hand tasks left running longer than ``timeout`` seconds (default
+    ``OCTOFIT_TASK_TIMEOUT``) by a worker that died back to the queue.
+    """
+    timeout = settings.OCTOFIT_TASK_TIMEOUT if timeout is None else timeout
+    stale = Task.objects.filter(status=Task.RUNNING, started_at__lt=timezone.now() - timedelta(seconds=timeout))
+    for task in stale:
+        _retry_or_fail(task, f'Worker {task.worker} did not finish within {timeout}s')
+
+
+def collect_queue_metrics():
+    """Queue depth per status and the age of the oldest due task, as gauges."""
+    depth = dict(Task.objects.values_list('status').annotate(count=Count('id')).order_by())
+    for status, _ in Task.STATUS_CHOICES:
+        metrics.set_gauge('octofit_task_queue_depth', depth.get(status, 0), status=status)
+    now = timezone.now()
+    oldest = Task.objects.filter(status=Task.PENDING, run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    metrics.set_gauge('octofit_task_queue_oldest_pending_seconds', (now - oldest).total_seconds() if oldest else 0)
+    return depth
+
+
+def run_due(worker='inline', batch_size=100):
+    """Run every due task in this thread; returns ``(processed, failed)``."""
+    processed = failed = 0
+    while True:
+        tasks = claim(worker, batch_size)
+        if not tasks:
+            return processed, failed
+        for task in tasks:
+            processed += 1
+            failed += not run_task(task)
+
+
+class WorkerPool:
+    """
+    ``threads`` worker threads polling the task table.
+
+    Each thread claims ``batch_size`` tasks at a time and sleeps
+    ``poll_interval`` seconds when the queue has nothing due. With
+    ``drain`` the pool stops once the queue has nothing due instead.
+    """
+
+    def __init__(self, threads=4, poll_interval=1.0, batch_size=1, drain=False):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.drain = drain
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def _work(self, number):
+        worker = f'{self._name}:{number}'
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                tasks = claim(worker, self.batch_size)
+                if not tasks:
+                    if self.drain:
+                        return
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                for task in tasks:
+                    ok = run_task(task)
+                    with self._lock:
+                        self.processed += 1
+                        self.failed += not ok
+        finally:
+            # Each thread has its own connection
+            connection.close()
+
+    def run(self):
+        """Run until :meth:`stop` (or, with ``drain``, until nothing is due)."""
+        requeue_stale()
+        workers = [
+            threading.Thread(target=self._work, args=(number,), name=f'octofit-worker-{number}', daemon=True)
+            for number in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=self.poll_interval)
+                if not self.drain:
+                    collect_queue_metrics()
+        finally:
+            self.stop()
+            for worker in workers:
+                worker.join()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,26 @@
+from .caching import invalidate
+from .leaderboard import rebuild_scores, rescore_user
+from .rollups import rebuild_rollups
+from .taskqueue import register
+
+RESCORE_USER = 'leaderboard.rescore_user'
+REBUILD_LEADERBOARD = 'leaderboard.rebuild'
+REBUILD_ROLLUPS = 'rollups.rebuild'
+
+
+@register(RESCORE_USER)
+def rescore_user_task(user_id):
+    rescore_user(int(user_id))
+    invalidate('leaderboard')
+
+
+@register(REBUILD_LEADERBOARD)
+def rebuild_leaderboard_task(key=''):
+    rebuild_scores()
+    invalidate('leaderboard')
+
+
+@register(REBUILD_ROLLUPS)
+def rebuild_rollups_task(key=''):
+    rebuild_rollups()
+    invalidate('stats')
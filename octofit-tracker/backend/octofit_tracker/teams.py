@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import Q
+from .changes import TEAMS, USERS, record_changes
+from .models import User, TeamMembership
+from .rollups import move_team_rollups
+
+
+@transaction.atomic
+def set_team_members(team, emails):
+    """
+    Make ``emails`` the exact member list of ``team``.
+
+    A user belongs to at most one team, so users taken from another team are
+    moved rather than duplicated. Unknown emails are ignored; serializers
+    validate them before calling this. Users who joined or left, and the
+    teams they were taken from, are logged as changed.
+    """
+    users = list(User.objects.filter(email__in=emails).only('id'))
+    user_ids = {user.pk for user in users}
+    # user_id -> team_id of current members and of the users' current teams
+    before = dict(
+        TeamMembership.objects.filter(Q(team=team) | Q(user__in=users)).values_list('user_id', 'team_id')
+    )
+    TeamMembership.objects.filter(team=team).exclude(user__in=users).delete()
+    TeamMembership.objects.filter(user__in=users).exclude(team=team).delete()
+    TeamMembership.objects.bulk_create([
+        TeamMembership(team=team, user=user) for user in users if before.get(user.pk) != team.pk
+    ])
+    left = {user_id for user_id, team_id in before.items() if team_id == team.pk and user_id not in user_ids}
+    moves = {user_id: (before[user_id], None) for user_id in left}
+    moves.update((user_id, (before.get(user_id), team.pk)) for user_id in user_ids)
+    move_team_rollups(moves)
+    record_changes(USERS, left | {user_id for user_id in user_ids if before.get(user_id) != team.pk})
+    record_changes(TEAMS, {team_id for team_id in before.values() if team_id != team.pk})
+
+
+@transaction.atomic
+def move_user_to_team(user, team):
+    """
+    Put ``user`` on ``team`` (or on no team when ``team`` is None).
+
+    The membership row is locked for the duration of the transaction so two
+    concurrent moves of the same user serialise. The user's contribution to
+    team rollups moves with them, and both teams' member lists are logged as
+    changed. Returns the previous team.
+    """
+    membership = (
+        TeamMembership.objects.select_for_update().select_related('team')
+        .filter(user=user).first()
+    )
+    previous = membership.team if membership else None
+    if team is None:
+        if membership:
+            membership.delete()
+    elif membership is None:
+        TeamMembership.objects.create(team=team, user=user)
+    elif membership.team_id != team.pk:
+        membership.team = team
+        membership.save(update_fields=['team'])
+    if previous != team:
+        move_team_rollups({user.pk: (previous.pk if previous else None, team.pk if team else None)})
+        record_changes(TEAMS, {t.pk for t in (previous, team) if t is not None})
+    return previous
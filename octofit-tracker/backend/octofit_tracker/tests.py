@@ -1,10 +1,76 @@
-from django.test import TestCase
+from django.contrib.admin import site
+from django.core.cache import caches
+from django.test import AsyncClient, TestCase as DjangoTestCase, override_settings
+from unittest import mock, skipIf
 from django.urls import reverse
 from rest_framework.test import APIClient
-from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework import serializers, status
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from contextlib import contextmanager
+from io import StringIO
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+import asyncio
+import csv
+from .models import (
+    User, Team, TeamMembership, Activity, ActivityRollup, Change, Leaderboard, Task, Workout, WorkoutExercise,
+)
+from .leaderboard import activity_points, ranked_leaderboard
+from .repositories import MongoAnalyticsRepository, OrmAnalyticsRepository
+from .rollups import apply_rollup_deltas, rebuild_rollups
+from .recommendations import WorkoutFeatures, reset_features
+from .async_views import ASYNC_READ_VIEWS
+from .search import SearchIndex, reset_index
+from .admin import ActivityAdmin, WorkoutAdmin
+from .caching import API_CACHE
+from .changes import TEAMS, USERS, WORKOUTS, record_changes
+from .urls import router
+from .serializers import ActivitySerializer, RankedLeaderboardSerializer, UserSerializer
+from .workouts import set_workout_exercises
+from .tasks import REBUILD_ROLLUPS, RESCORE_USER
+from . import metrics, mongo_pool, taskqueue
 import json
-from datetime import date
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'octofit-api-tests'},
+})
+class TestCase(DjangoTestCase):
+    """Starts every test with an empty API response cache, kept in memory as for a single worker."""
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        caches[API_CACHE].clear()
+        reset_index()
+        reset_features()
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label=None):
+        """Fail if the block runs more than ``budget`` queries; lists them if it does."""
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f"  {query['sql']}" for query in context.captured_queries)
+            self.fail(f'{label or "Block"} ran {executed} queries, budget is {budget}:\n{queries}')
+
+
+def hero(email):
+    """The user an activity or leaderboard row points at, created on first use."""
+    return User.objects.get_or_create(email=email, defaults={'name': email.split('@')[0], 'age': 30})[0]
 
 
 class UserModelTest(TestCase):
@@ -26,13 +92,17 @@ class UserModelTest(TestCase):
 
 class TeamModelTest(TestCase):
     def setUp(self):
-        self.team = Team.objects.create(
-            name='Team Marvel',
-            members=json.dumps(['ironman@marvel.com', 'spiderman@marvel.com'])
-        )
+        self.team = Team.objects.create(name='Team Marvel')
+        for name, email in [('Tony Stark', 'ironman@marvel.com'), ('Peter Parker', 'spiderman@marvel.com')]:
+            TeamMembership.objects.create(
+                team=self.team, user=User.objects.create(name=name, email=email, age=30)
+            )
 
     def test_team_creation(self):
         self.assertEqual(self.team.name, 'Team Marvel')
+        self.assertEqual(
+            sorted(self.team.member_emails), ['ironman@marvel.com', 'spiderman@marvel.com']
+        )
 
     def test_team_str(self):
         self.assertEqual(str(self.team), 'Team Marvel')
@@ -41,14 +111,14 @@ class TeamModelTest(TestCase):
 class ActivityModelTest(TestCase):
     def setUp(self):
         self.activity = Activity.objects.create(
-            user='ironman@marvel.com',
+            user=hero('ironman@marvel.com'),
             activity_type='Flying in Iron Man suit',
             duration=60.0,
             date=date(2024, 1, 10)
         )
 
     def test_activity_creation(self):
-        self.assertEqual(self.activity.user, 'ironman@marvel.com')
+        self.assertEqual(self.activity.user.email, 'ironman@marvel.com')
         self.assertEqual(self.activity.activity_type, 'Flying in Iron Man suit')
         self.assertEqual(self.activity.duration, 60.0)
 
@@ -59,12 +129,12 @@ class ActivityModelTest(TestCase):
 class LeaderboardModelTest(TestCase):
     def setUp(self):
         self.entry = Leaderboard.objects.create(
-            user='thor@marvel.com',
+            user=hero('thor@marvel.com'),
             score=950
         )
 
     def test_leaderboard_creation(self):
-        self.assertEqual(self.entry.user, 'thor@marvel.com')
+        self.assertEqual(self.entry.user.email, 'thor@marvel.com')
         self.assertEqual(self.entry.score, 950)
 
     def test_leaderboard_str(self):
@@ -77,8 +147,11 @@ class WorkoutModelTest(TestCase):
         self.workout = Workout.objects.create(
             name='Iron Man Endurance Circuit',
             description='High-intensity endurance training.',
-            exercises=json.dumps([{'name': 'Repulsor blast holds', 'sets': 3, 'reps': 15}])
         )
+        set_workout_exercises(self.workout, [
+            {'name': 'Repulsor blast holds', 'sets': 3, 'reps': 15},
+            {'name': 'Core stabilization plank', 'sets': 3, 'duration_seconds': 60},
+        ])
 
     def test_workout_creation(self):
         self.assertEqual(self.workout.name, 'Iron Man Endurance Circuit')
@@ -86,6 +159,14 @@ class WorkoutModelTest(TestCase):
     def test_workout_str(self):
         self.assertEqual(str(self.workout), 'Iron Man Endurance Circuit')
 
+    def test_exercises_keep_their_order(self):
+        self.assertEqual(
+            [str(exercise) for exercise in self.workout.exercises.all()],
+            ['Iron Man Endurance Circuit: Repulsor blast holds', 'Iron Man Endurance Circuit: Core stabilization plank'],
+        )
+        set_workout_exercises(self.workout, [{'name': 'Suit-up sprint drills', 'sets': 4}])
+        self.assertEqual(list(self.workout.exercises.values_list('position', 'name')), [(0, 'Suit-up sprint drills')])
+
 
 class UserAPITest(TestCase):
     def setUp(self):
@@ -118,10 +199,11 @@ class UserAPITest(TestCase):
 class TeamAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
-        self.team = Team.objects.create(
-            name='Team DC',
-            members=json.dumps(['batman@dc.com', 'superman@dc.com'])
-        )
+        self.batman = User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+        self.superman = User.objects.create(name='Clark Kent', email='superman@dc.com', age=35)
+        self.team = Team.objects.create(name='Team DC')
+        TeamMembership.objects.create(team=self.team, user=self.batman)
+        TeamMembership.objects.create(team=self.team, user=self.superman)
 
     def test_list_teams(self):
         response = self.client.get('/api/teams/')
@@ -131,13 +213,81 @@ class TeamAPITest(TestCase):
         response = self.client.get(f'/api/teams/{self.team.pk}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Team DC')
+        self.assertEqual(sorted(response.data['members']), ['batman@dc.com', 'superman@dc.com'])
+
+    def test_user_exposes_team(self):
+        response = self.client.get(f'/api/users/{self.batman.pk}/')
+        self.assertEqual(response.data['team'], str(self.team.pk))
+        self.assertEqual(response.data['team_name'], 'Team DC')
+
+    def test_create_team_moves_members(self):
+        data = {'name': 'Justice League', 'members': ['batman@dc.com']}
+        response = self.client.post('/api/teams/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['members'], ['batman@dc.com'])
+        self.assertEqual(self.team.member_emails, ['superman@dc.com'])
+
+    def test_update_team_members(self):
+        response = self.client.patch(
+            f'/api/teams/{self.team.pk}/', {'members': ['superman@dc.com']}, format='json'
+        )
+        self.assertEqual(response.data['members'], ['superman@dc.com'])
+        self.assertFalse(TeamMembership.objects.filter(user=self.batman).exists())
+
+    def test_unknown_member_rejected(self):
+        response = self.client.patch(
+            f'/api/teams/{self.team.pk}/', {'members': ['joker@dc.com']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MoveTeamAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+        self.dc = Team.objects.create(name='Team DC')
+        self.league = Team.objects.create(name='Justice League')
+        TeamMembership.objects.create(team=self.dc, user=self.user)
+
+    def test_move_team_updates_user_and_both_teams(self):
+        response = self.client.post(
+            f'/api/users/{self.user.pk}/move-team/',
+            {'email': 'bruce@wayne.com', 'team': self.league.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['email'], 'bruce@wayne.com')
+        self.assertEqual(response.data['user']['team'], str(self.league.pk))
+        self.assertEqual(response.data['from_team']['members'], [])
+        self.assertEqual(response.data['to_team']['members'], ['bruce@wayne.com'])
+
+    def test_move_to_no_team(self):
+        response = self.client.post(
+            f'/api/users/{self.user.pk}/move-team/', {'team': None}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['to_team'])
+        self.assertFalse(TeamMembership.objects.filter(user=self.user).exists())
+
+    def test_invalid_user_fields_leave_membership_untouched(self):
+        response = self.client.post(
+            f'/api/users/{self.user.pk}/move-team/',
+            {'age': 'old', 'team': self.league.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TeamMembership.objects.get(user=self.user).team, self.dc)
+
+    def test_unknown_team_rejected(self):
+        response = self.client.post(
+            f'/api/users/{self.user.pk}/move-team/', {'team': 999999}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class ActivityAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
         self.activity = Activity.objects.create(
-            user='batman@dc.com',
+            user=hero('batman@dc.com'),
             activity_type='Gotham night patrol',
             duration=180.0,
             date=date(2024, 1, 10)
@@ -151,13 +301,19 @@ class ActivityAPITest(TestCase):
         response = self.client.get(f'/api/activities/{self.activity.pk}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['activity_type'], 'Gotham night patrol')
+        self.assertEqual(response.data['user'], 'batman@dc.com')
+
+    def test_create_activity_for_unknown_user(self):
+        data = {'user': 'joker@dc.com', 'activity_type': 'Heist', 'duration': 30.0, 'date': '2024-01-10'}
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class LeaderboardAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
         self.entry = Leaderboard.objects.create(
-            user='thor@marvel.com',
+            user=hero('thor@marvel.com'),
             score=950
         )
 
@@ -170,6 +326,529 @@ class LeaderboardAPITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['score'], 950)
 
+    def test_second_entry_for_a_user_is_rejected(self):
+        response = self.client.post('/api/leaderboard/', {'user': 'thor@marvel.com', 'score': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user', response.data)
+        response = self.client.put(
+            f'/api/leaderboard/{self.entry.pk}/', {'user': 'thor@marvel.com', 'score': 1}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class RankedLeaderboardAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        User.objects.create(name='Thor Odinson', email='thor@marvel.com', age=1500)
+        User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+        User.objects.create(name='Clark Kent', email='superman@dc.com', age=35)
+        self.marvel = Team.objects.create(name='Team Marvel')
+        dc = Team.objects.create(name='Team DC')
+        for team, email in [(self.marvel, 'thor@marvel.com'), (dc, 'batman@dc.com'), (dc, 'superman@dc.com')]:
+            TeamMembership.objects.create(team=team, user=User.objects.get(email=email))
+        Leaderboard.objects.create(user=hero('thor@marvel.com'), score=950)
+        Leaderboard.objects.create(user=hero('batman@dc.com'), score=910)
+        Leaderboard.objects.create(user=hero('superman@dc.com'), score=910)
+        Activity.objects.create(user=hero('thor@marvel.com'), activity_type='Hammer', duration=120.0, date=date(2024, 1, 14))
+        Activity.objects.create(user=hero('thor@marvel.com'), activity_type='Flying', duration=30.0, date=date(2024, 2, 1))
+        Activity.objects.create(user=hero('batman@dc.com'), activity_type='Patrol', duration=180.0, date=date(2024, 1, 10))
+
+    def test_ranked_rows_are_joined(self):
+        response = self.client.get('/api/leaderboard/ranked/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['rank'] for row in response.data], [1, 2, 2])
+        thor = response.data[0]
+        self.assertEqual(thor['name'], 'Thor Odinson')
+        self.assertEqual(thor['team'], 'Team Marvel')
+        self.assertEqual(thor['total_duration'], 150.0)
+        self.assertEqual(thor['activity_count'], 2)
+        self.assertEqual(thor['calories'], 1500)
+
+    def test_ranked_top_and_team_filters(self):
+        response = self.client.get('/api/leaderboard/ranked/', {'top': 1})
+        self.assertEqual([row['user'] for row in response.data], ['thor@marvel.com'])
+        response = self.client.get('/api/leaderboard/ranked/', {'team': self.marvel.pk})
+        self.assertEqual([row['user'] for row in response.data], ['thor@marvel.com'])
+
+    def test_ranked_date_window(self):
+        response = self.client.get('/api/leaderboard/ranked/', {'date_from': '2024-02-01'})
+        thor = response.data[0]
+        self.assertEqual(thor['total_duration'], 30.0)
+        self.assertEqual(thor['activity_count'], 1)
+
+    def test_ranked_rejects_bad_window(self):
+        response = self.client.get(
+            '/api/leaderboard/ranked/', {'date_from': '2024-03-01', 'date_to': '2024-01-01'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LeaderboardScoringTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Leaderboard.objects.create(user=hero('thor@marvel.com'), score=100)
+        Leaderboard.objects.create(user=hero('batman@dc.com'), score=50)
+        hero('flash@dc.com')
+
+    def score(self, email):
+        return Leaderboard.objects.get(user__email=email).score
+
+    def test_activity_create_adds_points(self):
+        data = {'user': 'batman@dc.com', 'activity_type': 'Patrol', 'duration': 60.0, 'date': '2024-01-10'}
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.score('batman@dc.com'), 110)
+
+    def test_activity_create_for_new_user_creates_entry(self):
+        data = {'user': 'flash@dc.com', 'activity_type': 'Run', 'duration': 5.0, 'date': '2024-01-10'}
+        self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(self.score('flash@dc.com'), 5)
+
+    def test_activity_update_applies_delta(self):
+        response = self.client.post('/api/activities/', {
+            'user': 'thor@marvel.com', 'activity_type': 'Hammer', 'duration': 30.0, 'date': '2024-01-14',
+        }, format='json')
+        self.client.patch(f"/api/activities/{response.data['id']}/", {'duration': 45.0}, format='json')
+        self.assertEqual(self.score('thor@marvel.com'), 145)
+        self.client.patch(f"/api/activities/{response.data['id']}/", {'user': 'batman@dc.com'}, format='json')
+        self.assertEqual(self.score('thor@marvel.com'), 100)
+        self.assertEqual(self.score('batman@dc.com'), 95)
+
+    def test_activity_delete_removes_points(self):
+        response = self.client.post('/api/activities/', {
+            'user': 'thor@marvel.com', 'activity_type': 'Hammer', 'duration': 30.0, 'date': '2024-01-14',
+        }, format='json')
+        self.client.delete(f"/api/activities/{response.data['id']}/")
+        self.assertEqual(self.score('thor@marvel.com'), 100)
+
+    def test_concurrent_first_writes_for_a_user_both_count(self):
+        # Another request creates the entry between this one's update and insert
+        Leaderboard.objects.create(user=hero('flash@dc.com'), score=5)
+        real_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            response = self.client.post('/api/activities/', {
+                'user': 'flash@dc.com', 'activity_type': 'Run', 'duration': 5.0, 'date': '2024-01-10',
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.score('flash@dc.com'), 10)
+
+    def test_rebuild_leaderboard_command(self):
+        Activity.objects.create(user=hero('thor@marvel.com'), activity_type='Hammer', duration=120.0, date=date(2024, 1, 14))
+        Activity.objects.create(user=hero('flash@dc.com'), activity_type='Run', duration=5.0, date=date(2024, 1, 13))
+        call_command('rebuild_leaderboard', stdout=StringIO())
+        self.assertEqual(self.score('thor@marvel.com'), 120)
+        self.assertEqual(self.score('batman@dc.com'), 0)
+        self.assertEqual(self.score('flash@dc.com'), 5)
+
+
+class ActivityBulkAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        hero('batman@dc.com')
+        hero('flash@dc.com')
+
+    def item(self, email='batman@dc.com', duration=10.0, day='2024-01-10'):
+        return {'user': email, 'activity_type': 'Run', 'duration': duration, 'date': day}
+
+    def test_bulk_create_in_batches(self):
+        items = [self.item(duration=float(n)) for n in range(1, 8)] + [self.item('flash@dc.com', 5.0)]
+        response = self.client.post('/api/activities/bulk/?batch_size=3', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 8, 'errors': []})
+        self.assertEqual(Activity.objects.count(), 8)
+        self.assertEqual(Leaderboard.objects.get(user__email='batman@dc.com').score, 28)
+        self.assertEqual(Leaderboard.objects.get(user__email='flash@dc.com').score, 5)
+        week = ActivityRollup.objects.get(period='week', user__email='batman@dc.com')
+        self.assertEqual((week.total_duration, week.activity_count), (28.0, 7))
+
+    def test_bulk_queries_do_not_grow_with_batch_rows(self):
+        # The first post creates the leaderboard and rollup rows later ones update
+        self.client.post('/api/activities/bulk/', [self.item()], format='json')
+        counts = []
+        for size in (3, 30):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post('/api/activities/bulk/', [self.item()] * size, format='json')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_reports_per_item_errors(self):
+        items = [self.item(), self.item('joker@dc.com'), self.item(duration='long'), self.item()]
+        response = self.client.post('/api/activities/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('user', response.data['errors'][0]['errors'])
+        self.assertEqual(Activity.objects.count(), 2)
+
+    def test_bulk_reports_unhashable_user_as_item_error(self):
+        items = [self.item(), self.item(['batman@dc.com']), self.item({'email': 'batman@dc.com'})]
+        response = self.client.post('/api/activities/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('user', response.data['errors'][0]['errors'])
+
+    def test_bulk_rejects_non_list_and_oversized_payloads(self):
+        response = self.client.post('/api/activities/bulk/', self.item(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(OCTOFIT_BULK_MAX_ITEMS=2):
+            response = self.client.post('/api/activities/bulk/', [self.item()] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MethodFieldActivitySerializer(serializers.ModelSerializer):
+    """The per-object ``SerializerMethodField`` serializer list responses used to go through."""
+    id = serializers.SerializerMethodField()
+    user = serializers.SlugRelatedField(slug_field='email', queryset=User.objects.all())
+
+    class Meta:
+        model = Activity
+        fields = ['id', 'user', 'activity_type', 'duration', 'date']
+
+    def get_id(self, obj):
+        return str(obj.pk)
+
+
+class SerializerFastPathTest(TestCase):
+    ROWS = 1000
+
+    def test_list_output_unchanged(self):
+        team = Team.objects.create(name='Justice League')
+        batman = User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+        TeamMembership.objects.create(team=team, user=batman)
+        User.objects.create(name='Clark Kent', email='superman@dc.com', age=35)
+        users = User.objects.select_related('membership__team').order_by('id')
+        self.assertEqual(json.loads(json.dumps(UserSerializer(users, many=True).data)), [
+            {'id': str(batman.pk), 'name': 'Bruce Wayne', 'email': 'batman@dc.com', 'age': 40,
+             'team': str(team.pk), 'team_name': 'Justice League'},
+            {'id': str(batman.pk + 1), 'name': 'Clark Kent', 'email': 'superman@dc.com', 'age': 35,
+             'team': None, 'team_name': None},
+        ])
+        rows = [{'rank': 1, 'user': 'batman@dc.com', 'name': 'Bruce Wayne', 'team': None, 'team_id': None,
+                 'score': 5, 'total_duration': 5.0, 'activity_count': 1, 'calories': 50}]
+        self.assertEqual(RankedLeaderboardSerializer(rows, many=True).data, rows)
+
+    def test_evaluated_queryset_is_not_queried_again(self):
+        User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+        users = User.objects.select_related('membership__team')
+        list(users)
+        with self.assertNumQueries(0):
+            data = UserSerializer(users, many=True).data
+        self.assertEqual([row['email'] for row in data], ['batman@dc.com'])
+        # A manager is still queried
+        self.assertEqual(len(UserSerializer(User.objects, many=True).data), 1)
+
+    def test_rows_match_method_field_serializer(self):
+        # Timings are in manage.py benchmark (serialize-activities)
+        user = User(pk=1, name='Bruce Wayne', email='batman@dc.com', age=40)
+        activities = [
+            Activity(pk=pk, user=user, activity_type='Running', duration=30.0, date=date(2024, 1, 1))
+            for pk in range(1, self.ROWS + 1)
+        ]
+        with self.assertNumQueries(0):
+            fast = ActivitySerializer(activities, many=True).data
+        self.assertEqual(len(fast), self.ROWS)
+        self.assertEqual(fast, MethodFieldActivitySerializer(activities, many=True).data)
+
+
+class ActivityFilterAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Activity.objects.create(user=hero('batman@dc.com'), activity_type='Patrol', duration=180.0, date=date(2024, 1, 10))
+        Activity.objects.create(user=hero('batman@dc.com'), activity_type='Patrol', duration=20.0, date=date(2024, 2, 10))
+        Activity.objects.create(user=hero('batman@dc.com'), activity_type='Sparring', duration=60.0, date=date(2024, 2, 11))
+        Activity.objects.create(user=hero('flash@dc.com'), activity_type='Patrol', duration=5.0, date=date(2024, 2, 12))
+
+    def results(self, **params):
+        response = self.client.get('/api/activities/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_filter_by_user_and_date_range(self):
+        rows = self.results(user='batman@dc.com', date_from='2024-02-01', date_to='2024-02-28')
+        self.assertEqual([row['date'] for row in rows], ['2024-02-11', '2024-02-10'])
+
+    def test_filter_by_type_and_min_duration(self):
+        rows = self.results(activity_type='Patrol', min_duration=10)
+        self.assertEqual(sorted(row['duration'] for row in rows), [20.0, 180.0])
+
+    def test_field_projection(self):
+        rows = self.results(user='flash@dc.com', fields='user,duration')
+        self.assertEqual(rows, [{'user': 'flash@dc.com', 'duration': 5.0}])
+
+    def test_invalid_filters_rejected(self):
+        for params in ({'fields': 'id,password'}, {'min_duration': -1}, {'date_from': 'yesterday'}):
+            response = self.client.get('/api/activities/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncReadAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.async_client = AsyncClient()
+        team = Team.objects.create(name='Justice League')
+        TeamMembership.objects.create(team=team, user=hero('batman@dc.com'))
+        for day in range(1, 6):
+            Activity.objects.create(user=hero('batman@dc.com'), activity_type='Patrol', duration=day, date=date(2024, 1, day))
+        Activity.objects.create(user=hero('flash@dc.com'), activity_type='Running', duration=5.0, date=date(2024, 1, 3))
+        self.workout = Workout.objects.create(name='Gauntlet', description='Run it')
+        set_workout_exercises(self.workout, [{'name': 'Sprints', 'sets': 4}])
+
+    async def test_lists_match_sync_endpoints(self):
+        for path in ('users/', 'teams/', 'activities/?page_size=2', 'leaderboard/', 'workouts/',
+                     'activities/?user=batman@dc.com&fields=id,date'):
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            expected = await sync_to_async(self.client.get)(f'/api/{path}')
+            # Pagination links differ only in the /async/ prefix
+            self.assertEqual(response.content.decode().replace('/api/async/', '/api/'), expected.content.decode())
+
+    async def test_pages_follow_cursor(self):
+        response = await self.async_client.get('/api/async/activities/', {'page_size': 4})
+        page = response.json()
+        self.assertEqual(len(page['results']), 4)
+        response = await self.async_client.get(page['next'])
+        self.assertEqual(len(response.json()['results']), 2)
+
+    async def test_detail_and_errors(self):
+        response = await self.async_client.get(f'/api/async/workouts/{self.workout.pk}/')
+        self.assertEqual(response.json()['name'], 'Gauntlet')
+        for path in ('workouts/999999/', 'workouts/not-an-id/'):
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get('/api/async/activities/', {'min_duration': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('min_duration', response.json())
+        response = await self.async_client.post('/api/async/workouts/', {})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ExportAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for email, activity_type, duration, day in [
+            ('batman@dc.com', 'Patrol', 180.0, date(2024, 1, 10)),
+            ('batman@dc.com', 'Sparring', 60.0, date(2024, 2, 11)),
+            ('flash@dc.com', 'Running', 5.0, date(2024, 2, 12)),
+        ]:
+            Activity.objects.create(user=hero(email), activity_type=activity_type, duration=duration, date=day)
+        call_command('rebuild_leaderboard', stdout=StringIO())
+
+    def stream(self, path, params=None):
+        response = self.client.get(path, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode(), response
+
+    def test_activities_ndjson_matches_list_rows(self):
+        body, response = self.stream('/api/activities/export/ndjson/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(rows, self.client.get('/api/activities/').json()['results'])
+
+    def test_activities_csv_with_filters(self):
+        body, response = self.stream(
+            '/api/activities/export/csv/', {'user': 'batman@dc.com', 'date_from': '2024-02-01'},
+        )
+        self.assertIn('activities.csv', response['Content-Disposition'])
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0], ['id', 'user', 'activity_type', 'duration', 'date'])
+        self.assertEqual([row[1:] for row in rows[1:]], [['batman@dc.com', 'Sparring', '60.0', '2024-02-11']])
+
+    def test_invalid_filter_rejected(self):
+        response = self.client.get('/api/activities/export/csv/', {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/activities/export/xml/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_leaderboard_export_is_ranked(self):
+        body, _ = self.stream('/api/leaderboard/export/ndjson/', {'top': 1})
+        self.assertEqual([json.loads(line) for line in body.splitlines()], [
+            {'rank': 1, 'user': 'batman@dc.com', 'name': 'batman', 'team': None, 'score': activity_points(240)},
+        ])
+
+
+class ActivityRollupTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team DC')
+        TeamMembership.objects.create(team=self.team, user=hero('batman@dc.com'))
+        TeamMembership.objects.create(team=self.team, user=hero('superman@dc.com'))
+
+    def log(self, email, duration, day):
+        response = self.client.post('/api/activities/', {
+            'user': email, 'activity_type': 'Patrol', 'duration': duration, 'date': day,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def rollup(self, period, start, **owner):
+        row = ActivityRollup.objects.get(period=period, period_start=start, **owner)
+        return row.total_duration, row.activity_count
+
+    def test_writes_update_user_and_team_rollups(self):
+        # 2024-01-10 is a Wednesday; its week starts on Monday 2024-01-08
+        first = self.log('batman@dc.com', 60.0, '2024-01-10')
+        self.log('batman@dc.com', 30.0, '2024-01-11')
+        self.log('superman@dc.com', 15.0, '2024-01-11')
+        batman = hero('batman@dc.com')
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), user=batman), (60.0, 1))
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), user=batman), (90.0, 2))
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), team=self.team), (105.0, 3))
+
+        self.client.patch(f'/api/activities/{first}/', {'date': '2024-01-15'}, format='json')
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), user=batman), (30.0, 1))
+        self.assertEqual(self.rollup('week', date(2024, 1, 15), team=self.team), (60.0, 1))
+
+        self.client.delete(f'/api/activities/{first}/')
+        self.assertEqual(self.rollup('week', date(2024, 1, 15), user=batman), (0.0, 0))
+
+    def test_team_move_takes_rollups_along(self):
+        # Then edits and deletes of earlier activities balance on the new team
+        other = Team.objects.create(name='Team Justice')
+        batman = hero('batman@dc.com')
+        edited = self.log('batman@dc.com', 30.0, '2024-01-10')
+        deleted = self.log('batman@dc.com', 20.0, '2024-01-10')
+        self.log('superman@dc.com', 15.0, '2024-01-10')
+        response = self.client.post(f'/api/users/{batman.pk}/move-team/', {'team': other.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), team=self.team), (15.0, 1))
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), team=other), (50.0, 2))
+
+        self.client.patch(f'/api/activities/{edited}/', {'duration': 45.0}, format='json')
+        self.client.delete(f'/api/activities/{deleted}/')
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), team=self.team), (15.0, 1))
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), team=other), (45.0, 1))
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), team=other), (45.0, 1))
+
+        # Member list edits move rollups too
+        self.client.patch(f'/api/teams/{self.team.pk}/', {'members': ['batman@dc.com']}, format='json')
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), team=self.team), (45.0, 1))
+        self.assertEqual(self.rollup('week', date(2024, 1, 8), team=other), (0.0, 0))
+
+    def test_concurrent_first_writes_for_a_rollup_both_count(self):
+        # Another request creates the row between this one's update and insert
+        batman = hero('batman@dc.com')
+        ActivityRollup.objects.create(
+            period='day', period_start=date(2024, 1, 10), user=batman, total_duration=5.0, activity_count=1,
+        )
+        real_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            apply_rollup_deltas({('day', date(2024, 1, 10), batman.pk, None): [5.0, 1]})
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), user=batman), (10.0, 2))
+
+    def test_deleted_user_leaves_team_rollups(self):
+        self.log('batman@dc.com', 30.0, '2024-01-10')
+        self.log('superman@dc.com', 10.0, '2024-01-10')
+        response = self.client.delete(f"/api/users/{hero('batman@dc.com').pk}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), team=self.team), (10.0, 1))
+        response = self.client.get('/api/stats/', {'team': self.team.pk, 'period': 'week'})
+        self.assertEqual([row['total_duration'] for row in response.data['results']], [10.0])
+
+    def test_admin_writes_apply_deltas_inline(self):
+        model_admin = ActivityAdmin(Activity, site)
+        batman, superman = hero('batman@dc.com'), hero('superman@dc.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            activities = [
+                Activity(user=user, activity_type='Patrol', duration=duration, date=date(2024, 1, 10))
+                for user, duration in ((batman, 30.0), (batman, 20.0), (superman, 15.0))
+            ]
+            for activity in activities:
+                model_admin.save_model(None, activity, None, False)
+            activities[0].duration = 45.0
+            model_admin.save_model(None, activities[0], None, True)
+            model_admin.delete_model(None, activities[1])
+            model_admin.delete_queryset(None, Activity.objects.filter(user=superman))
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(Leaderboard.objects.get(user=batman).score, 45)
+        self.assertEqual(Leaderboard.objects.get(user=superman).score, 0)
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), team=self.team), (45.0, 1))
+        self.assertEqual(self.rollup('day', date(2024, 1, 10), user=batman), (45.0, 1))
+
+    def test_stats_endpoint_filters(self):
+        self.log('batman@dc.com', 60.0, '2024-01-10')
+        self.log('superman@dc.com', 15.0, '2024-01-22')
+        response = self.client.get('/api/stats/', {'user': 'batman@dc.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['period_start'], row['total_duration']) for row in response.data['results']],
+            [('2024-01-08', 60.0)],
+        )
+        response = self.client.get('/api/stats/', {'team': self.team.pk, 'period': 'day', 'date_from': '2024-01-20'})
+        self.assertEqual(
+            [(row['period_start'], row['team'], row['total_duration']) for row in response.data['results']],
+            [('2024-01-22', str(self.team.pk), 15.0)],
+        )
+
+    def test_backfill_matches_incremental_rollups(self):
+        self.log('batman@dc.com', 60.0, '2024-01-10')
+        self.log('superman@dc.com', 15.0, '2024-01-22')
+        fields = ('period', 'period_start', 'user_id', 'team_id', 'total_duration', 'activity_count')
+        incremental = sorted(ActivityRollup.objects.values_list(*fields), key=str)
+        ActivityRollup.objects.all().delete()
+        call_command('backfill_rollups', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(sorted(ActivityRollup.objects.values_list(*fields), key=str), incremental)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        # Several activities share a date so the id tiebreak matters
+        for day in range(1, 6):
+            for n in range(3):
+                Activity.objects.create(
+                    user=hero('batman@dc.com'), activity_type=f'Patrol {n}',
+                    duration=10.0, date=date(2024, 1, day),
+                )
+
+    def walk(self, url, key):
+        seen, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(response.data['results'])
+            url = response.data[key]
+            pages += 1
+        return seen, pages
+
+    def test_pages_cover_every_row_in_order(self):
+        seen, pages = self.walk('/api/activities/?page_size=4', 'next')
+        self.assertEqual(pages, 4)
+        expected = [
+            str(pk) for pk in Activity.objects.order_by('-date', '-id').values_list('pk', flat=True)
+        ]
+        self.assertEqual([row['id'] for row in seen], expected)
+
+    def test_previous_link_returns_preceding_page(self):
+        first = self.client.get('/api/activities/?page_size=4').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNotNone(back['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_leaderboard_ordered_by_score(self):
+        Leaderboard.objects.create(user=hero('batman@dc.com'), score=10)
+        Leaderboard.objects.create(user=hero('thor@marvel.com'), score=950)
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual([row['score'] for row in response.data['results']], [950, 10])
+
 
 class WorkoutAPITest(TestCase):
     def setUp(self):
@@ -177,8 +856,21 @@ class WorkoutAPITest(TestCase):
         self.workout = Workout.objects.create(
             name='Batman Combat Conditioning',
             description='Full-body combat conditioning.',
-            exercises=json.dumps([{'name': 'Batarang throws', 'sets': 3, 'reps': 20}])
         )
+        set_workout_exercises(self.workout, [
+            {'name': 'Batarang throws', 'sets': 3, 'reps': 20},
+            {'name': 'Squats', 'sets': 3, 'reps': 12},
+        ])
+        self.legs = Workout.objects.create(name='Leg day', description='')
+        set_workout_exercises(self.legs, [
+            {'name': 'Squats', 'sets': 5, 'reps': 5},
+            {'name': 'Rowing', 'duration_seconds': 600},
+        ])
+
+    def list_names(self, **params):
+        response = self.client.get('/api/workouts/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [workout['name'] for workout in response.data['results']]
 
     def test_list_workouts(self):
         response = self.client.get('/api/workouts/')
@@ -189,6 +881,700 @@ class WorkoutAPITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Batman Combat Conditioning')
 
+    def test_exercises_are_nested_json(self):
+        response = self.client.get(f'/api/workouts/{self.legs.pk}/')
+        self.assertEqual(json.loads(response.content)['exercises'], [
+            {'name': 'Squats', 'sets': 5, 'reps': 5, 'duration_seconds': None},
+            {'name': 'Rowing', 'sets': None, 'reps': None, 'duration_seconds': 600},
+        ])
+
+    def test_create_and_replace_exercises(self):
+        response = self.client.post('/api/workouts/', {
+            'name': 'Core', 'description': 'Abs', 'exercises': [{'name': 'Plank', 'duration_seconds': 90}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['exercises'][0]['duration_seconds'], 90)
+        pk = response.data['id']
+
+        response = self.client.patch(f'/api/workouts/{pk}/', {
+            'exercises': [{'name': 'Crunches', 'sets': 3}, {'name': 'Plank', 'duration_seconds': 60}],
+        }, format='json')
+        self.assertEqual([e['name'] for e in response.data['exercises']], ['Crunches', 'Plank'])
+        self.client.patch(f'/api/workouts/{pk}/', {'name': 'Abs'}, format='json')
+        self.assertEqual(WorkoutExercise.objects.filter(workout_id=pk).count(), 2)
+
+    def test_json_encoded_exercises_are_still_accepted(self):
+        response = self.client.post('/api/workouts/', {
+            'name': 'Legacy', 'description': 'Old client', 'exercises': json.dumps([{'name': 'Burpees', 'reps': 10}]),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['exercises'][0]['name'], 'Burpees')
+        response = self.client.post('/api/workouts/', {'name': 'Bad', 'description': '', 'exercises': '[{'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('exercises', response.data)
+
+    def test_filter_by_exercise(self):
+        self.assertEqual(self.list_names(exercise='Squats'), ['Batman Combat Conditioning', 'Leg day'])
+        self.assertEqual(self.list_names(exercise='Squats', min_sets=4), ['Leg day'])
+        self.assertEqual(self.list_names(min_duration_seconds=300), ['Leg day'])
+        # Conditions apply to one exercise: no single exercise is Rowing with sets
+        self.assertEqual(self.list_names(exercise='Rowing', min_sets=1), [])
+        response = self.client.get('/api/workouts/', {'min_sets': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PopulateDbCommandTest(TestCase):
+    def populate(self, **options):
+        call_command('populate_db', stdout=StringIO(), **options)
+
+    def test_superhero_dataset_by_default(self):
+        self.populate()
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(TeamMembership.objects.count(), 10)
+        self.assertTrue(ActivityRollup.objects.exists())
+        # Scores hold the activity points, so later deltas apply to a true base
+        self.assertEqual(Leaderboard.objects.get(user__email='thor@marvel.com').score, activity_points(120.0))
+        total_points = sum(activity_points(duration) for duration in Activity.objects.values_list('duration', flat=True))
+        self.assertEqual(sum(Leaderboard.objects.values_list('score', flat=True)), total_points)
+
+    def test_synthetic_dataset_is_deterministic(self):
+        options = {'users': 20, 'activities': 300, 'teams': 3, 'workouts': 4, 'seed': 7, 'batch_size': 64}
+        fields = ('user__email', 'activity_type', 'duration', 'date')
+        self.populate(**options)
+        first = list(Activity.objects.order_by('id').values_list(*fields))
+        self.populate(**options)
+        self.assertEqual(list(Activity.objects.order_by('id').values_list(*fields)), first)
+        self.assertEqual(len(first), 300)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(TeamMembership.objects.count(), 20)
+        self.assertEqual(Workout.objects.count(), 4)
+        total_points = sum(activity_points(duration) for *_, duration, _ in first)
+        self.assertEqual(sum(Leaderboard.objects.values_list('score', flat=True)), total_points)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Bruce Wayne', email='batman@dc.com', age=40)
+
+    def test_repeat_read_is_served_from_cache(self):
+        before = metrics.counter_value('octofit_cache_hits_total', resource='users')
+        first = self.client.get('/api/users/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/users/')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(metrics.counter_value('octofit_cache_hits_total', resource='users'), before + 1)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(f'/api/users/{self.user.pk}/')['ETag']
+        response = self.client.get(f'/api/users/{self.user.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(f'/api/users/{self.user.pk}/', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_invalidates_resource_and_dependents(self):
+        etag = self.client.get('/api/users/')['ETag']
+        self.client.get('/api/leaderboard/ranked/')
+        self.client.post('/api/activities/', {
+            'user': 'batman@dc.com', 'activity_type': 'Running', 'duration': 30, 'date': '2024-01-01',
+        }, format='json')
+        ranked = self.client.get('/api/leaderboard/ranked/').json()
+        self.assertEqual(ranked[0]['score'], activity_points(30))
+        # Users are not derived from activities: still cached
+        self.assertEqual(
+            self.client.get('/api/users/', HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        self.client.patch(f'/api/users/{self.user.pk}/', {'name': 'Batman'}, format='json')
+        response = self.client.get('/api/users/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['name'], 'Batman')
+
+    def test_bulk_insert_invalidates_activities(self):
+        self.assertEqual(self.client.get('/api/activities/').json()['results'], [])
+        self.client.post('/api/activities/bulk/', [
+            {'user': 'batman@dc.com', 'activity_type': 'Boxing', 'duration': 20, 'date': '2024-01-02'},
+        ], format='json')
+        self.assertEqual(len(self.client.get('/api/activities/').json()['results']), 1)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'api': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    })
+    def test_no_shared_cache_serves_fresh_responses(self):
+        # The default without a shared backend: nothing a worker can miss an invalidation of
+        first = self.client.get(f'/api/users/{self.user.pk}/')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/users/{self.user.pk}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        User.objects.filter(pk=self.user.pk).update(name='Batman')
+        self.assertEqual(self.client.get(f'/api/users/{self.user.pk}/').json()['name'], 'Batman')
+
+    def test_metrics_endpoint_reports_cache_counters(self):
+        self.client.get('/api/workouts/')
+        self.client.get('/api/workouts/')
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE octofit_cache_hits_total counter', body)
+        self.assertIn('octofit_cache_misses_total{resource="workouts"}', body)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Activity.objects.create(user=hero('batman@dc.com'), activity_type='Patrol', duration=30.0, date=date(2024, 1, 1))
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/activities/')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'serialize', 'total'})
+        self.assertIn('desc="1 queries"', timing['db'])
+
+    def test_per_route_histograms(self):
+        before = metrics.histogram_count('octofit_request_duration_seconds', route='activity-list')
+        self.client.get('/api/activities/')
+        self.client.get('/api/activities/', {'user': 'batman@dc.com'})
+        self.assertEqual(metrics.histogram_count('octofit_request_duration_seconds', route='activity-list'), before + 2)
+        body = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('# TYPE octofit_request_queries histogram', body)
+        self.assertIn('octofit_request_queries_bucket{route="activity-list",le="1"}', body)
+        self.assertIn('octofit_response_size_bytes_count{route="activity-list"}', body)
+        self.assertIn('octofit_requests_total{method="GET",route="activity-list",status="200"}', body)
+
+
+class AsgiMiddlewareChainTest(TestCase):
+    def test_chain_stays_async(self):
+        handler = ASGIHandler()
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+        self.assertFalse(isinstance(handler._middleware_chain, SyncToAsync))
+
+    async def test_async_requests_are_measured(self):
+        route = 'async-activities-list'
+        before = await sync_to_async(metrics.histogram_count)('octofit_request_duration_seconds', route=route)
+        response = await AsyncClient().get('/api/async/activities/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertEqual(metrics.histogram_count('octofit_request_duration_seconds', route=route), before + 1)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_writes_results_for_every_endpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command(
+                'benchmark', users=20, activities=200, teams=3, iterations=2, index_workouts=200, feature_workouts=50,
+                serialize_rows=100, output=output, stdout=StringIO(),
+            )
+            with open(output) as handle:
+                report = json.load(handle)
+            call_command(
+                'benchmark', no_seed=True, iterations=2, index_workouts=200, feature_workouts=50, serialize_rows=100,
+                output=os.path.join(directory, 'again.json'),
+                compare=output, threshold=1000, stdout=StringIO(),
+            )
+        self.assertEqual(report['meta']['activities'], 200)
+        results = report['results']
+        for name in ('user-list', 'activity-detail', 'stats-list', 'leaderboard-ranked'):
+            self.assertEqual(results[name]['status'], [200], name)
+            self.assertGreater(results[name]['p95_ms'], 0)
+        self.assertEqual(results['activity-list']['queries'], 1)
+        self.assertGreater(results['recommend-features']['p95_ms'], 0)
+        self.assertGreater(results['serialize-activities']['p95_ms'], 0)
+
+    def test_asks_before_seeding_a_real_database(self):
+        out = StringIO()
+        with mock.patch.object(connection, 'vendor', 'mongodb'), \
+                mock.patch('builtins.input', return_value='no') as prompt:
+            call_command('benchmark', users=5, activities=10, stdout=out)
+        self.assertIn("Type 'yes'", prompt.call_args.args[0])
+        self.assertIn('Benchmark cancelled.', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+
+@override_settings(OCTOFIT_CHANGES_SETTLE_SECONDS=0)
+class QueryBudgetTest(TestCase):
+    """Each list and detail endpoint runs a fixed number of queries, however many rows there are."""
+    # Router basename -> (list budget, detail budget), also for the /api/async/ reads
+    BUDGETS = {
+        'user': (1, 1),
+        # Teams, then memberships and their users prefetched
+        'team': (3, 3),
+        'activity': (1, 1),
+        'leaderboard': (1, 1),
+        # Workouts, then their exercises prefetched
+        'workout': (2, 2),
+        'stats': (1, 1),
+    }
+    # Leaderboard entries, activity totals, users
+    RANKED_BUDGET = 3
+    # Building the index: workouts, their exercises, activity type counts
+    SEARCH_BUDGET = 3
+    # Oldest change and the page, then each resource with the queries of its list
+    CHANGES_BUDGET = 2 + sum(list_budget for list_budget, _ in BUDGETS.values()) - BUDGETS['stats'][0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seeded = 0
+
+    def seed(self, count):
+        """Add ``count`` users, each on a team with activities, a score and rollups."""
+        for n in range(self.seeded, self.seeded + count):
+            team = Team.objects.create(name=f'Team {n}')
+            user = User.objects.create(name=f'Athlete {n}', email=f'athlete{n}@octofit.test', age=30)
+            TeamMembership.objects.create(team=team, user=user)
+            for day in (1, 2):
+                self.client.post('/api/activities/', {
+                    'user': user.email, 'activity_type': 'Running', 'duration': 10 + n, 'date': f'2024-01-0{day}',
+                }, format='json')
+            workout = Workout.objects.create(name=f'Workout {n}', description='')
+            set_workout_exercises(workout, [{'name': 'Squats', 'sets': 3}, {'name': 'Plank', 'duration_seconds': 60}])
+            # So the change feed returns every resource
+            for resource, pk in ((USERS, user.pk), (TEAMS, team.pk), (WORKOUTS, workout.pk)):
+                record_changes(resource, [pk])
+        self.seeded += count
+
+    def assert_budgets(self):
+        for prefix, viewset, basename in router.registry:
+            list_budget, detail_budget = self.BUDGETS[basename]
+            detail = viewset.queryset.order_by('pk').first()
+            # The async reads share the viewset's queryset, so its budgets
+            for route in ['', 'async/'] if prefix in ASYNC_READ_VIEWS else ['']:
+                for label, path, budget in (
+                    (f'{route}{basename}-list', f'/api/{route}{prefix}/', list_budget),
+                    (f'{route}{basename}-detail', f'/api/{route}{prefix}/{detail.pk}/', detail_budget),
+                ):
+                    self.assert_budget(label, path, budget)
+        self.assert_budget('leaderboard-ranked', '/api/leaderboard/ranked/', self.RANKED_BUDGET)
+        reset_index()
+        self.assert_budget('search', '/api/search/?q=run', self.SEARCH_BUDGET)
+        self.assert_budget('changes', '/api/changes/?since=0', self.CHANGES_BUDGET)
+
+    def assert_budget(self, label, path, budget):
+        caches[API_CACHE].clear()
+        with self.assertMaxQueries(budget, f'{label} with {self.seeded} rows'):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, label)
+
+    def test_every_routed_endpoint_has_a_budget(self):
+        self.assertEqual({basename for _, _, basename in router.registry}, set(self.BUDGETS))
+        self.assertLessEqual(set(ASYNC_READ_VIEWS), {prefix for prefix, _, _ in router.registry})
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.seed(2)
+        self.assert_budgets()
+        self.seed(20)
+        self.assert_budgets()
+
+
+class HealthCheckTest(TestCase):
+    def test_health_reports_database_and_pool(self):
+        response = APIClient().get('/api/_health')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ok')
+        self.assertTrue(response.data['database']['ok'])
+        self.assertIn('pool', response.data)
+
+    @skipIf(mongo_pool.monitoring is None, 'pymongo is not installed')
+    def test_pool_listener_tracks_usage(self):
+        address = ('mongo.test', 27017)
+        listener = mongo_pool.PoolStatsListener()
+        listener.pool_created(mongo_pool.monitoring.PoolCreatedEvent(address, {'maxPoolSize': 20}))
+        for connection_id in (1, 2):
+            listener.connection_created(mongo_pool.monitoring.ConnectionCreatedEvent(address, connection_id))
+            listener.connection_checked_out(mongo_pool.monitoring.ConnectionCheckedOutEvent(address, connection_id))
+        listener.connection_checked_in(mongo_pool.monitoring.ConnectionCheckedInEvent(address, 2))
+        listener.connection_check_out_failed(mongo_pool.monitoring.ConnectionCheckOutFailedEvent(address, 'timeout'))
+        pool = mongo_pool.pool_stats.snapshot()['mongo.test:27017']
+        self.assertEqual(pool, {
+            'max_pool_size': 20, 'open': 2, 'checked_out': 1, 'created_total': 2, 'checkout_failures': 1,
+        })
+        self.assertEqual(metrics.gauge_value('octofit_mongo_pool_checked_out', server='mongo.test:27017'), 1)
+        self.assertEqual(APIClient().get('/api/_health').data['pool']['mongo.test:27017']['open'], 2)
+
+
+def mirror_to_mongo(database):
+    """Copy every table into ``database`` the way djongo stores rows (dates as datetimes)."""
+    for model in (User, Team, TeamMembership, Activity, Leaderboard):
+        documents = []
+        for obj in model.objects.all():
+            document = {}
+            for field in model._meta.concrete_fields:
+                value = getattr(obj, field.attname)
+                if isinstance(value, date):
+                    value = datetime.combine(value, datetime.min.time())
+                document[field.column] = value
+            documents.append(document)
+        if documents:
+            database[model._meta.db_table].insert_many(documents)
+
+
+@skipIf(mongomock is None, 'mongomock is not installed')
+class AnalyticsRepositoryParityTest(TestCase):
+    def setUp(self):
+        call_command('populate_db', users=30, activities=600, teams=4, workouts=1, stdout=StringIO())
+        self.orm = OrmAnalyticsRepository()
+        self.mongo = MongoAnalyticsRepository(mongomock.MongoClient()['octofit_db'])
+        mirror_to_mongo(self.mongo.db)
+
+    def test_repositories_agree(self):
+        team = Team.objects.order_by('id').first().pk
+        for kwargs in ({}, {'team_id': team}, {'limit': 5}):
+            self.assertEqual(list(self.mongo.ranked_entries(**kwargs)), list(self.orm.ranked_entries(**kwargs)), kwargs)
+        user_ids = list(User.objects.values_list('id', flat=True)[:10])
+        for kwargs in ({}, {'user_ids': user_ids}, {'date_from': date(2024, 3, 1), 'date_to': date(2024, 3, 31)}):
+            self.assertEqual(self.mongo.activity_totals(**kwargs), self.orm.activity_totals(**kwargs), kwargs)
+        self.assertEqual(self.mongo.users_with_teams(user_ids), self.orm.users_with_teams(user_ids))
+        self.assertEqual(self.mongo.activity_type_counts(), self.orm.activity_type_counts())
+        self.assertEqual(
+            sorted(self.mongo.daily_activity_totals()), sorted(self.orm.daily_activity_totals()),
+        )
+
+    def test_ranked_leaderboard_and_rollups_agree(self):
+        team = Team.objects.order_by('id').last().pk
+        for kwargs in ({}, {'top': 3}, {'team': team, 'date_from': date(2024, 6, 1)}):
+            self.assertEqual(
+                ranked_leaderboard(repository=self.mongo, **kwargs), ranked_leaderboard(repository=self.orm, **kwargs),
+            )
+
+        def rollups():
+            return sorted(ActivityRollup.objects.values_list(
+                'period', 'period_start', 'user_id', 'team_id', 'total_duration', 'activity_count',
+            ), key=str)
+
+        rebuild_rollups(repository=self.orm)
+        expected = rollups()
+        rebuild_rollups(repository=self.mongo)
+        self.assertEqual(rollups(), expected)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='search@example.com', name='Searcher', age=30)
+        self.squat = Workout.objects.create(name='Squat Ladder', description='Legs day with a kettlebell finisher')
+        set_workout_exercises(self.squat, [{'name': 'Goblet squats', 'sets': 3}, {'name': 'Kettlebell swings', 'sets': 3}])
+        self.swings = Workout.objects.create(name='Kettlebell complex', description='Hinge work')
+        set_workout_exercises(self.swings, [{'name': 'Kettlebell swings', 'sets': 5}])
+        Workout.objects.create(name='Easy run', description='Recovery pace')
+        for activity_type in ('Running', 'Running', 'Rowing'):
+            Activity.objects.create(user=self.user, activity_type=activity_type, duration=30, date=date(2024, 1, 1))
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data['results']
+
+    def test_results_are_ranked_by_field(self):
+        results = self.search(q='kettlebell', type='workout')
+        # A match in the name outweighs matches in the exercises and description
+        self.assertEqual([r['id'] for r in results], [str(self.swings.pk), str(self.squat.pk)])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[0]['name'], 'Kettlebell complex')
+
+    def test_all_terms_must_match_and_last_is_a_prefix(self):
+        self.assertEqual([r['id'] for r in self.search(q='kettlebell squ')], [str(self.squat.pk)])
+        self.assertEqual(self.search(q='kettlebell yoga'), [])
+        self.assertEqual([r['id'] for r in self.search(q='recov')], [str(Workout.objects.get(name='Easy run').pk)])
+
+    def test_activity_types(self):
+        results = self.search(q='r', type='activity_type')
+        self.assertEqual(
+            {r['activity_type']: r['activities'] for r in results}, {'Running': 2, 'Rowing': 1},
+        )
+
+    def test_index_follows_api_writes(self):
+        self.assertEqual(self.search(q='tabata'), [])
+        response = self.client.post('/api/workouts/', {
+            'name': 'Tabata', 'description': 'Intervals', 'exercises': '[]',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        pk = str(response.data['id'])
+        self.assertEqual([r['id'] for r in self.search(q='tabata')], [pk])
+        self.client.patch(f'/api/workouts/{pk}/', {'name': 'Sprints', 'exercises': [{'name': 'Burpees'}]}, format='json')
+        self.assertEqual(self.search(q='tabata'), [])
+        self.assertEqual([r['id'] for r in self.search(q='sprints burpees')], [pk])
+        self.client.delete(f'/api/workouts/{pk}/')
+        self.assertEqual(self.search(q='sprints'), [])
+
+        # Activity counts change once the write's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/activities/', {
+                'user': self.user.email, 'activity_type': 'Climbing', 'duration': 40, 'date': '2024-01-02',
+            }, format='json')
+        self.client.post('/api/activities/bulk/', [
+            {'user': self.user.email, 'activity_type': 'Climbing', 'duration': 20, 'date': '2024-01-03'},
+        ], format='json')
+        self.assertEqual(self.search(q='climbing')[0]['activities'], 2)
+        rowing = Activity.objects.get(activity_type='Rowing')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/activities/{rowing.pk}/')
+        self.assertEqual(self.search(q='rowing'), [])
+
+    def test_query_is_validated(self):
+        self.assertEqual(self.client.get('/api/search/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'run', 'limit': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_early_stop_keeps_the_best_matches(self):
+        # Enough matches that multi-term queries walk postings instead of scoring directly
+        words = ['tempo', 'hill', 'core', 'power', 'mobility', 'interval', 'recovery', 'strength']
+        index = SearchIndex()
+        for n in range(20_000):
+            index.add_workout(n, f'{words[n % 8].title()} {n}', f'{words[n // 8 % 8].title()} work', ['Squats'])
+        index.add_workout('best', 'Squats', 'Squats work', ['Squats'])
+        for query in ('squ', 'work squ'):
+            results = index.search(query, limit=5)
+            self.assertEqual(len(results), 5)
+            self.assertEqual(results[0][2]['id'], 'best')
+            scores = [score for score, _, _ in results]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(index.search('12345')[0][2]['id'], '12345')
+
+
+class RecommendedWorkoutsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.runner = User.objects.create(email='runner@example.com', name='Runner', age=30)
+        for day, duration in enumerate((25, 30, 35), start=1):
+            Activity.objects.create(user=self.runner, activity_type='Running', duration=duration, date=date(2024, 1, day))
+        Activity.objects.create(user=self.runner, activity_type='Yoga', duration=30, date=date(2024, 1, 4))
+        self.tempo = self.workout('Tempo run', 'Running session', [{'name': 'Tempo', 'duration_seconds': 1740}])
+        self.long = self.workout('Long run', 'Running session', [{'name': 'Easy pace', 'duration_seconds': 5400}])
+        self.lifting = self.workout('Heavy day', 'Strength training', [{'name': 'Squats', 'sets': 5, 'reps': 5}])
+
+    def workout(self, name, description, exercises):
+        workout = Workout.objects.create(name=name, description=description)
+        set_workout_exercises(workout, exercises)
+        return workout
+
+    def recommend(self, user, **params):
+        response = self.client.get(f'/api/users/{user.pk}/recommended-workouts/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def test_ranked_by_activity_types_and_duration(self):
+        data = self.recommend(self.runner)
+        self.assertEqual(data['based_on'], {'activities': 4, 'typical_duration': 30.0})
+        self.assertEqual([r['id'] for r in data['results']], [str(w.pk) for w in (self.tempo, self.long, self.lifting)])
+        self.assertEqual(data['results'][0]['estimated_minutes'], 30.0)
+        self.assertEqual(len(self.recommend(self.runner, limit=1)['results']), 1)
+
+    def test_user_without_activities_gets_nothing(self):
+        idle = User.objects.create(email='idle@example.com', name='Idle', age=30)
+        self.assertEqual(self.recommend(idle)['results'], [])
+        self.assertEqual(self.client.get('/api/users/999999/recommended-workouts/').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(f'/api/users/{idle.pk}/recommended-workouts/', {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_features_follow_workout_writes(self):
+        self.recommend(self.runner)
+        response = self.client.post('/api/workouts/', {
+            'name': 'Running flow', 'description': 'Running and yoga',
+            'exercises': [{'name': 'Flow', 'duration_seconds': 1800}],
+        }, format='json')
+        created = response.data['id']
+        self.assertEqual(self.recommend(self.runner)['results'][0]['id'], created)
+        self.client.delete(f'/api/workouts/{created}/')
+        self.client.delete(f'/api/workouts/{self.tempo.pk}/')
+        self.assertEqual([r['id'] for r in self.recommend(self.runner)['results']], [str(self.long.pk), str(self.lifting.pk)])
+
+    def test_feature_matrix_grows_and_reuses_rows(self):
+        types = ['running', 'cycling', 'yoga']
+        features = WorkoutFeatures(types, capacity=4)
+        for n in range(10):
+            features.set_workout(n, f'Workout {n}', f'{types[n % 3].title()} session', [('Plank', 1, None, 600)])
+        features.remove_workout(3)
+        features.set_workout(10, 'Workout 10', 'Yoga session', [('Plank', 1, None, 600)])
+        self.assertEqual(len(features), 10)
+        profile, minutes = features.profile([('Yoga', 10)])
+        results = features.recommend(profile, minutes, limit=4)
+        self.assertEqual({pk for _, pk, *_ in results}, {2, 5, 8, 10})
+
+
+@override_settings(OCTOFIT_TASK_COALESCE_SECONDS=0, OCTOFIT_TASK_RETRY_SECONDS=0, OCTOFIT_TASK_MAX_ATTEMPTS=2)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.user = hero('batman@dc.com')
+
+    def test_writes_for_one_user_coalesce_into_one_recompute(self):
+        Activity.objects.bulk_create(
+            Activity(user=self.user, activity_type='Patrol', duration=1.0, date=date(2024, 1, 1)) for _ in range(1000)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(1000):
+                taskqueue.enqueue(RESCORE_USER, self.user.pk)
+        task = Task.objects.get()
+        self.assertEqual((task.name, task.key, task.coalesced), (RESCORE_USER, str(self.user.pk), 999))
+
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertIn('Tasks run: 1 (0 failed)', out.getvalue())
+        self.assertEqual(Leaderboard.objects.get(user=self.user).score, 1000)
+        self.assertFalse(Task.objects.exists())
+
+    def test_claimed_task_is_not_claimed_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue(REBUILD_ROLLUPS)
+        self.assertEqual(len(taskqueue.claim('a', limit=10)), 1)
+        self.assertEqual(taskqueue.claim('b', limit=10), [])
+        # A new enqueue while the first runs is queued behind it, not merged
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue(REBUILD_ROLLUPS)
+        self.assertEqual(Task.objects.filter(status=Task.PENDING).count(), 1)
+
+    @skipIf(connection.vendor != 'sqlite', 'drops the SQLite partial index to simulate MongoDB')
+    def test_claim_folds_duplicate_pending_tasks(self):
+        # MongoDB has no partial unique index, so racing enqueues can insert duplicates
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX tasks_pending_name_key_uniq')
+        for coalesced in (0, 4, 2):
+            Task.objects.create(name=RESCORE_USER, key=str(self.user.pk), run_at=timezone.now(), coalesced=coalesced)
+        Task.objects.create(name=RESCORE_USER, key='other', run_at=timezone.now())
+        claimed = taskqueue.claim('a', limit=1)
+        self.assertEqual([task.coalesced for task in claimed], [8])
+        self.assertEqual(list(Task.objects.filter(status=Task.PENDING).values_list('key', flat=True)), ['other'])
+
+    def test_failing_task_is_retried_then_left_failed(self):
+        calls = []
+
+        def broken(key):
+            calls.append(key)
+            raise RuntimeError('boom')
+
+        taskqueue.TASKS['test.broken'] = broken
+        self.addCleanup(taskqueue.TASKS.pop, 'test.broken')
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue('test.broken', 'x')
+        with self.assertLogs('octofit_tracker.taskqueue', 'ERROR'):
+            self.assertEqual(taskqueue.run_due(), (2, 2))
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, calls), (Task.FAILED, 2, ['x', 'x']))
+        self.assertIn('RuntimeError: boom', task.last_error)
+        with self.assertRaises(KeyError):
+            taskqueue.enqueue('test.unknown')
+
+    def test_queue_depth_metrics(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue(RESCORE_USER, self.user.pk)
+            taskqueue.enqueue(REBUILD_ROLLUPS)
+        body = APIClient().get('/api/_metrics').content.decode()
+        self.assertIn('octofit_task_queue_depth{status="pending"} 2', body)
+        self.assertIn('octofit_task_queue_depth{status="failed"} 0', body)
+        self.assertIn('octofit_task_queue_oldest_pending_seconds', body)
+
+
+@override_settings(OCTOFIT_CHANGES_SETTLE_SECONDS=0)
+class ChangeFeedTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = hero('batman@dc.com')
+        self.token = self.client.get('/api/changes/').data['next']
+
+    def changes(self, since, **params):
+        response = self.client.get('/api/changes/', dict(params, since=since))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def post_activity(self, duration):
+        response = self.client.post('/api/activities/', {
+            'user': 'batman@dc.com', 'activity_type': 'Patrol', 'duration': duration, 'date': '2024-01-01',
+        }, format='json')
+        return response.data['id']
+
+    def test_writes_and_deletes_since_token(self):
+        kept, removed = self.post_activity(30), self.post_activity(20)
+        self.client.patch(f'/api/activities/{kept}/', {'duration': 45}, format='json')
+        self.client.delete(f'/api/activities/{removed}/')
+        data = self.changes(self.token)
+        self.assertFalse(data['has_more'])
+        # One entry per object, in the order of its latest change
+        entries = [(c['resource'], c['id'], c['deleted']) for c in data['changes']]
+        entry_id = str(Leaderboard.objects.get(user=self.user).pk)
+        self.assertEqual(entries, [('activities', kept, False), ('activities', removed, True), ('leaderboard', entry_id, False)])
+        self.assertEqual(data['changes'][0]['data']['duration'], 45.0)
+        self.assertEqual(data['changes'][2]['data']['score'], 45)
+        self.assertIsNone(data['changes'][1]['data'])
+        self.assertEqual(self.changes(data['next'])['changes'], [])
+
+    def test_email_change_reaches_rows_showing_it(self):
+        activity = self.post_activity(30)
+        token = self.changes(self.token)['next']
+        self.client.patch(f'/api/users/{self.user.pk}/', {'email': 'bruce@dc.com'}, format='json')
+        changed = {(c['resource'], c['id']): c['data'] for c in self.changes(token)['changes']}
+        self.assertEqual(changed['activities', activity]['user'], 'bruce@dc.com')
+        self.assertEqual(changed['users', str(self.user.pk)]['email'], 'bruce@dc.com')
+        self.assertIn('leaderboard', {resource for resource, _ in changed})
+
+    def test_user_delete_leaves_tombstones_for_cascaded_rows(self):
+        activity = self.post_activity(30)
+        token = self.changes(self.token)['next']
+        self.client.delete(f'/api/users/{self.user.pk}/')
+        deleted = {(c['resource'], c['id']) for c in self.changes(token)['changes'] if c['deleted']}
+        self.assertEqual({resource for resource, _ in deleted}, {'users', 'activities', 'leaderboard'})
+        self.assertIn(('activities', activity), deleted)
+
+    def test_pages_and_bulk_writes(self):
+        self.client.post('/api/activities/bulk/', [
+            {'user': 'batman@dc.com', 'activity_type': 'Patrol', 'duration': 10, 'date': '2024-01-01'},
+        ] * 5, format='json')
+        seen, since = [], self.token
+        while True:
+            page = self.changes(since, limit=2)
+            seen += [c['id'] for c in page['changes'] if c['resource'] == 'activities']
+            since = page['next']
+            if not page['has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(str(pk) for pk in Activity.objects.values_list('pk', flat=True)))
+
+    def test_pruned_token_is_gone(self):
+        self.post_activity(30)
+        self.post_activity(20)
+        out = StringIO()
+        call_command('prune_changes', days=0, stdout=out)
+        self.assertEqual(Change.objects.count(), 1)
+        response = self.client.get('/api/changes/', {'since': self.token})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.changes(Change.objects.get().pk - 1)['next'], Change.objects.get().pk)
+
+    def test_populate_db_expires_every_token(self):
+        self.post_activity(30)
+        token = self.changes(self.token)['next']
+        call_command('populate_db', stdout=StringIO())
+        for stale in (self.token, token):
+            response = self.client.get('/api/changes/', {'since': stale})
+            self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        fresh = self.client.get('/api/changes/').data['next']
+        self.assertEqual(self.changes(fresh)['changes'], [])
+        activity = self.post_activity(20)
+        self.assertEqual([c['id'] for c in self.changes(fresh)['changes'] if c['resource'] == 'activities'], [activity])
+
+    def test_admin_bulk_delete_logs_workouts(self):
+        kept, *removed = (Workout.objects.create(name=f'Workout {pk}', description='') for pk in range(3))
+        token = self.changes(self.token)['next']
+        WorkoutAdmin(Workout, site).delete_queryset(None, Workout.objects.exclude(pk=kept.pk))
+        entries = [(c['resource'], c['id'], c['deleted']) for c in self.changes(token)['changes']]
+        self.assertEqual(entries, [('workouts', str(workout.pk), True) for workout in removed])
+
+    def test_unsettled_changes_are_held_back(self):
+        older, newer = self.post_activity(30), self.post_activity(20)
+        with override_settings(OCTOFIT_CHANGES_SETTLE_SECONDS=60):
+            # A token taken now must not skip a lower id that may still commit
+            self.assertEqual(self.client.get('/api/changes/').data['next'], self.token)
+            data = self.changes(self.token)
+            self.assertEqual((data['changes'], data['next'], data['has_more']), ([], self.token, False))
+            # Only the changes before the first unsettled one are served
+            logged = Change.objects.filter(resource='activities', object_id=older).get()
+            Change.objects.filter(id__lte=logged.id).update(created_at=timezone.now() - timedelta(minutes=5))
+            data = self.changes(self.token)
+            self.assertEqual([c['id'] for c in data['changes'] if c['resource'] == 'activities'], [older])
+            self.assertEqual(data['next'], logged.id)
+            self.assertNotIn(newer, [c['id'] for c in self.changes(data['next'])['changes']])
+
 
 class ApiRootTest(TestCase):
     def setUp(self):
@@ -201,3 +1587,31 @@ class ApiRootTest(TestCase):
     def test_api_root_prefix(self):
         response = self.client.get('/api/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(OCTOFIT_BASE_URL='https://octofit.example.com')
+    def test_api_root_links_use_request_host(self):
+        response = self.client.get('/api/')
+        self.assertEqual(response.data['activities'], 'http://testserver/api/activities/')
+        self.assertEqual(
+            self.client.get('/api/', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        for pk in range(3):
+            Workout.objects.create(name=f'Workout {pk}', description='')
+        response = self.client.get('/api/workouts/', {'page_size': 2}, HTTP_HOST='10.0.0.5:8000')
+        self.assertTrue(response.data['next'].startswith('http://10.0.0.5:8000/api/workouts/?'))
+
+    @override_settings(OCTOFIT_BASE_URL='https://octofit.example.com', OCTOFIT_FORWARDED_HOSTS=['.example.com'])
+    def test_forwarded_host_must_be_allowed(self):
+        response = self.client.get('/api/', HTTP_X_FORWARDED_HOST='evil.test', HTTP_X_FORWARDED_PROTO='https')
+        self.assertEqual(response.data['users'], 'https://octofit.example.com/api/users/')
+
+    @override_settings(OCTOFIT_FORWARDED_HOSTS=['proxy.example.com'])
+    def test_forwarded_host_is_honoured(self):
+        headers = {'HTTP_X_FORWARDED_HOST': 'proxy.example.com', 'HTTP_X_FORWARDED_PROTO': 'https'}
+        response = self.client.get('/api/', **headers)
+        self.assertEqual(response.data['users'], 'https://proxy.example.com/api/users/')
+        for pk in range(3):
+            Workout.objects.create(name=f'Workout {pk}', description='')
+        response = self.client.get('/api/workouts/', {'page_size': 2}, **headers)
+        self.assertTrue(response.data['next'].startswith('https://proxy.example.com/api/workouts/?'))
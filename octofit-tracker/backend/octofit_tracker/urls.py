@@ -1,19 +1,11 @@
-import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from octofit_tracker.async_views import ASYNC_READ_VIEWS
+from octofit_tracker.metrics import metrics_view
 from octofit_tracker.views import (
     UserViewSet, TeamViewSet, ActivityViewSet,
-    LeaderboardViewSet, WorkoutViewSet, api_root
-)
-
-# Build the base URL for the API using the Codespaces environment variable so
-# that all self-describing links resolve correctly via the GitHub proxy.
-CODESPACE_NAME = os.environ.get('CODESPACE_NAME')
-API_BASE_URL = (
-    f"https://{CODESPACE_NAME}-8000.app.github.dev"
-    if CODESPACE_NAME
-    else "http://localhost:8000"
+    LeaderboardViewSet, WorkoutViewSet, StatsViewSet, api_root, changes, health, search
 )
 
 router = DefaultRouter()
@@ -22,9 +14,23 @@ router.register(r'teams', TeamViewSet)
 router.register(r'activities', ActivityViewSet)
 router.register(r'leaderboard', LeaderboardViewSet)
 router.register(r'workouts', WorkoutViewSet)
+router.register(r'stats', StatsViewSet, basename='stats')
+
+# Async reads (list and detail) for ASGI deployments, see async_views.py
+async_urls = []
+for prefix, view in ASYNC_READ_VIEWS.items():
+    async_urls += [
+        path(f'{prefix}/', view.as_view(), name=f'async-{prefix}-list'),
+        path(f'{prefix}/<str:pk>/', view.as_view(), name=f'async-{prefix}-detail'),
+    ]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api_root, name='api-root'),
+    path('api/_metrics', metrics_view, name='metrics'),
+    path('api/_health', health, name='health'),
+    path('api/search/', search, name='search'),
+    path('api/changes/', changes, name='changes'),
+    path('api/async/', include(async_urls)),
     path('api/', include(router.urls)),
 ]
@@ -1,51 +1,506 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+import copy
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import status, viewsets
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
+from .base_url import base_url
+from .caching import CachedResponseMixin, conditional_response, etag_for, invalidate
+from .changes import (
+    ACTIVITIES, LEADERBOARD, TEAMS, USERS, WORKOUTS, ChangesExpired, changes_since, latest_token,
+    record_changes, record_created, record_email_change, record_team_members, record_user_deleted,
+)
+from .exports import activity_rows, leaderboard_rows, streaming_export
+from .filters import filter_activities, filter_workouts
+from .leaderboard import ranked_leaderboard, record_activity_batch, record_activity_change
+from .mongo_pool import pool_stats
+from .recommendations import recommend_workouts
+from .search import count_activity_types, get_index
+from .rollups import record_rollup_batch, record_rollup_change, remove_user_rollups
+from .teams import move_user_to_team
+from .workouts import workout_deleted, workout_saved
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, Workout
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer,
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer, MoveTeamSerializer,
+    RankedLeaderboardQuerySerializer, RankedLeaderboardSerializer,
+    ActivityQuerySerializer, ActivityRollupSerializer, StatsQuerySerializer,
+    LeaderboardExportQuerySerializer, SearchQuerySerializer, WorkoutQuerySerializer,
+    RecommendationQuerySerializer, ChangesQuerySerializer
 )
 
+EXPORT_URL_PATH = r'export/(?P<fmt>ndjson|csv)'
+
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+class UserViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_resource = 'users'
+    queryset = User.objects.select_related('membership__team')
     serializer_class = UserSerializer
+    ordering = ('id',)
+
+    @staticmethod
+    def record_write(email, user):
+        """Log a user write; a new email also changes the rows that show it."""
+        record_changes(USERS, [user.pk])
+        if user.email != email:
+            record_email_change(user.pk)
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        record_changes(USERS, [serializer.save().pk])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        email = serializer.instance.email
+        self.record_write(email, serializer.save())
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        record_user_deleted(instance.pk)
+        remove_user_rollups([instance.pk])
+        instance.delete()
+
+    @action(detail=True, methods=['post'], url_path='move-team')
+    def move_team(self, request, pk=None):
+        """
+        Update the user's own fields and move them to ``team`` in one transaction.
+
+        Body: any of ``name``/``email``/``age`` plus ``team`` (a team id, or
+        null for no team). Returns the user and both affected teams.
+        """
+        move = MoveTeamSerializer(data=request.data)
+        move.is_valid(raise_exception=True)
+        with transaction.atomic():
+            user = self.get_object()
+            email = user.email
+            serializer = self.get_serializer(user, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            user = serializer.save()
+            self.record_write(email, user)
+            to_team = move.validated_data['team']
+            from_team = move_user_to_team(user, to_team)
+        invalidate('users')
 
+        teams = {
+            team.pk: team
+            for team in Team.objects.prefetch_related('memberships__user').filter(
+                pk__in=[t.pk for t in (from_team, to_team) if t is not None]
+            )
+        }
+        user = self.get_queryset().get(pk=user.pk)
+        return Response({
+            'user': UserSerializer(user).data,
+            'from_team': TeamSerializer(teams[from_team.pk]).data if from_team else None,
+            'to_team': TeamSerializer(teams[to_team.pk]).data if to_team else None,
+        })
 
-class TeamViewSet(viewsets.ModelViewSet):
-    queryset = Team.objects.all()
+    @action(detail=True, methods=['get'], url_path='recommended-workouts')
+    def recommended_workouts(self, request, pk=None):
+        """
+        Workouts ranked for the user: similarity of each workout to the
+        activity types of their latest activities, and how close its
+        estimated length is to their usual session. Takes ``limit``.
+        """
+        query = RecommendationQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(recommend_workouts(self.get_object(), **query.validated_data))
+
+
+class TeamViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_resource = 'teams'
+    queryset = Team.objects.prefetch_related('memberships__user')
     serializer_class = TeamSerializer
+    ordering = ('id',)
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        record_changes(TEAMS, [serializer.save().pk])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        team = serializer.save()
+        record_changes(TEAMS, [team.pk])
+        # Members show the team's name
+        record_team_members(team.pk)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        record_team_members(instance.pk)
+        record_changes(TEAMS, [instance.pk], deleted=True)
+        instance.delete()
 
-class ActivityViewSet(viewsets.ModelViewSet):
-    queryset = Activity.objects.all()
+
+class ActivityViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_resource = 'activities'
+    queryset = Activity.objects.select_related('user')
     serializer_class = ActivitySerializer
+    ordering = ('-date', '-id')
+    # Columns each serializer field needs when ``?fields=`` projects the list
+    projection = {
+        'id': ('id',),
+        'user': ('user__email',),
+        'activity_type': ('activity_type',),
+        'duration': ('duration',),
+        'date': ('date',),
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        queryset, self.projected_fields = self.filter_list(queryset, self.request.query_params)
+        return queryset
+
+    @classmethod
+    def filter_list(cls, queryset, query_params):
+        """
+        Apply the list filters: ``user`` (email), ``activity_type``,
+        ``date_from``, ``date_to``, ``min_duration`` and ``fields``
+        (comma-separated). Returns the queryset and the projected fields.
+        """
+        query = ActivityQuerySerializer(data=query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        fields = params.pop('fields', None)
+        queryset = filter_activities(queryset, **params)
+        if fields:
+            # Always load the ordering columns the paginator reads back
+            columns = {'id', 'date'}
+            for name in fields:
+                columns.update(cls.projection[name])
+            if 'user' not in fields:
+                # A deferred foreign key can't also be joined
+                queryset = queryset.select_related(None)
+            queryset = queryset.only(*columns)
+        return queryset, fields
 
+    def get_serializer(self, *args, **kwargs):
+        if getattr(self, 'projected_fields', None):
+            kwargs.setdefault('fields', self.projected_fields)
+        return super().get_serializer(*args, **kwargs)
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
-    queryset = Leaderboard.objects.all()
+    @staticmethod
+    def record_write(before=None, after=None):
+        """Log a write and apply its score and rollup deltas; runs inside the write's transaction."""
+        if after is not None:
+            record_changes(ACTIVITIES, [after.pk])
+        else:
+            record_changes(ACTIVITIES, [before.pk], deleted=True)
+        record_activity_change(before=before, after=after)
+        record_rollup_change(before=before, after=after)
+        types = Counter()
+        if before is not None:
+            types[before.activity_type] -= 1
+        if after is not None:
+            types[after.activity_type] += 1
+        transaction.on_commit(lambda: count_activity_types(types))
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        self.record_write(after=serializer.save())
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        before = copy.copy(serializer.instance)
+        self.record_write(before=before, after=serializer.save())
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        self.record_write(before=instance)
+        instance.delete()
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a list of activities in batches.
+
+        Items are validated independently: valid ones are inserted with
+        ``bulk_create`` ``batch_size`` at a time (``?batch_size=``, default
+        ``OCTOFIT_BULK_BATCH_SIZE``), each batch together with a single
+        leaderboard and rollup update. Invalid ones are reported by index.
+        """
+        if isinstance(request.data, list) and len(request.data) > settings.OCTOFIT_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {settings.OCTOFIT_BULK_MAX_ITEMS} activities per request.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            batch_size = max(1, int(request.query_params.get('batch_size', settings.OCTOFIT_BULK_BATCH_SIZE)))
+        except ValueError:
+            return Response({'detail': 'batch_size must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        valid, errors = serializer.partition()
+        for start in range(0, len(valid), batch_size):
+            batch = [Activity(**item) for item in valid[start:start + batch_size]]
+            with transaction.atomic():
+                record_created(ACTIVITIES, Activity, batch, Activity.objects.bulk_create)
+                record_activity_batch(batch)
+                record_rollup_batch(batch)
+            count_activity_types(Counter(activity.activity_type for activity in batch))
+        if valid:
+            self.invalidate_cache()
+
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif valid:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': len(valid), 'errors': errors}, status=response_status)
+
+    @action(detail=False, methods=['get'], url_path=EXPORT_URL_PATH)
+    def export(self, request, fmt):
+        """
+        Stream every matching activity as NDJSON or CSV, newest first.
+
+        Takes the list filters (``user``, ``activity_type``, ``date_from``,
+        ``date_to``, ``min_duration``); rows are read with a chunked
+        ``iterator()`` and not paginated.
+        """
+        query = ActivityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        params.pop('fields', None)
+        queryset = filter_activities(Activity.objects.order_by(*self.ordering), **params)
+        return streaming_export(
+            fmt, 'activities', ['id', 'user', 'activity_type', 'duration', 'date'],
+            activity_rows(queryset, settings.OCTOFIT_EXPORT_CHUNK_SIZE),
+        )
+
+
+class LeaderboardViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_resource = 'leaderboard'
+    queryset = Leaderboard.objects.select_related('user')
     serializer_class = LeaderboardSerializer
+    ordering = ('-score', 'id')
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        record_changes(LEADERBOARD, [serializer.save().pk])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        record_changes(LEADERBOARD, [serializer.save().pk])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        record_changes(LEADERBOARD, [instance.pk], deleted=True)
+        instance.delete()
+
+    @action(detail=False, methods=['get'])
+    def ranked(self, request):
+        """Leaderboard joined with names, teams and activity totals, best first."""
+        query = RankedLeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return self.cached_response(request, lambda: Response(
+            RankedLeaderboardSerializer(ranked_leaderboard(**query.validated_data), many=True).data
+        ))
 
+    @action(detail=False, methods=['get'], url_path=EXPORT_URL_PATH)
+    def export(self, request, fmt):
+        """Stream the ranked leaderboard as NDJSON or CSV; takes ``top`` and ``team``."""
+        query = LeaderboardExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        entries = Leaderboard.objects.all()
+        if 'team' in query.validated_data:
+            entries = entries.filter(user__membership__team=query.validated_data['team'])
+        return streaming_export(
+            fmt, 'leaderboard', ['rank', 'user', 'name', 'team', 'score'],
+            leaderboard_rows(entries, settings.OCTOFIT_EXPORT_CHUNK_SIZE, top=query.validated_data.get('top')),
+        )
 
-class WorkoutViewSet(viewsets.ModelViewSet):
-    queryset = Workout.objects.all()
+
+class StatsViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Pre-aggregated activity totals per user or per team, by day or by week.
+
+    Filters: ``period`` (day|week, default week), ``user`` (email) or ``team``
+    (id), ``scope`` (user|team) when neither is given, ``date_from`` and
+    ``date_to`` on the period start.
+    """
+    cache_resource = 'stats'
+    queryset = ActivityRollup.objects.select_related('user')
+    serializer_class = ActivityRollupSerializer
+    ordering = ('period_start', 'id')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        query = StatsQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        queryset = queryset.filter(period=params['period'])
+        if params['scope'] == 'user':
+            queryset = queryset.filter(team__isnull=True)
+        else:
+            queryset = queryset.filter(user__isnull=True)
+        if 'user' in params:
+            queryset = queryset.filter(user__email=params['user'])
+        if 'team' in params:
+            queryset = queryset.filter(team_id=params['team'])
+        if 'date_from' in params:
+            queryset = queryset.filter(period_start__gte=params['date_from'])
+        if 'date_to' in params:
+            queryset = queryset.filter(period_start__lte=params['date_to'])
+        return queryset
+
+
+class WorkoutViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_resource = 'workouts'
+    queryset = Workout.objects.prefetch_related('exercises')
     serializer_class = WorkoutSerializer
+    ordering = ('id',)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        queryset, _ = self.filter_list(queryset, self.request.query_params)
+        return queryset
+
+    @classmethod
+    def filter_list(cls, queryset, query_params):
+        """
+        Apply the list filters: ``exercise`` (exact name), ``min_sets`` and
+        ``min_duration_seconds``, all on the same exercise. Returns the
+        queryset and no field projection.
+        """
+        query = WorkoutQuerySerializer(data=query_params)
+        query.is_valid(raise_exception=True)
+        return filter_workouts(queryset, **query.validated_data), None
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        workout_saved(serializer.save())
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        workout_saved(serializer.save())
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        workout_deleted(pk)
+
+
+@api_view(['GET'])
+def search(request):
+    """
+    Ranked full-text search over workouts (name, description and exercise
+    names) and activity types.
+
+    Query: ``q`` (required; the last word also matches as a prefix),
+    ``type`` (workout|activity_type) and ``limit`` (1-100, default 20).
+    """
+    query = SearchQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    results = []
+    for score, kind, payload in get_index().search(params['q'], kind=params.get('type'), limit=params['limit']):
+        results.append(dict(payload, type=kind, score=round(score, 4)))
+    return Response({'query': params['q'], 'results': results})
+
+
+# Where the change feed reads the current state of each resource from
+CHANGE_FEED_VIEWSETS = {
+    USERS: UserViewSet,
+    TEAMS: TeamViewSet,
+    ACTIVITIES: ActivityViewSet,
+    LEADERBOARD: LeaderboardViewSet,
+    WORKOUTS: WorkoutViewSet,
+}
+
+
+@api_view(['GET'])
+def changes(request):
+    """
+    Delta sync: users, teams, activities, leaderboard entries and workouts
+    changed after the token ``since``.
+
+    Each change holds the object as the list endpoint shows it now, or
+    ``deleted`` with no data for a delete. Pass ``next`` back as ``since``
+    while ``has_more``. Without ``since`` only the current token is
+    returned; take it before a full fetch. Answers 410 Gone when changes
+    after ``since`` were pruned or the log was reset. ``limit`` (1-1000, default 500) caps the
+    log entries read per page.
+    """
+    query = ChangesQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    since = query.validated_data.get('since')
+    if since is None:
+        return Response({'changes': [], 'next': latest_token(), 'has_more': False})
+    try:
+        entries, next_token, has_more = changes_since(since, query.validated_data['limit'])
+    except ChangesExpired:
+        return Response(
+            {'detail': 'Changes after this token are no longer available; a full resync is required.'},
+            status=status.HTTP_410_GONE,
+        )
+
+    upserts = defaultdict(list)
+    for resource, object_id, deleted in entries:
+        if not deleted:
+            upserts[resource].append(object_id)
+    current = {}
+    for resource, ids in upserts.items():
+        viewset = CHANGE_FEED_VIEWSETS[resource]
+        for item in viewset.serializer_class(viewset.queryset.filter(pk__in=ids), many=True).data:
+            current[resource, item['id']] = item
+    results = []
+    for resource, object_id, _ in entries:
+        # Gone by now even if the logged change was a write
+        data = current.get((resource, object_id))
+        results.append({'resource': resource, 'id': object_id, 'deleted': data is None, 'data': data})
+    return Response({'changes': results, 'next': next_token, 'has_more': has_more})
+
+
+API_ROOT_RESOURCES = ('users', 'teams', 'activities', 'leaderboard', 'workouts', 'stats', 'search', 'changes')
+
+
+@lru_cache(maxsize=32)
+def api_root_payload(base):
+    """The API root for ``base`` and its ETag, built once per base URL."""
+    data = {resource: f'{base}/api/{resource}/' for resource in API_ROOT_RESOURCES}
+    return data, etag_for(data)
 
 
 @api_view(['GET'])
 def api_root(request):
-    import os
-    codespace_name = os.environ.get('CODESPACE_NAME')
-    if codespace_name:
-        base_url = f"https://{codespace_name}-8000.app.github.dev"
+    return conditional_response(request, *api_root_payload(base_url(request)))
+
+
+def database_ping():
+    """Round-trip time of a trivial database command, in milliseconds."""
+    started = time.perf_counter()
+    connection.ensure_connection()
+    # djongo's connection is a pymongo MongoClient (or Database)
+    client = getattr(connection.connection, 'client', connection.connection)
+    if hasattr(client, 'admin'):
+        client.admin.command('ping')
     else:
-        base_url = "http://localhost:8000"
-
-    return Response({
-        'users': f'{base_url}/api/users/',
-        'teams': f'{base_url}/api/teams/',
-        'activities': f'{base_url}/api/activities/',
-        'leaderboard': f'{base_url}/api/leaderboard/',
-        'workouts': f'{base_url}/api/workouts/',
-    })
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    return (time.perf_counter() - started) * 1000
+
+
+@api_view(['GET'])
+def health(request):
+    """Database reachability and pymongo pool usage; 503 when the database is down."""
+    try:
+        database = {'ok': True, 'latency_ms': round(database_ping(), 2)}
+    except Exception as exc:  # any driver error means the database is unusable
+        database = {'ok': False, 'error': str(exc)}
+    return Response(
+        {
+            'status': 'ok' if database['ok'] else 'unavailable',
+            'database': dict(database, vendor=connection.vendor),
+            'pool': pool_stats.snapshot(),
+        },
+        status=status.HTTP_200_OK if database['ok'] else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
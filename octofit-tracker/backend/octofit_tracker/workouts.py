@@ -0,0 +1,37 @@
+from django.db import transaction
+from . import recommendations, search
+from .changes import WORKOUTS, record_changes
+from .models import WorkoutExercise
+
+
+@transaction.atomic
+def set_workout_exercises(workout, exercises):
+    """
+    Make ``exercises`` (dicts of ``WorkoutExercise`` fields, in order) the
+    exact exercise list of ``workout``.
+    """
+    WorkoutExercise.objects.filter(workout=workout).delete()
+    WorkoutExercise.objects.bulk_create([
+        WorkoutExercise(workout=workout, position=position, **fields)
+        for position, fields in enumerate(exercises)
+    ])
+
+
+def workout_saved(workout):
+    """
+    Log a workout write and bring this process's search index and
+    recommendation features up to date with it.
+    """
+    record_changes(WORKOUTS, [workout.pk])
+    # Queried, not read from a prefetch the write may have made stale
+    exercises = list(
+        WorkoutExercise.objects.filter(workout=workout).values_list('name', 'sets', 'reps', 'duration_seconds')
+    )
+    search.index_workout(workout, [exercise[0] for exercise in exercises])
+    recommendations.update_workout(workout, exercises)
+
+
+def workout_deleted(pk):
+    record_changes(WORKOUTS, [pk], deleted=True)
+    search.unindex_workout(pk)
+    recommendations.remove_workout(pk)
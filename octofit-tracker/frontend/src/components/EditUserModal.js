@@ -4,16 +4,6 @@ const API_BASE = process.env.REACT_APP_CODESPACE_NAME
   ? `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev`
   : 'http://localhost:8000';
 
-function parseMembers(members) {
-  if (Array.isArray(members)) return members;
-  try {
-    const parsed = JSON.parse(members);
-    return Array.isArray(parsed) ? parsed : [];
-  } catch {
-    return [];
-  }
-}
-
 /**
  * Modal for editing a user's personal details and team membership.
  * Props:
@@ -28,17 +18,14 @@ function EditUserModal({ user, teams, onSave, onClose }) {
     email: user.email || '',
     age:   user.age   || '',
   });
-  const [teamId, setTeamId] = useState('');
+  const [teamId, setTeamId] = useState(user.team || '');
   const [saving, setSaving] = useState(false);
   const [error, setError]   = useState(null);
 
-  // Pre-select the team that currently contains this user's email
+  // Pre-select the team the user currently belongs to
   useEffect(() => {
-    const current = teams.find((t) =>
-      parseMembers(t.members).includes(user.email)
-    );
-    setTeamId(current ? current.id : '');
-  }, [user.email, teams]);
+    setTeamId(user.team || '');
+  }, [user.team]);
 
   function handleChange(e) {
     setForm((prev) => ({ ...prev, [e.target.name]: e.target.value }));
@@ -50,71 +37,19 @@ function EditUserModal({ user, teams, onSave, onClose }) {
     setError(null);
 
     try {
-      // 1. PATCH user fields
-      const userRes = await fetch(`${API_BASE}/api/users/${user.id}/`, {
-        method: 'PATCH',
+      // User fields and team membership are updated in one server transaction
+      const res = await fetch(`${API_BASE}/api/users/${user.id}/move-team/`, {
+        method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           name:  form.name,
           email: form.email,
           age:   parseInt(form.age, 10),
+          team:  teamId || null,
         }),
       });
-      if (!userRes.ok) throw new Error(`User update failed (HTTP ${userRes.status})`);
-      const updatedUser = await userRes.json();
-
-      // 2. Update team membership
-      const oldEmail = user.email;
-      const newEmail = form.email;
-
-      // Find the team the user currently belongs to
-      const oldTeam = teams.find((t) =>
-        parseMembers(t.members).includes(oldEmail)
-      );
-      const oldTeamId = oldTeam ? oldTeam.id : '';
-
-      if (oldTeamId !== teamId) {
-        // Remove from old team
-        if (oldTeam) {
-          const updatedMembers = parseMembers(oldTeam.members).filter(
-            (m) => m !== oldEmail
-          );
-          await fetch(`${API_BASE}/api/teams/${oldTeam.id}/`, {
-            method: 'PATCH',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ members: JSON.stringify(updatedMembers) }),
-          });
-        }
-
-        // Add to new team
-        if (teamId) {
-          const newTeam = teams.find((t) => t.id === teamId);
-          if (newTeam) {
-            const updatedMembers = [
-              ...parseMembers(newTeam.members).filter((m) => m !== oldEmail),
-              newEmail,
-            ];
-            await fetch(`${API_BASE}/api/teams/${newTeam.id}/`, {
-              method: 'PATCH',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ members: JSON.stringify(updatedMembers) }),
-            });
-          }
-        }
-      } else if (oldTeamId === teamId && oldEmail !== newEmail && teamId) {
-        // Email changed but same team — update email in members list
-        const sameTeam = teams.find((t) => t.id === teamId);
-        if (sameTeam) {
-          const updatedMembers = parseMembers(sameTeam.members).map((m) =>
-            m === oldEmail ? newEmail : m
-          );
-          await fetch(`${API_BASE}/api/teams/${sameTeam.id}/`, {
-            method: 'PATCH',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ members: JSON.stringify(updatedMembers) }),
-          });
-        }
-      }
+      if (!res.ok) throw new Error(`User update failed (HTTP ${res.status})`);
+      const { user: updatedUser } = await res.json();
 
       onSave(updatedUser);
     } catch (err) {
@@ -2,18 +2,9 @@ import React, { useEffect, useState } from 'react';
 import LoadingSpinner from './LoadingSpinner';
 
 const CODESPACE = process.env.REACT_APP_CODESPACE_NAME;
-const API_BASE = CODESPACE
-  ? `https://${CODESPACE}-8000.app.github.dev`
-  : 'http://localhost:8000';
-const LEADERBOARD_ENDPOINT = CODESPACE
-  ? `https://${CODESPACE}-8000.app.github.dev/api/leaderboard/`
-  : 'http://localhost:8000/api/leaderboard/';
-
-function parseMembers(members) {
-  if (Array.isArray(members)) return members;
-  try { const p = JSON.parse(members); return Array.isArray(p) ? p : []; }
-  catch { return []; }
-}
+const RANKED_ENDPOINT = CODESPACE
+  ? `https://${CODESPACE}-8000.app.github.dev/api/leaderboard/ranked/`
+  : 'http://localhost:8000/api/leaderboard/ranked/';
 
 function getInitials(name = '') {
   return name.split(' ').map((w) => w[0]).join('').toUpperCase().slice(0, 2) || '?';
@@ -25,41 +16,12 @@ function Leaderboard() {
   const [error, setError]     = useState(null);
 
   useEffect(() => {
-    Promise.all([
-      fetch(LEADERBOARD_ENDPOINT).then((r) => r.json()),
-      fetch(`${API_BASE}/api/users/`).then((r) => r.json()),
-      fetch(`${API_BASE}/api/teams/`).then((r) => r.json()),
-      fetch(`${API_BASE}/api/activities/`).then((r) => r.json()),
-    ])
-      .then(([lbData, usersData, teamsData, actData]) => {
-        const users      = Array.isArray(usersData) ? usersData : usersData.results || [];
-        const teams      = Array.isArray(teamsData) ? teamsData : teamsData.results || [];
-        const activities = Array.isArray(actData)   ? actData   : actData.results   || [];
-        const lb         = Array.isArray(lbData)    ? lbData    : lbData.results    || [];
-
-        const emailToName = {};
-        users.forEach((u) => { emailToName[u.email] = u.name; });
-
-        const emailToTeam = {};
-        teams.forEach((t) => {
-          parseMembers(t.members).forEach((email) => { emailToTeam[email] = t.name; });
-        });
-
-        const emailToCalories = {};
-        activities.forEach((a) => {
-          emailToCalories[a.user] = (emailToCalories[a.user] || 0) + (a.duration || 0) * 10;
-        });
-
-        const enriched = lb
-          .map((entry) => ({
-            ...entry,
-            displayName: emailToName[entry.user] || entry.user,
-            team:        emailToTeam[entry.user]  || null,
-            calories:    Math.round(emailToCalories[entry.user] || 0),
-          }))
-          .sort((a, b) => b.score - a.score);
-
-        setEntries(enriched);
+    // Names, teams and activity totals are joined and ranked by the backend
+    fetch(RANKED_ENDPOINT)
+      .then((r) => { if (!r.ok) throw new Error(`HTTP ${r.status}`); return r.json(); })
+      .then((data) => {
+        const rows = Array.isArray(data) ? data : data.results || [];
+        setEntries(rows.map((row) => ({ ...row, displayName: row.name || row.user })));
         setLoading(false);
       })
       .catch((err) => { setError(err.message); setLoading(false); });
@@ -111,8 +73,8 @@ function Leaderboard() {
       {/* Remaining rows */}
       {rest.length > 0 && (
         <div style={{ display: 'flex', flexDirection: 'column', gap: '0.5rem' }}>
-          {rest.map((entry, i) => {
-            const rank = i + 4;
+          {rest.map((entry) => {
+            const rank = entry.rank;
             return (
               <div key={entry.user} className="octo-lb-row">
                 <span className="octo-lb-rank">#{rank}</span>
@@ -10,16 +10,6 @@ const TEAMS_ENDPOINT = CODESPACE
   ? `https://${CODESPACE}-8000.app.github.dev/api/teams/`
   : 'http://localhost:8000/api/teams/';
 
-function parseMembers(members) {
-  if (Array.isArray(members)) return members;
-  try {
-    const parsed = JSON.parse(members);
-    return Array.isArray(parsed) ? parsed : [];
-  } catch {
-    return [];
-  }
-}
-
 function Users() {
   const [users, setUsers]       = useState([]);
   const [teams, setTeams]       = useState([]);
@@ -46,12 +36,6 @@ function Users() {
 
   useEffect(() => { loadData(); }, [loadData]);
 
-  // Find the team name for a given user email
-  function teamForUser(email) {
-    const found = teams.find((t) => parseMembers(t.members).includes(email));
-    return found ? found.name : '—';
-  }
-
   function handleSave(updatedUser) {
     // Refresh both users and teams to reflect membership changes
     setEditing(null);
@@ -85,7 +69,7 @@ function Users() {
               <td>{user.name}</td>
               <td>{user.email}</td>
               <td>{user.age}</td>
-              <td>{teamForUser(user.email)}</td>
+              <td>{user.team_name || '—'}</td>
               <td>
                 <button
                   className="btn btn-sm btn-outline-primary"
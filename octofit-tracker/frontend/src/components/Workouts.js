@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import LoadingSpinner from './LoadingSpinner';
 
-// exercises arrives as a JSON-encoded string from the backend TextField
+// exercises arrives as a list; older backends sent it JSON-encoded
 function parseExercises(exercises) {
   if (Array.isArray(exercises)) return exercises;
   try {
@@ -16,7 +16,11 @@ function exerciseLabel(e) {
   let detail = e.name;
   if (e.sets)             detail += ` · ${e.sets} sets`;
   if (e.reps)             detail += ` × ${e.reps} reps`;
-  if (e.duration_seconds) detail += ` · ${e.duration_seconds}s`;
+  if (e.duration_seconds) {
+    detail += e.duration_seconds % 60 === 0
+      ? ` · ${e.duration_seconds / 60} min`
+      : ` · ${e.duration_seconds}s`;
+  }
   if (e.duration_minutes) detail += ` · ${e.duration_minutes} min`;
   return detail;
 }